@@ -0,0 +1,136 @@
+"""
+Dashboard / historial con tablas grandes (1M y 10M señales).
+
+    python bench/dashboard_rows.py [filas ...]      # default: 1000000 10000000
+
+Por cada tamaño carga una base SQLite nueva (en un directorio temporal)
+con señales sintéticas repartidas en los últimos 30 días: 20 símbolos,
+5 timeframes, BUY/SELL, y un símbolo raro (1 cada 1000 filas). Después
+mide p50/p99 de:
+  - history.fetch_page: sin filtros, cada filtro, los tres, el símbolo
+    raro, una página profunda (before_id a mitad de tabla) y since=24h,
+  - counters.totals (lo que usa el dashboard) contra el COUNT(*) GROUP BY
+    side de antes,
+y corre explain_dashboard (sale con código 1 si algún plan no pasa).
+
+Con DATABASE_URL=postgres://... usa esa base (¡descartable!): agrega las
+filas que falten para llegar a cada tamaño.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import counters    # noqa: E402
+import db          # noqa: E402
+import history     # noqa: E402
+import partitions  # noqa: E402
+
+SYMBOLS = [f"SYM{i:02d}USDT" for i in range(20)]
+TFS = ["1m", "5m", "15m", "1h", "4h"]
+RARE = "RAREUSDT"
+LOAD_CHUNK = 50_000
+REPEAT = 50
+
+INSERT_SQL = (
+    "INSERT INTO signals(ts_utc,symbol,tf,side,price,tp,sl,reason,payload,ts,idem_key) "
+    "VALUES(?,?,?,?,?,?,?,?,?,?,?)"
+)
+
+
+def _count() -> int:
+    with db.conn() as c:
+        return c.execute("SELECT COUNT(*) n FROM signals").fetchone()["n"]
+
+
+def load(n: int):
+    have = _count()
+    if have >= n:
+        return
+    rnd = random.Random(n)
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=30)
+    if db._is_postgres():
+        # las particiones viejas pueden no existir: todo en el mes actual
+        start = max(start, now.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
+    step = (now - start) / n
+    t0 = time.perf_counter()
+    for lo in range(have, n, LOAD_CHUNK):
+        rows = []
+        for i in range(lo, min(n, lo + LOAD_CHUNK)):
+            ts = start + step * i
+            price = round(rnd.uniform(1, 50_000), 2)
+            rows.append((
+                ts.isoformat(),
+                RARE if i % 1000 == 0 else rnd.choice(SYMBOLS),
+                rnd.choice(TFS),
+                rnd.choice(("BUY", "SELL")),
+                price, round(price * 1.02, 2), round(price * 0.99, 2),
+                "bench", None, db.ts_param(ts), None,
+            ))
+        with db.conn() as c:
+            c.executemany(INSERT_SQL, rows)
+            c.commit(strict=True)
+    counters.rebuild()
+    print(f"  carga {n - have} filas en {time.perf_counter() - t0:.1f}s")
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def timed(fn) -> str:
+    lat = []
+    for _ in range(REPEAT):
+        with db.conn(readonly=True) as c:
+            t0 = time.perf_counter()
+            fn(c)
+            lat.append((time.perf_counter() - t0) * 1000)
+    return f"p50 {_pct(lat, 0.50):8.2f} ms   p99 {_pct(lat, 0.99):8.2f} ms"
+
+
+def run(n: int) -> bool:
+    if not db._is_postgres():
+        db.DB_PATH = os.path.join(tempfile.mkdtemp(), f"dash-{n}.db")
+    db.migrate()
+    partitions.ensure_partitions()
+    load(n)
+    print(f"== {n:,} filas ({'postgres' if db._is_postgres() else 'sqlite'})")
+
+    with db.conn(readonly=True) as c:
+        mid = c.execute("SELECT MAX(id) m FROM signals").fetchone()["m"] // 2
+    since = datetime.now(timezone.utc) - timedelta(hours=24)
+    cases = [
+        ("sin filtros", {}),
+        ("symbol", {"symbol": "SYM03USDT"}),
+        ("tf", {"tf": "15m"}),
+        ("side", {"side": "SELL"}),
+        ("symbol+tf+side", {"symbol": "SYM03USDT", "tf": "15m", "side": "SELL"}),
+        ("símbolo raro", {"symbol": RARE}),
+        ("página profunda", {"before_id": mid}),
+        ("since 24h", {"since": since}),
+    ]
+    for name, f in cases:
+        print(f"  fetch_page {name:16s} {timed(lambda c, f=f: history.fetch_page(c, **f))}")
+    print(f"  counters.totals             {timed(counters.totals)}")
+    legacy = "SELECT side, COUNT(*) n FROM signals GROUP BY side"
+    print(f"  COUNT(*) GROUP BY side      {timed(lambda c: c.execute(legacy).fetchall())}")
+
+    bad = [sql for sql, _, ok in db.explain_dashboard() if not ok]
+    for sql in bad:
+        print(f"  ❌ plan: {sql}")
+    return not bad
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1_000_000, 10_000_000]
+    ok = all([run(n) for n in sizes])
+    sys.exit(0 if ok else 1)
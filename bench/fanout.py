@@ -0,0 +1,99 @@
+"""
+Fan-out de una señal a miles de suscriptores contra un stub de Telegram.
+
+    python bench/fanout.py [suscripciones] [paralelismo]
+
+Carga `suscripciones` filas en una base SQLite temporal: un tercio con
+filtro exacto (BTCUSDT 15m BUY), un tercio con comodines ('*' en algún
+campo) y un tercio que no matchea (ETHUSDT / SELL). Resuelve los chats con
+SubscriptionIndex.match y entrega con Fanout.deliver + notifier.send_message.
+
+Chequea (sale con código 1 si no):
+  - cada chat que matchea recibió exactamente un mensaje y ningún otro chat
+    recibió nada,
+  - los requests en vuelo nunca superaron el paralelismo configurado.
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tg_stub  # noqa: E402  (bench/, al lado de este script)
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+PARALLELISM = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+stub = tg_stub.start(delay=0.005, track_chats=True)
+
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "fanout.db")
+os.environ["TELEGRAM_API_BASE"] = stub.url
+os.environ["TELEGRAM_BOT_TOKEN"] = "bench"
+os.environ["TELEGRAM_POOL_SIZE"] = str(PARALLELISM)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import db             # noqa: E402
+import notifier       # noqa: E402
+import subscriptions  # noqa: E402
+
+WILDCARDS = [("*", "15m", "BUY"), ("BTCUSDT", "*", "BUY"), ("BTCUSDT", "15m", "*"), ("*", "*", "*")]
+MISSES = [("ETHUSDT", "15m", "BUY"), ("BTCUSDT", "15m", "SELL"), ("BTCUSDT", "1h", "*")]
+
+
+def load(n: int) -> set:
+    """Crea las suscripciones y devuelve los chats que deberían recibir."""
+    rows, expected = [], set()
+    now = db.utc_now()
+    for i in range(n):
+        chat = str(100000 + i)
+        if i % 3 == 0:
+            sym, tf, side = "BTCUSDT", "15m", "BUY"
+        elif i % 3 == 1:
+            sym, tf, side = WILDCARDS[i % len(WILDCARDS)]
+        else:
+            sym, tf, side = MISSES[i % len(MISSES)]
+        if i % 3 != 2:
+            expected.add(chat)
+        rows.append((chat, sym, tf, side, now))
+    with db.conn() as c:
+        c.executemany(
+            "INSERT INTO subscriptions(chat_id,symbol,tf,side,active,created_at) VALUES(?,?,?,?,1,?)", rows
+        )
+        c.commit(strict=True)
+    return expected
+
+
+if __name__ == "__main__":
+    db.migrate()
+    expected = load(N)
+    index = subscriptions.SubscriptionIndex(refresh=3600)
+    fanout = subscriptions.Fanout(PARALLELISM)
+
+    t0 = time.perf_counter()
+    chats = index.match("BTCUSDT", "15m", "BUY")
+    match_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    res = fanout.deliver(chats, "🟢 BUY BTCUSDT 15m (bench)", notifier.send_message)
+    dt = time.perf_counter() - t0
+
+    print(f"{N} suscripciones, {len(chats)} matchean (match {match_ms:.2f} ms)")
+    print(f"entregados {res['sent']} en {dt:.2f}s = {int(res['sent'] / dt)} msg/s, "
+          f"pico en vuelo {stub.max_in_flight}/{PARALLELISM}, conexiones {len(stub.ports)}")
+
+    errors = []
+    if chats != expected:
+        errors.append(f"match: {len(chats ^ expected)} chats de diferencia")
+    if res["failed"]:
+        errors.append(f"{res['failed']} envíos fallidos")
+    extra = [chat for chat, n in stub.chats.items() if n != 1 or chat not in expected]
+    missing = expected - set(stub.chats)
+    if extra or missing:
+        errors.append(f"{len(missing)} chats sin mensaje, {len(extra)} con mensajes de más o ajenos")
+    if stub.max_in_flight > PARALLELISM:
+        errors.append(f"en vuelo {stub.max_in_flight} > paralelismo {PARALLELISM}")
+    for e in errors:
+        print("❌", e)
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,64 @@
+"""
+Verificaciones de nonce por segundo, por backend (objetivo: 10k+/s).
+
+    python bench/nonce_throughput.py [n] [backend ...]
+
+Por defecto corre memory y shm; `db` usa SQLite en un archivo temporal
+(o DATABASE_URL si está definida). Cada verificación es un nonce nuevo
++ un replay del anterior (el replay tiene que volver True). Sale con
+código 1 si memory o shm quedan por debajo de 10k/s.
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import nonces  # noqa: E402
+
+TARGET = 10_000
+MAX_SKEW = 300
+
+
+def run(backend: str, n: int) -> dict:
+    opts = {"max_entries": 2 * n, "shm_slots": 4 * n}
+    if backend == "shm":
+        opts["shm_path"] = os.path.join(tempfile.mkdtemp(), "nonces.shm")
+    if backend == "db":
+        import db
+        db.migrate()
+    store = nonces.make_nonce_store(backend, MAX_SKEW, **opts)
+    ids = [uuid.uuid4().hex for _ in range(n)]
+    ts = int(time.time())
+
+    t0 = time.perf_counter()
+    prev = None
+    for nonce in ids:
+        assert store.seen(nonce, ts) is False
+        if prev is not None:
+            assert store.seen(prev, ts) is True
+        prev = nonce
+    dt = time.perf_counter() - t0
+    checks = 2 * n - 1
+    return {"checks": checks, "per_sec": int(checks / dt), "us_per_check": round(dt / checks * 1e6, 2)}
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    backends = sys.argv[2:] or ["memory", "shm"]
+    slow = []
+    for backend in backends:
+        res = run(backend, n if backend != "db" else min(n, 5_000))
+        print(f"{backend:6s} {res}")
+        if backend != "db" and res["per_sec"] < TARGET:
+            slow.append(backend)
+    if slow:
+        print(f"❌ debajo de {TARGET}/s: {', '.join(slow)}")
+        sys.exit(1)
@@ -0,0 +1,81 @@
+"""
+Throughput del notificador contra un stub HTTP local (no toca Telegram).
+
+    python bench/notifier_throughput.py [n] [concurrencia]
+
+Compara:
+  - antes:  requests.post suelto por mensaje (conexión nueva cada vez)
+  - sync:   notifier.send_message (Session con pool keep-alive), en serie
+  - hilos:  send_message desde `concurrencia` threads (comparten el pool)
+  - async:  asend_message con `concurrencia` en vuelo (aiohttp si está)
+
+Reporta msg/s y cuántas conexiones TCP vio el stub.
+"""
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tg_stub  # noqa: E402  (bench/, al lado de este script)
+
+stub = tg_stub.start()
+os.environ["TELEGRAM_API_BASE"] = stub.url
+os.environ["TELEGRAM_BOT_TOKEN"] = "bench"
+os.environ.setdefault("TELEGRAM_POOL_SIZE", "16")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import requests  # noqa: E402
+import notifier  # noqa: E402
+
+
+def _measure(name: str, n: int, fn):
+    stub.reset()
+    t0 = time.perf_counter()
+    fn(n)
+    dt = time.perf_counter() - t0
+    print(f"{name:6s} {int(n / dt):6d} msg/s  conexiones={len(stub.ports)}")
+
+
+def _legacy(n):
+    url = notifier._url(notifier.TELEGRAM_BOT_TOKEN)
+    for i in range(n):
+        requests.post(url, json={"chat_id": "1", "text": f"m{i}"}, timeout=10).raise_for_status()
+
+
+def _sync(n):
+    for i in range(n):
+        notifier.send_message("1", f"m{i}")
+
+
+def _threads(conc):
+    def run(n):
+        with ThreadPoolExecutor(conc) as pool:
+            list(pool.map(lambda i: notifier.send_message("1", f"m{i}"), range(n)))
+    return run
+
+
+def _async(conc):
+    async def main(n):
+        sem = asyncio.Semaphore(conc)
+
+        async def one(i):
+            async with sem:
+                await notifier.asend_message("1", f"m{i}")
+        await asyncio.gather(*(one(i) for i in range(n)))
+        await notifier.aclose()
+    return lambda n: asyncio.run(main(n))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    conc = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    print(f"stub {notifier.TELEGRAM_API_BASE}  n={n}  concurrencia={conc}  "
+          f"aiohttp={'sí' if notifier.aiohttp else 'no (to_thread)'}")
+    _measure("antes", n, _legacy)
+    _measure("sync", n, _sync)
+    _measure("hilos", n, _threads(conc))
+    _measure("async", n, _async(conc))
@@ -0,0 +1,70 @@
+"""
+Stub HTTP local de la API de Telegram para los benchmarks.
+
+    stub = start()                       # antes de importar notifier
+    os.environ["TELEGRAM_API_BASE"] = stub.url
+
+Responde 200 a cada POST (keep-alive) y registra qué chats recibieron
+cuántos mensajes, las conexiones TCP vistas y el pico de requests en
+vuelo. `delay` (seg) simula la latencia de Telegram.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Stub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    disable_nagle_algorithm = True  # si no, Nagle + delayed ACK: ~40 ms por respuesta
+
+    def do_POST(self):
+        stub = self.server.stub
+        n = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(n)
+        with stub.lock:
+            stub.ports.add(self.client_address[1])
+            stub.in_flight += 1
+            stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+            if stub.track_chats:
+                stub.chats[str(json.loads(body).get("chat_id"))] += 1
+        try:
+            if stub.delay:
+                time.sleep(stub.delay)
+            out = b'{"ok":true,"result":{}}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+        finally:
+            with stub.lock:
+                stub.in_flight -= 1
+
+    def log_message(self, *a):
+        pass
+
+
+class TelegramStub:
+    def __init__(self, delay: float = 0.0, track_chats: bool = False):
+        self.delay = delay
+        self.track_chats = track_chats
+        self.lock = threading.Lock()
+        self.reset()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def reset(self):
+        with self.lock:
+            self.ports = set()
+            self.chats = Counter()
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+
+def start(delay: float = 0.0, track_chats: bool = False) -> TelegramStub:
+    return TelegramStub(delay=delay, track_chats=track_chats)
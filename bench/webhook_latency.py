@@ -0,0 +1,90 @@
+"""
+Latencia de /webhook (p50/p99): con migraciones al arrancar (actual) vs
+el esquema viejo, que corría init_db() -- dos CREATE TABLE IF NOT EXISTS
+en una conexión nueva -- en cada request.
+
+    python bench/webhook_latency.py [n]
+
+SQLite en un archivo temporal; con DATABASE_URL=postgres://... corre
+contra esa base (usa las tablas users/signals, inserta n*2 señales).
+Telegram no se llama (stub).
+"""
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["WEBHOOK_SECRET"] = "bench-secret"
+os.environ["TELEGRAM_CHAT_ID"] = ""
+os.environ.setdefault("WEBHOOK_RATE", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import db      # noqa: E402
+import server  # noqa: E402
+
+
+def _legacy_init_db():
+    # lo que hacía cada request antes de user-002: conexión nueva + DDL
+    users_sql, signals_sql = db.MIGRATIONS[0][3 if db._is_postgres() else 2]
+    if db._is_postgres():
+        import psycopg
+        c = psycopg.connect(db._with_sslmode_require(db.DATABASE_URL))
+    else:
+        c = __import__("sqlite3").connect(db.DB_PATH)
+    try:
+        c.execute(users_sql)
+        c.execute(signals_sql)
+        c.commit()
+    finally:
+        c.close()
+
+
+def _signed() -> dict:
+    data = {
+        "passphrase": server.WEBHOOK_PASSPHRASE, "symbol": "BTCUSDT", "tf": "15m", "side": "BUY",
+        "price": 100, "tp": 110, "sl": 95, "reason": "bench",
+        "ts": int(time.time()), "nonce": uuid.uuid4().hex,
+    }
+    canon = json.dumps(data, separators=(",", ":"), sort_keys=True)
+    data["sig"] = hmac.new(
+        b"bench-secret", f"{data['ts']}.{data['nonce']}.{canon}".encode(), hashlib.sha256
+    ).hexdigest()
+    return data
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(n: int, legacy: bool) -> dict:
+    client = server.app.test_client()
+    lat = []
+    for _ in range(n):
+        body = _signed()
+        t0 = time.perf_counter()
+        if legacy:
+            _legacy_init_db()
+        r = client.post("/webhook", json=body)
+        lat.append((time.perf_counter() - t0) * 1000)
+        assert r.status_code == 200, r.get_json()
+    return {"p50_ms": round(_pct(lat, 0.50), 3), "p99_ms": round(_pct(lat, 0.99), 3)}
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    server.bootstrap()
+    server.send_telegram = lambda *a, **k: True
+    run(min(200, n), legacy=False)  # calentar
+    kind = "postgres" if db._is_postgres() else "sqlite"
+    print(f"{kind} antes (init_db por request): {run(n, legacy=True)}")
+    print(f"{kind} ahora (migrado al arrancar):  {run(n, legacy=False)}")
@@ -11,10 +11,10 @@ TG_CHAT_ID = os.getenv("TG_CHAT_ID")
 
 import os
 import time
-import requests
 import pandas as pd
 from dotenv import load_dotenv
 from binance.client import Client
+from notifier import notify
 
 from binance.client import Client
 client = Client(API_KEY, API_SECRET, tld="com")
@@ -46,8 +46,8 @@ position = {
 # UTILIDADES
 # ======================
 def tg_send(msg: str):
-    url = f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage"
-    requests.post(url, json={"chat_id": TG_CHAT, "text": msg})
+    # notificador compartido: pool keep-alive + timeouts (antes: sin timeout)
+    notify(msg, chat_id=TG_CHAT)
 
 def get_df(client, interval, limit=200):
     kl = client.get_klines(symbol=SYMBOL, interval=interval, limit=limit)
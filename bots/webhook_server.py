@@ -9,6 +9,7 @@ BANCRIPFUTBOT PRO - Webhook Server (Plataforma PRO v1)
 import os
 import json
 import time
+import logging
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 
@@ -18,11 +19,21 @@ load_dotenv()
 # Importar tu motor y almacenamiento (están en la carpeta raíz)
 from engine import process_signal
 from storage import append_trade
+from logs import get_logger, log_event, payload_for_log
+import outbox
+
+log = get_logger("webhook_server")
 
 app = Flask(__name__)
 
 WEBHOOK_PASSPHRASE = os.getenv("WEBHOOK_PASSPHRASE", "BANCRIPFUTBOT").strip()
 
+@app.before_request
+def _start_background():
+    # entrega de Telegram desde el outbox (un pool por proceso)
+    if outbox.OUTBOX_ENABLED:
+        outbox.outbox_worker.start()
+
 @app.route("/")
 def home():
     return jsonify({"status": "BANCRIPFUTBOT PRO ONLINE"}), 200
@@ -32,11 +43,13 @@ def webhook():
     if request.method == "GET":
         return jsonify({"message": "Use POST para enviar señales"}), 200
 
+    t0 = time.perf_counter()
     data = request.get_json(silent=True) or {}
-    print("📩 Webhook recibido:", json.dumps(data, indent=2))
 
     # 1) Validar passphrase
     if str(data.get("passphrase", "")).strip() != WEBHOOK_PASSPHRASE:
+        log_event(log, "webhook", http_status=403, error="bad passphrase",
+                  latency_ms=round((time.perf_counter() - t0) * 1000, 2))
         return jsonify({"ok": False, "error": "bad passphrase"}), 403
 
     # 2) Guardar evento RAW (persistente)
@@ -50,7 +63,9 @@ def webhook():
     try:
         process_signal(data)
     except Exception as e:
-        print("❌ Error en process_signal:", str(e))
+        log_event(log, "webhook", logging.ERROR, http_status=500, error=str(e),
+                  latency_ms=round((time.perf_counter() - t0) * 1000, 2),
+                  payload=payload_for_log(data))
         append_trade({
             "type": "ERROR",
             "error": str(e),
@@ -58,6 +73,9 @@ def webhook():
         })
         return jsonify({"ok": False, "error": "engine_failed", "detail": str(e)}), 500
 
+    log_event(log, "webhook", http_status=200,
+              latency_ms=round((time.perf_counter() - t0) * 1000, 2),
+              payload=payload_for_log(data))
     return jsonify({"ok": True}), 200
 
 @app.route("/signals", methods=["GET"])
@@ -140,6 +158,9 @@ def stats():
     }), 200
 
 if __name__ == "__main__":
+    if outbox.OUTBOX_ENABLED:
+        from db import migrate
+        migrate()
     port = int(os.getenv("PORT", 5000))
     print(f"🚀 BANCRIPFUTBOT PRO (Plataforma) iniciando en puerto {port}")
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,121 @@
+"""
+Circuit breaker para llamadas salientes (Telegram).
+
+Cuando Telegram está degradado, cada envío se come el timeout completo y
+los workers de gunicorn se agotan esperando. El breaker mira la tasa de
+fallos en una ventana deslizante y, si supera el umbral, se ABRE: los
+envíos fallan al instante (CircuitOpenError) hasta que pasa `open_seconds`.
+Después deja pasar UNA prueba (HALF_OPEN): si sale bien vuelve a CLOSED,
+si falla se abre otra vez.
+
+    if not breaker.allow():
+        ... fallar rápido (retry_after = breaker.retry_after())
+    ... llamada ...
+    breaker.record(ok)
+
+Estados: CLOSED -> OPEN -> HALF_OPEN -> CLOSED
+                     ^-----------/ (la prueba falló)
+"""
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: float = 30.0, min_calls: int = 10,
+                 failure_rate: float = 0.5, open_seconds: float = 30.0):
+        self.name = name
+        self.window = max(1.0, float(window))
+        self.min_calls = max(1, int(min_calls))
+        self.failure_rate = min(1.0, max(0.0, float(failure_rate)))
+        self.open_seconds = max(0.1, float(open_seconds))
+
+        self._lock = threading.Lock()
+        self._calls = deque()   # (monotonic, ok)
+        self._failures = 0
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe = False     # hay una prueba en vuelo (HALF_OPEN)
+
+        self.opened = 0
+        self.rejected = 0
+
+    def _trim(self, now: float):
+        cutoff = now - self.window
+        while self._calls and self._calls[0][0] < cutoff:
+            if not self._calls.popleft()[1]:
+                self._failures -= 1
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        True si la llamada puede salir. En HALF_OPEN solo pasa una a la vez.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probe = False
+            if self.state == HALF_OPEN and not self._probe:
+                self._probe = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe = False
+                if ok:
+                    self.state = CLOSED
+                    self._calls.clear()
+                    self._failures = 0
+                else:
+                    self._open(now)
+                return
+            if self.state == OPEN:
+                # respuesta tardía de una llamada previa a la apertura
+                return
+
+            self._calls.append((now, ok))
+            if not ok:
+                self._failures += 1
+            self._trim(now)
+            n = len(self._calls)
+            if n >= self.min_calls and self._failures / n >= self.failure_rate:
+                self._open(now)
+
+    def release(self):
+        """
+        La llamada terminó sin veredicto (p.ej. 429): libera la prueba de
+        HALF_OPEN sin cambiar de estado.
+        """
+        with self._lock:
+            self._probe = False
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self._opened_at = now
+        self.opened += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._trim(time.monotonic())
+            n = len(self._calls)
+            return {
+                "state": self.state,
+                "calls": n,
+                "failure_rate": round(self._failures / n, 3) if n else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "retry_after_s": round(self.retry_after(), 1) if self.state != CLOSED else 0.0,
+            }
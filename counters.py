@@ -0,0 +1,100 @@
+"""
+Contadores de señales para el dashboard (tabla `signal_counters`).
+
+En vez de tres COUNT(*) sobre `signals` por cada carga del dashboard, cada
+INSERT suma 1 en la MISMA transacción a:
+
+    (symbol, tf, side)   exacto
+    ('*', '*', side)     por side
+    ('*', '*', '*')      total
+
+y el dashboard lee esas filas por clave primaria. '*' está reservado: el
+webhook rechaza señales con symbol/tf/side = '*'. Si algo se desfasa
+(borrados a mano, restore), `python db.py rebuild-counters` los recalcula
+desde cero.
+"""
+from collections import Counter
+
+from db import conn, statement, COUNTERS_REBUILD_SQL
+
+ANY = "*"
+
+UPSERT_COUNTER_SQL = (
+    "INSERT INTO signal_counters(symbol,tf,side,n) VALUES(?,?,?,?) "
+    "ON CONFLICT(symbol,tf,side) DO UPDATE SET n = signal_counters.n + excluded.n"
+)
+TOTALS_SQL = statement("SELECT side, n FROM signal_counters WHERE symbol=? AND tf=?")
+
+
+def _apply(c, keys, sign: int):
+    delta = Counter()
+    for symbol, tf, side in keys:
+        symbol, tf, side = symbol or "", tf or "", side or ""
+        delta[(symbol, tf, side)] += sign
+        delta[(ANY, ANY, side)] += sign
+        delta[(ANY, ANY, ANY)] += sign
+    if delta:
+        c.executemany(UPSERT_COUNTER_SQL, [(*k, n) for k, n in sorted(delta.items())])
+
+
+def bump(c, keys):
+    """
+    keys: [(symbol, tf, side), ...] de las filas NUEVAS. Dentro de la
+    transacción de `c` (no hace commit). Un upsert por clave distinta; en
+    orden fijo para que dos transacciones no se bloqueen cruzadas.
+    """
+    _apply(c, keys, 1)
+
+
+def subtract(c, keys):
+    """
+    Igual que bump() pero para filas que SALEN de `signals` (retención),
+    en la misma transacción que las borra.
+    """
+    _apply(c, keys, -1)
+
+
+def totals(c) -> dict:
+    """
+    {"total": n, "BUY": n, "SELL": n, ...}: una sola lectura por PK.
+    """
+    rows = c.execute(TOTALS_SQL, (ANY, ANY)).fetchall()
+    out = {"total": 0}
+    for r in rows:
+        out["total" if r["side"] == ANY else r["side"]] = r["n"]
+    return out
+
+
+def count(c, symbol: str = "", tf: str = "", side: str = "") -> int:
+    """
+    Cantidad de señales con esos filtros (vacío = cualquiera), sumando
+    contadores exactos: cuesta O(combinaciones), no O(señales).
+    """
+    if not (symbol or tf):
+        return totals(c).get(side or "total", 0)
+    q = "SELECT COALESCE(SUM(n), 0) n FROM signal_counters WHERE symbol<>?"
+    params = [ANY]
+    for col, val in (("symbol", symbol), ("tf", tf), ("side", side)):
+        if val:
+            q += f" AND {col}=?"
+            params.append(val)
+    return c.execute(q, tuple(params)).fetchone()["n"]
+
+
+def rebuild() -> int:
+    """
+    Recalcula todos los contadores desde `signals`. Bloquea los INSERTs
+    mientras corre (si no, una señal podría contarse dos veces o ninguna).
+    Devuelve el total.
+    """
+    with conn() as c:
+        if c.kind == "postgres":
+            c.execute("LOCK TABLE signals IN SHARE MODE")
+        else:
+            c.commit()
+            c.execute("BEGIN IMMEDIATE")
+        for stmt in COUNTERS_REBUILD_SQL:
+            c.execute(stmt)
+        total = totals(c)["total"]
+        c.commit(strict=True)
+    return total
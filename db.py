@@ -1,17 +1,64 @@
+import asyncio
 import os
+import re
 import sqlite3
-from contextlib import contextmanager
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from functools import partial
 from datetime import datetime, timezone
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse, quote
 
 DB_PATH = os.getenv("SQLITE_PATH", "app.db")
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
 
+# Pool de conexiones (Postgres). DB_POOL=0 vuelve a una conexión por bloque.
+DB_POOL = os.getenv("DB_POOL", "1").strip() != "0"
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # seg
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seg esperando conexión libre
+
+# Perfil SQLite para varios workers escribiendo a la vez: WAL (lectores y
+# escritor no se bloquean), synchronous=NORMAL (fsync solo en checkpoint;
+# seguro ante caída del proceso, en WAL), busy_timeout (esperar el lock en
+# vez de "database is locked"), mmap y temporales en memoria.
+# SQLITE_TUNED=0 vuelve a los defaults de sqlite3.
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "1").strip() != "0"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+
+# Prepared statements (Postgres): psycopg prepara solo una consulta después
+# de DB_PREPARE_THRESHOLD ejecuciones en la misma conexión; las registradas
+# con statement() se preparan desde la primera. "off" desactiva ambas cosas
+# (p.ej. detrás de pgbouncer en modo transaction).
+_prepare = os.getenv("DB_PREPARE_THRESHOLD", "5").strip().lower()
+DB_PREPARE_THRESHOLD = None if _prepare in ("", "off", "none") else int(_prepare)
+# tope de SQL distintos con la traducción de placeholders cacheada
+DB_SQL_CACHE_SIZE = int(os.getenv("DB_SQL_CACHE_SIZE", "1024"))
+
+# aconn() con SQLite: sesiones async concurrentes (cada una ocupa un hilo
+# con su conexión persistente mientras dura)
+DB_ASYNC_SQLITE_THREADS = int(os.getenv("DB_ASYNC_SQLITE_THREADS", "4"))
+
 
 def utc_now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def ts_param(dt: datetime):
+    """
+    Valor para la columna `ts`: datetime (timestamptz) en Postgres, epoch
+    en milisegundos en SQLite.
+    """
+    if _is_postgres():
+        return dt
+    return int(dt.timestamp() * 1000)
+
+
 def _with_sslmode_require(url: str) -> str:
     """
     Render Postgres normalmente requiere SSL. Si no viene sslmode en la URL,
@@ -35,6 +82,230 @@ def _is_postgres() -> bool:
     return DATABASE_URL.lower().startswith(("postgres://", "postgresql://"))
 
 
+# =========================
+# SENTENCIAS (cache de traducción + prepared)
+# =========================
+# SQL con `?` -> SQL con `%s`, una vez por string. Las consultas son un
+# conjunto chico de constantes y combinaciones de filtros, así que el dict
+# casi no crece; pasado DB_SQL_CACHE_SIZE se traduce sin guardar.
+_sql_cache = {}
+_sql_hits = 0
+_sql_misses = 0
+_hot = set()
+
+
+def _pg_sql(sql: str) -> str:
+    global _sql_hits, _sql_misses
+    out = _sql_cache.get(sql)
+    if out is not None:
+        _sql_hits += 1
+        return out
+    _sql_misses += 1
+    out = sql.replace("?", "%s")
+    if len(_sql_cache) < DB_SQL_CACHE_SIZE:
+        _sql_cache[sql] = out
+    return out
+
+
+def _prepare_flag(sql: str):
+    # None = que decida psycopg según prepare_threshold
+    return True if DB_PREPARE_THRESHOLD is not None and sql in _hot else None
+
+
+def statement(sql: str) -> str:
+    """
+    Registra una sentencia caliente (insert de señales, lookup de usuario,
+    ...): en Postgres se prepara en el servidor desde la primera ejecución
+    en cada conexión, en vez de replanificarse. Devuelve el mismo SQL, para
+    usar como constante:
+
+        INSERT_X_SQL = statement("INSERT INTO x(a) VALUES(?)")
+    """
+    _hot.add(sql)
+    return sql
+
+
+def statement_stats() -> dict:
+    lookups = _sql_hits + _sql_misses
+    return {
+        "cached": len(_sql_cache),
+        "hits": _sql_hits,
+        "misses": _sql_misses,
+        "hit_rate": round(_sql_hits / lookups, 4) if lookups else 0.0,
+        "hot": len(_hot),
+        "prepare_threshold": DB_PREPARE_THRESHOLD,
+    }
+
+
+# =========================
+# POOL (fork-safe)
+# =========================
+# Todo el estado del pool se asocia al pid que lo creó: después del fork de
+# gunicorn cada worker detecta que el pid cambió y arma su propio pool.
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_sqlite_local = threading.local()
+_sqlite_opened = 0
+_in_use = 0
+_acquire_ms_total = 0.0
+_acquire_count = 0
+
+
+def _pg_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            from psycopg.rows import dict_row
+            from psycopg_pool import ConnectionPool
+
+            # el pool heredado del padre NO se cierra: sus sockets son del padre
+            _pool = ConnectionPool(
+                _with_sslmode_require(DATABASE_URL),
+                min_size=DB_POOL_MIN,
+                max_size=max(DB_POOL_MIN, DB_POOL_MAX),
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                timeout=DB_POOL_TIMEOUT,
+                check=ConnectionPool.check_connection,
+                kwargs={"row_factory": dict_row, "prepare_threshold": DB_PREPARE_THRESHOLD},
+                name="bancripfut",
+                open=True,
+            )
+            _pool_pid = pid
+    return _pool
+
+
+def _sqlite_tune(c, readonly: bool):
+    c.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    c.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    c.execute("PRAGMA temp_store=MEMORY")
+    if readonly:
+        c.execute("PRAGMA query_only=1")
+        return
+    # journal_mode=WAL queda persistido en el archivo; repetirlo es barato
+    c.execute("PRAGMA journal_mode=WAL")
+    if SQLITE_SYNCHRONOUS in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        c.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+
+
+def _sqlite_open(readonly: bool):
+    timeout = SQLITE_BUSY_TIMEOUT_MS / 1000.0 if SQLITE_TUNED else 5.0
+    if readonly:
+        # solo lectura a nivel de archivo: nunca toma el lock de escritura
+        c = sqlite3.connect(f"file:{quote(DB_PATH)}?mode=ro", uri=True, timeout=timeout)
+    else:
+        c = sqlite3.connect(DB_PATH, timeout=timeout)
+    c.row_factory = sqlite3.Row
+    if SQLITE_TUNED:
+        _sqlite_tune(c, readonly)
+    return c
+
+
+def _sqlite_conn(readonly: bool = False):
+    """
+    Una conexión SQLite persistente por thread (y por proceso). Con
+    readonly=True, otra conexión aparte abierta en modo solo lectura para
+    las consultas del dashboard.
+    """
+    global _sqlite_opened
+    attr = "ro_conn" if readonly else "conn"
+    key = (os.getpid(), DB_PATH)
+    c = getattr(_sqlite_local, attr, None)
+    if c is not None and getattr(_sqlite_local, attr + "_key", None) == key:
+        return c
+    try:
+        c = _sqlite_open(readonly)
+    except sqlite3.OperationalError:
+        if not readonly:
+            raise
+        # la base todavía no existe: la conexión normal la crea
+        return _sqlite_conn()
+    setattr(_sqlite_local, attr, c)
+    setattr(_sqlite_local, attr + "_key", key)
+    _sqlite_opened += 1
+    return c
+
+
+def reset_pool():
+    """
+    Hook post_fork: olvida el pool heredado sin cerrarlo (es del padre).
+    """
+    global _pool, _pool_pid
+    _pool = None
+    _pool_pid = None
+    _sqlite_local.__dict__.clear()
+
+
+def close_pool():
+    """
+    Cierra el pool de ESTE proceso (p.ej. el master de gunicorn después de
+    migrar, para no dejar conexiones abiertas que los workers heredarían).
+    """
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        try:
+            _pool.close()
+        except Exception:
+            pass
+    _pool = None
+    _pool_pid = None
+    _close_sqlite_local()
+
+
+def _close_sqlite_local():
+    # conexiones SQLite persistentes del thread actual
+    for attr in ("conn", "ro_conn"):
+        c = getattr(_sqlite_local, attr, None)
+        if c is not None and getattr(_sqlite_local, attr + "_key", (None,))[0] == os.getpid():
+            try:
+                c.close()
+            except Exception:
+                pass
+    _sqlite_local.__dict__.clear()
+
+
+def pool_stats() -> dict:
+    """
+    Conexiones en uso, esperando y tiempo de espera para obtener conexión.
+    """
+    avg = (_acquire_ms_total / _acquire_count) if _acquire_count else 0.0
+    out = {
+        "kind": "postgres" if _is_postgres() else "sqlite",
+        "in_use": _in_use,
+        "acquire_count": _acquire_count,
+        "acquire_ms_avg": round(avg, 3),
+    }
+    if _async_acquire_count:
+        out["async"] = {
+            "in_use": _async_in_use,
+            "acquire_count": _async_acquire_count,
+            "acquire_ms_avg": round(_async_acquire_ms_total / _async_acquire_count, 3),
+        }
+    if out["kind"] == "postgres":
+        out["statements"] = statement_stats()
+        if _pool is not None and _pool_pid == os.getpid():
+            st = _pool.get_stats()
+            out.update({
+                "pool_min": st.get("pool_min", DB_POOL_MIN),
+                "pool_max": st.get("pool_max", DB_POOL_MAX),
+                "pool_size": st.get("pool_size", 0),
+                "available": st.get("pool_available", 0),
+                "waiting": st.get("requests_waiting", 0),
+                "wait_ms_total": st.get("requests_wait_ms", 0),
+                "errors": st.get("requests_errors", 0),
+                "connections_lost": st.get("connections_lost", 0),
+            })
+        else:
+            out["pool_size"] = 0
+    else:
+        out["connections_opened"] = _sqlite_opened
+        out["tuned"] = SQLITE_TUNED
+    return out
+
+
 class DBSession:
     """
     Compatible con tu uso actual:
@@ -45,28 +316,50 @@ class DBSession:
             c.commit()
 
     Soporta SQLite y Postgres (psycopg v3).
+    Las conexiones salen de un pool (Postgres) o son persistentes por thread
+    (SQLite): al salir del bloque se hace commit/rollback y se devuelven,
+    no se cierran.
+    readonly=True (solo SQLite): conexión aparte en modo solo lectura, para
+    que las lecturas del dashboard nunca compitan por el lock de escritura.
     """
-    def __init__(self):
+    def __init__(self, readonly: bool = False):
         self.kind = "postgres" if _is_postgres() else "sqlite"
+        self.readonly = readonly
         self._conn = None
         self._cur = None
+        self._pool = None
 
     def __enter__(self):
+        global _in_use, _acquire_ms_total, _acquire_count
+        t0 = time.perf_counter()
         if self.kind == "postgres":
-            # psycopg v3
-            import psycopg
-            from psycopg.rows import dict_row
+            if DB_POOL:
+                try:
+                    self._pool = _pg_pool()
+                except ImportError:
+                    self._pool = None
+            if self._pool is not None:
+                self._conn = self._pool.getconn()
+            else:
+                # sin psycopg_pool: conexión nueva por bloque (modo anterior)
+                import psycopg
+                from psycopg.rows import dict_row
 
-            url = _with_sslmode_require(DATABASE_URL)
-            self._conn = psycopg.connect(url, row_factory=dict_row)
-            self._cur = self._conn.cursor()
+                url = _with_sslmode_require(DATABASE_URL)
+                self._conn = psycopg.connect(
+                    url, row_factory=dict_row, prepare_threshold=DB_PREPARE_THRESHOLD
+                )
         else:
-            self._conn = sqlite3.connect(DB_PATH)
-            self._conn.row_factory = sqlite3.Row
-            self._cur = self._conn.cursor()
+            self._conn = _sqlite_conn(readonly=self.readonly)
+        self._cur = self._conn.cursor()
+        _acquire_ms_total += (time.perf_counter() - t0) * 1000.0
+        _acquire_count += 1
+        _in_use += 1
         return self
 
     def __exit__(self, exc_type, exc, tb):
+        global _in_use
+        _in_use -= 1
         try:
             if exc_type:
                 self._conn.rollback()
@@ -79,92 +372,760 @@ class DBSession:
                 self._cur.close()
         except Exception:
             pass
+        if self.kind == "sqlite":
+            # persistente por thread: no se cierra
+            return
         try:
-            if self._conn:
+            if self._pool is not None:
+                self._pool.putconn(self._conn)
+            elif self._conn:
                 self._conn.close()
         except Exception:
             pass
 
     def execute(self, sql, params=()):
-        # SQLite usa ?; Postgres usa %s
+        # SQLite usa ?; Postgres usa %s (traducción cacheada, ver _pg_sql)
+        if self.kind == "postgres":
+            self._cur.execute(_pg_sql(sql), params, prepare=_prepare_flag(sql))
+        else:
+            self._cur.execute(sql, params)
+        return self
+
+    def executemany(self, sql, seq_params):
         if self.kind == "postgres":
-            sql = sql.replace("?", "%s")
-        self._cur.execute(sql, params)
+            sql = _pg_sql(sql)
+        self._cur.executemany(sql, seq_params)
         return self
 
+    @property
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
     def fetchone(self):
         return self._cur.fetchone()
 
     def fetchall(self):
         return self._cur.fetchall()
 
-    def commit(self):
+    def commit(self, strict: bool = False):
+        # strict=True: el error de commit se propaga (ack durable del writer)
         try:
             self._conn.commit()
         except Exception:
-            pass
+            if strict:
+                raise
 
 
 @contextmanager
-def conn():
-    with DBSession() as s:
+def conn(readonly: bool = False):
+    with DBSession(readonly=readonly) as s:
         yield s
 
 
-def init_db():
+# =========================
+# ASYNC (aconn)
+# =========================
+# Pools y hilos por event loop (un AsyncConnectionPool no se puede usar
+# desde otro loop) y por pid, igual que el pool sync.
+_apools = weakref.WeakKeyDictionary()   # loop -> (pid, AsyncConnectionPool)
+_alanes = weakref.WeakKeyDictionary()   # loop -> (pid, asyncio.Queue de hilos, hilos)
+_async_in_use = 0
+_async_acquire_ms_total = 0.0
+_async_acquire_count = 0
+
+
+async def _apg_pool():
+    loop = asyncio.get_running_loop()
+    pid = os.getpid()
+    entry = _apools.get(loop)
+    if entry is not None and entry[0] == pid:
+        return entry[1]
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool
+
+    pool = AsyncConnectionPool(
+        _with_sslmode_require(DATABASE_URL),
+        min_size=DB_POOL_MIN,
+        max_size=max(DB_POOL_MIN, DB_POOL_MAX),
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        timeout=DB_POOL_TIMEOUT,
+        check=AsyncConnectionPool.check_connection,
+        kwargs={"row_factory": dict_row, "prepare_threshold": DB_PREPARE_THRESHOLD},
+        name="bancripfut-async",
+        open=False,
+    )
+    await pool.open()
+    # otra corrutina pudo haberlo creado mientras abríamos este
+    entry = _apools.get(loop)
+    if entry is not None and entry[0] == pid:
+        await pool.close()
+        return entry[1]
+    _apools[loop] = (pid, pool)
+    return pool
+
+
+def _sqlite_lanes() -> asyncio.Queue:
     """
-    Crea tablas si no existen.
+    DB_ASYNC_SQLITE_THREADS hilos de un solo worker ("carriles"): una
+    sesión toma uno entero, así todas sus operaciones van por la misma
+    conexión (sqlite3 no comparte conexiones entre hilos) y la transacción
+    no se mezcla con otra sesión.
     """
-    if _is_postgres():
-        users_sql = """
+    loop = asyncio.get_running_loop()
+    entry = _alanes.get(loop)
+    if entry is None or entry[0] != os.getpid():
+        lanes = [ThreadPoolExecutor(1, thread_name_prefix=f"sqlite-async-{i}")
+                 for i in range(max(1, DB_ASYNC_SQLITE_THREADS))]
+        free = asyncio.Queue()
+        for lane in lanes:
+            free.put_nowait(lane)
+        entry = (os.getpid(), free, lanes)
+        _alanes[loop] = entry
+        weakref.finalize(loop, lambda ls=lanes: [lane.shutdown(wait=False) for lane in ls])
+    return entry[1]
+
+
+class AsyncDBSession:
+    """
+    Contraparte async de DBSession, con la misma semántica: `?` como
+    placeholder en ambos motores, filas como mapping (dict en Postgres,
+    sqlite3.Row en SQLite), commit/rollback y devolución al salir.
+
+        async with aconn() as c:
+            row = await (await c.execute("SELECT ... WHERE id=?", (1,))).fetchone()
+            await c.commit()
+
+    Postgres: psycopg.AsyncConnection desde un AsyncConnectionPool (o una
+    conexión por bloque con DB_POOL=0 / sin psycopg_pool).
+    SQLite: la misma DBSession sync (perfil, conexiones persistentes,
+    readonly) corriendo en un hilo propio de la sesión.
+    """
+    def __init__(self, readonly: bool = False):
+        self.kind = "postgres" if _is_postgres() else "sqlite"
+        self.readonly = readonly
+        self._conn = None
+        self._cur = None
+        self._pool = None
+        self._sync = None
+        self._lane = None
+        self._free = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._lane, partial(fn, *args))
+
+    async def __aenter__(self):
+        global _async_in_use, _async_acquire_ms_total, _async_acquire_count
+        t0 = time.perf_counter()
+        if self.kind == "postgres":
+            if DB_POOL:
+                try:
+                    self._pool = await _apg_pool()
+                except ImportError:
+                    self._pool = None
+            if self._pool is not None:
+                self._conn = await self._pool.getconn()
+            else:
+                import psycopg
+                from psycopg.rows import dict_row
+
+                url = _with_sslmode_require(DATABASE_URL)
+                self._conn = await psycopg.AsyncConnection.connect(
+                    url, row_factory=dict_row, prepare_threshold=DB_PREPARE_THRESHOLD
+                )
+            self._cur = self._conn.cursor()
+        else:
+            self._free = _sqlite_lanes()
+            self._lane = await asyncio.wait_for(self._free.get(), DB_POOL_TIMEOUT)
+            try:
+                self._sync = DBSession(readonly=self.readonly)
+                await self._run(self._sync.__enter__)
+            except BaseException:
+                self._free.put_nowait(self._lane)
+                raise
+        _async_acquire_ms_total += (time.perf_counter() - t0) * 1000.0
+        _async_acquire_count += 1
+        _async_in_use += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        global _async_in_use
+        _async_in_use -= 1
+        if self._sync is not None:
+            try:
+                await self._run(self._sync.__exit__, exc_type, exc, tb)
+            finally:
+                self._free.put_nowait(self._lane)
+            return
+        try:
+            if exc_type:
+                await self._conn.rollback()
+            else:
+                await self._conn.commit()
+        except Exception:
+            pass
+        try:
+            if self._cur:
+                await self._cur.close()
+        except Exception:
+            pass
+        try:
+            if self._pool is not None:
+                await self._pool.putconn(self._conn)
+            elif self._conn:
+                await self._conn.close()
+        except Exception:
+            pass
+
+    async def execute(self, sql, params=()):
+        if self._sync is not None:
+            await self._run(self._sync.execute, sql, params)
+        else:
+            await self._cur.execute(_pg_sql(sql), params, prepare=_prepare_flag(sql))
+        return self
+
+    async def executemany(self, sql, seq_params):
+        if self._sync is not None:
+            # la secuencia se materializa acá: un generador no debe
+            # consumirse desde otro hilo
+            await self._run(self._sync.executemany, sql, list(seq_params))
+        else:
+            await self._cur.executemany(_pg_sql(sql), seq_params)
+        return self
+
+    @property
+    def rowcount(self) -> int:
+        return self._sync.rowcount if self._sync is not None else self._cur.rowcount
+
+    async def fetchone(self):
+        if self._sync is not None:
+            return await self._run(self._sync.fetchone)
+        return await self._cur.fetchone()
+
+    async def fetchall(self):
+        if self._sync is not None:
+            return await self._run(self._sync.fetchall)
+        return await self._cur.fetchall()
+
+    async def commit(self, strict: bool = False):
+        if self._sync is not None:
+            return await self._run(self._sync.commit, strict)
+        try:
+            await self._conn.commit()
+        except Exception:
+            if strict:
+                raise
+
+
+@asynccontextmanager
+async def aconn(readonly: bool = False):
+    async with AsyncDBSession(readonly=readonly) as s:
+        yield s
+
+
+async def aclose_pool():
+    """
+    Cierra el pool async y los hilos SQLite del event loop actual (al
+    apagar un server async).
+    """
+    loop = asyncio.get_running_loop()
+    entry = _apools.pop(loop, None)
+    if entry is not None and entry[0] == os.getpid():
+        await entry[1].close()
+    entry = _alanes.pop(loop, None)
+    if entry is not None and entry[0] == os.getpid():
+        for lane in entry[2]:
+            # cada hilo cierra su conexión persistente antes de terminar
+            lane.submit(_close_sqlite_local)
+            lane.shutdown(wait=False)
+
+
+# =========================
+# MIGRACIONES (schema_version)
+# =========================
+# Cada migración: (version, nombre, statements_sqlite, statements_postgres).
+# Se aplican una sola vez, en orden, al arrancar el proceso (ver migrate()).
+# NUNCA editar una migración ya publicada: agregar una nueva al final.
+# Contadores de señales (ver counters.py): '*' = todos. Se recalculan con
+# esto en la migración y en `python db.py rebuild-counters`.
+COUNTERS_REBUILD_SQL = [
+    "DELETE FROM signal_counters",
+    "INSERT INTO signal_counters(symbol,tf,side,n) "
+    "SELECT COALESCE(symbol,''), COALESCE(tf,''), COALESCE(side,''), COUNT(*) FROM signals "
+    "GROUP BY COALESCE(symbol,''), COALESCE(tf,''), COALESCE(side,'')",
+    "INSERT INTO signal_counters(symbol,tf,side,n) "
+    "SELECT '*', '*', COALESCE(side,''), COUNT(*) FROM signals GROUP BY COALESCE(side,'')",
+    "INSERT INTO signal_counters(symbol,tf,side,n) SELECT '*', '*', '*', COUNT(*) FROM signals",
+]
+
+MIGRATIONS = [
+    (1, "users_signals",
+     [
+        """
         CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
             password_hash TEXT NOT NULL,
             role TEXT NOT NULL DEFAULT 'USER'
-        );
+        )
+        """,
         """
-        signals_sql = """
         CREATE TABLE IF NOT EXISTS signals (
-            id SERIAL PRIMARY KEY,
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
             ts_utc TEXT NOT NULL,
             symbol TEXT,
             tf TEXT,
             side TEXT,
-            price DOUBLE PRECISION,
-            tp DOUBLE PRECISION,
-            sl DOUBLE PRECISION,
+            price REAL,
+            tp REAL,
+            sl REAL,
             reason TEXT,
             raw_json TEXT
-        );
+        )
+        """,
+     ],
+     [
         """
-    else:
-        users_sql = """
         CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id SERIAL PRIMARY KEY,
             username TEXT UNIQUE NOT NULL,
             password_hash TEXT NOT NULL,
             role TEXT NOT NULL DEFAULT 'USER'
-        );
+        )
+        """,
         """
-        signals_sql = """
         CREATE TABLE IF NOT EXISTS signals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id SERIAL PRIMARY KEY,
             ts_utc TEXT NOT NULL,
             symbol TEXT,
             tf TEXT,
             side TEXT,
-            price REAL,
-            tp REAL,
-            sl REAL,
+            price DOUBLE PRECISION,
+            tp DOUBLE PRECISION,
+            sl DOUBLE PRECISION,
             reason TEXT,
             raw_json TEXT
-        );
+        )
+        """,
+     ]),
+    (2, "webhook_nonces",
+     [
+        "CREATE TABLE IF NOT EXISTS webhook_nonces (nonce TEXT PRIMARY KEY, expires_at INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_webhook_nonces_expires ON webhook_nonces(expires_at)",
+     ],
+     [
+        "CREATE TABLE IF NOT EXISTS webhook_nonces (nonce TEXT PRIMARY KEY, expires_at BIGINT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_webhook_nonces_expires ON webhook_nonces(expires_at)",
+     ]),
+    (3, "signals_idem_key",
+     [
+        "ALTER TABLE signals ADD COLUMN idem_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_signals_idem_key ON signals(idem_key)",
+     ],
+     [
+        "ALTER TABLE signals ADD COLUMN IF NOT EXISTS idem_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_signals_idem_key ON signals(idem_key)",
+     ]),
+    (4, "outbox",
+     [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at INTEGER NOT NULL,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL,
+            lease_until INTEGER,
+            claimed_by TEXT,
+            last_error TEXT,
+            delivered_at INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_claimed ON outbox(claimed_by)",
+     ],
+     [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            created_at BIGINT NOT NULL,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'PENDING',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at BIGINT NOT NULL,
+            lease_until BIGINT,
+            claimed_by TEXT,
+            last_error TEXT,
+            delivered_at BIGINT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_claimed ON outbox(claimed_by)",
+     ]),
+    # '*' = cualquiera en symbol / tf / side
+    (5, "subscriptions",
+     [
+        """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            chat_id TEXT NOT NULL,
+            symbol TEXT NOT NULL DEFAULT '*',
+            tf TEXT NOT NULL DEFAULT '*',
+            side TEXT NOT NULL DEFAULT '*',
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT NOT NULL
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_subscriptions ON subscriptions(chat_id, symbol, tf, side)",
+     ],
+     [
         """
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            chat_id TEXT NOT NULL,
+            symbol TEXT NOT NULL DEFAULT '*',
+            tf TEXT NOT NULL DEFAULT '*',
+            side TEXT NOT NULL DEFAULT '*',
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT NOT NULL
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_subscriptions ON subscriptions(chat_id, symbol, tf, side)",
+     ]),
+    # Filtros del dashboard (cualquier combinación de symbol/tf/side) con
+    # ORDER BY id DESC LIMIT: igualdades primero e id al final, así el plan
+    # recorre el índice hacia atrás y corta en el LIMIT sin ordenar. Para
+    # eso las igualdades tienen que ser TODAS las columnas antes de id, por
+    # eso hay un índice por combinación (7). Los COUNT por side salen del
+    # índice (side, id) sin tocar la tabla.
+    # En Postgres con tablas grandes conviene crearlos antes a mano con
+    # CREATE INDEX CONCURRENTLY (mismo nombre): acá quedan como no-op.
+    (6, "signals_dashboard_indexes",
+     [
+        "CREATE INDEX IF NOT EXISTS idx_signals_symbol_tf_side ON signals(symbol, tf, side, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_symbol_tf ON signals(symbol, tf, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_symbol_side ON signals(symbol, side, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_symbol ON signals(symbol, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_tf_side ON signals(tf, side, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_tf ON signals(tf, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_side ON signals(side, id)",
+        "ANALYZE signals",
+     ],
+     [
+        "CREATE INDEX IF NOT EXISTS idx_signals_symbol_tf_side ON signals(symbol, tf, side, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_symbol_tf ON signals(symbol, tf, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_symbol_side ON signals(symbol, side, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_symbol ON signals(symbol, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_tf_side ON signals(tf, side, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_tf ON signals(tf, id)",
+        "CREATE INDEX IF NOT EXISTS idx_signals_side ON signals(side, id)",
+        "ANALYZE signals",
+     ]),
+    (7, "signal_counters",
+     [
+        """
+        CREATE TABLE IF NOT EXISTS signal_counters (
+            symbol TEXT NOT NULL,
+            tf TEXT NOT NULL,
+            side TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (symbol, tf, side)
+        )
+        """,
+        *COUNTERS_REBUILD_SQL,
+     ],
+     [
+        """
+        CREATE TABLE IF NOT EXISTS signal_counters (
+            symbol TEXT NOT NULL,
+            tf TEXT NOT NULL,
+            side TEXT NOT NULL,
+            n BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (symbol, tf, side)
+        )
+        """,
+        *COUNTERS_REBUILD_SQL,
+     ]),
+    # rango de tiempo del historial (since/until); ts_utc es ISO UTC, compara
+    # bien como texto
+    (8, "signals_ts_index",
+     ["CREATE INDEX IF NOT EXISTS idx_signals_ts_utc ON signals(ts_utc)"],
+     ["CREATE INDEX IF NOT EXISTS idx_signals_ts_utc ON signals(ts_utc)"]),
+    # Timestamp nativo: epoch-ms INTEGER en SQLite, timestamptz en Postgres.
+    # Las filas viejas quedan en NULL hasta `python db.py backfill-ts`
+    # (por lotes, con la app andando). Reemplaza al índice sobre ts_utc.
+    # (ts, side): los conteos por side de un rango salen solo del índice.
+    (9, "signals_ts",
+     [
+        "ALTER TABLE signals ADD COLUMN ts INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_signals_ts ON signals(ts, side)",
+        "DROP INDEX IF EXISTS idx_signals_ts_utc",
+     ],
+     [
+        "ALTER TABLE signals ADD COLUMN IF NOT EXISTS ts TIMESTAMPTZ",
+        "CREATE INDEX IF NOT EXISTS idx_signals_ts ON signals(ts, side)",
+        "DROP INDEX IF EXISTS idx_signals_ts_utc",
+     ]),
+    # Payload compacto sin secretos (payloads.py): JSONB en Postgres, blob
+    # deflate en SQLite. raw_json queda para filas viejas hasta
+    # `python db.py compact-payloads`.
+    (10, "signals_payload",
+     ["ALTER TABLE signals ADD COLUMN payload BLOB"],
+     ["ALTER TABLE signals ADD COLUMN IF NOT EXISTS payload JSONB"]),
+    # Idempotencia en tabla propia: un índice único sobre signals(idem_key)
+    # no se puede tener con `signals` particionada por mes (tendría que
+    # incluir ts). La retención (partitions.py) borra las claves de lo que
+    # archiva.
+    (11, "signal_keys",
+     [
+        "CREATE TABLE IF NOT EXISTS signal_keys (idem_key TEXT PRIMARY KEY) WITHOUT ROWID",
+        "INSERT INTO signal_keys(idem_key) SELECT idem_key FROM signals WHERE idem_key IS NOT NULL",
+        "DROP INDEX IF EXISTS ux_signals_idem_key",
+     ],
+     [
+        "CREATE TABLE IF NOT EXISTS signal_keys (idem_key TEXT PRIMARY KEY)",
+        "INSERT INTO signal_keys(idem_key) SELECT idem_key FROM signals WHERE idem_key IS NOT NULL",
+        "DROP INDEX IF EXISTS ux_signals_idem_key",
+     ]),
+]
+
+# lock id arbitrario para pg_advisory_xact_lock (serializa migraciones entre procesos)
+_MIGRATION_LOCK_ID = 7340021
+
 
+def schema_version() -> int:
     with conn() as c:
-        c.execute(users_sql)
-        c.execute(signals_sql)
+        c.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)")
+        r = c.execute("SELECT MAX(version) v FROM schema_version").fetchone()
+    return (r["v"] if r else None) or 0
+
+
+def migrate() -> int:
+    """
+    Aplica las migraciones pendientes y devuelve la versión final.
+    Es idempotente y segura con varios procesos arrancando a la vez
+    (advisory lock en Postgres, BEGIN IMMEDIATE en SQLite).
+    Debe llamarse UNA vez al arrancar, nunca en el request.
+    """
+    current = schema_version()
+    pending = [m for m in MIGRATIONS if m[0] > current]
+    if not pending:
+        return current
+
+    with conn() as c:
+        if c.kind == "postgres":
+            c.execute("SELECT pg_advisory_xact_lock(?)", (_MIGRATION_LOCK_ID,))
+        else:
+            c.commit()
+            c.execute("BEGIN IMMEDIATE")
+
+        # releer dentro del lock: otro proceso pudo haber migrado
+        r = c.execute("SELECT MAX(version) v FROM schema_version").fetchone()
+        current = (r["v"] if r else None) or 0
+
+        for version, name, sqlite_stmts, pg_stmts in MIGRATIONS:
+            if version <= current:
+                continue
+            for stmt in (pg_stmts if c.kind == "postgres" else sqlite_stmts):
+                c.execute(stmt)
+            c.execute(
+                "INSERT INTO schema_version(version,name,applied_at) VALUES(?,?,?)",
+                (version, name, utc_now())
+            )
+            current = version
+            print(f"🗄️ Migración {version} aplicada: {name}")
         c.commit()
 
+    return current
+
+
+DASHBOARD_FILTERS = ("symbol", "tf", "side")
+
+
+def _plan_ok(kind: str, plan: str, filtered: bool, ranged: bool = False) -> bool:
+    """
+    Una consulta filtrada tiene que ir por índice; todas (filtradas o no)
+    tienen que salir ya en orden de id, sin un paso de sort aparte: el
+    listado sin filtros es un scan del PK hacia atrás que corta en LIMIT.
+    `ranged`: sólo rango since/until, sin filtros por columna; ahí se
+    acepta ordenar aparte porque el sort es sobre la ventana, no la tabla.
+    """
+    if kind == "postgres":
+        # nodo Sort (no la línea "Sort Key:" de un Merge Append)
+        nodes = [ln.strip().removeprefix("->").strip() for ln in plan.splitlines()]
+        sorts = any(re.match(r"(Incremental )?Sort(\s*\(|$)", n) for n in nodes)
+        return "Seq Scan" not in plan and (ranged or not sorts)
+    sorts = "TEMP B-TREE" in plan
+    return ("USING" in plan or not filtered) and (ranged or not sorts)
+
+
+class _Recorder:
+    """
+    Envuelve una sesión y anota las consultas sobre `signals` /
+    `signal_counters` que se ejecutan (el resto pasa tal cual).
+    """
+    def __init__(self, c):
+        self._c = c
+        self.kind = c.kind
+        self.queries = []
+
+    def execute(self, sql, params=()):
+        if "FROM signals" in sql or "FROM signal_counters" in sql:
+            self.queries.append((sql, tuple(params)))
+        return self._c.execute(sql, params)
+
+
+def dashboard_queries(sample=None) -> list:
+    """
+    Las consultas que arma history.fetch_page para el dashboard / API
+    (cada combinación de filtros, sin cursor, before_id, after_id y rango
+    `since`/`until`) + la lectura de contadores.
+    [(sql, params, filtrado, sólo rango)], ver _plan_ok.
+    Se generan ejecutando fetch_page de verdad, así el chequeo sigue al
+    código aunque cambie el SQL.
+    """
+    from itertools import combinations
+    import counters
+    import history
+
+    sample = sample or {"symbol": "BTCUSDT", "tf": "15m", "side": "BUY"}
+    now = datetime.now(timezone.utc)
+    pages = [{}, {"before_id": 1 << 40}, {"after_id": 0}, {"since": now}, {"since": now, "until": now}]
+    out, seen = [], set()
+    with conn(readonly=True) as c:
+        for n in range(len(DASHBOARD_FILTERS) + 1):
+            for cols in combinations(DASHBOARD_FILTERS, n):
+                for page in pages:
+                    rec = _Recorder(c)
+                    history.fetch_page(rec, **{col: sample[col] for col in cols}, **page)
+                    for sql, params in rec.queries:
+                        if sql not in seen:
+                            seen.add(sql)
+                            out.append((sql, params, bool(cols), not cols and "ts >=" in sql))
+        rec = _Recorder(c)
+        counters.totals(rec)
+        out += [(sql, params, True, False) for sql, params in rec.queries]
+    return out
+
+
+def explain_dashboard(sample=None) -> list:
+    """
+    Plan de cada consulta del dashboard (dashboard_queries). Devuelve
+    [(query, plan, ok)] con ok según _plan_ok. Chequeo de regresión:
+    `python db.py explain` sale con código 1 si alguna consulta hace full
+    scan con filtros o necesita ordenar aparte.
+    """
+    queries = dashboard_queries(sample)
+    out = []
+    with conn() as c:
+        if c.kind == "postgres":
+            # con pocas filas Postgres elige seq scan igual: se fuerza a
+            # mostrar si el índice ES usable
+            c.execute("SET LOCAL enable_seqscan = off")
+        for sql, params, filtered, ranged in queries:
+            if c.kind == "postgres":
+                rows = c.execute("EXPLAIN " + sql, params).fetchall()
+                plan = "\n".join(r["QUERY PLAN"] for r in rows)
+            else:
+                rows = c.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+                plan = "\n".join(r["detail"] for r in rows)
+            out.append((sql, plan, _plan_ok(c.kind, plan, filtered, ranged)))
+    return out
+
 
+def backfill_ts(batch: int = 5000, pause: float = 0.05) -> int:
+    """
+    Completa `ts` en filas viejas a partir de ts_utc, por lotes cortos
+    (cada lote es su propia transacción y se avanza por id), así se puede
+    correr con la app recibiendo señales. Devuelve cuántas filas completó.
+    """
+    last_id, done = 0, 0
+    while True:
+        with conn() as c:
+            rows = c.execute(
+                "SELECT id, ts_utc FROM signals WHERE id > ? AND ts IS NULL ORDER BY id LIMIT ?",
+                (last_id, batch)
+            ).fetchall()
+            if not rows:
+                return done
+            updates = []
+            for r in rows:
+                try:
+                    dt = datetime.fromisoformat(str(r["ts_utc"]).replace("Z", "+00:00"))
+                except ValueError:
+                    continue
+                if dt.tzinfo is None:
+                    dt = dt.replace(tzinfo=timezone.utc)
+                updates.append((ts_param(dt), r["id"]))
+            if updates:
+                c.executemany("UPDATE signals SET ts=? WHERE id=?", updates)
+            c.commit(strict=True)
+        last_id = rows[-1]["id"]
+        done += len(updates)
+        print(f"⏳ backfill ts: {done} filas (id <= {last_id})")
+        time.sleep(pause)
+
+
+def init_db():
+    """
+    Compat: antes creaba las tablas en cada request. Ahora delega en migrate().
+    """
+    return migrate()
+
+
+if __name__ == "__main__":
+    import sys
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if cmd == "migrate":
+        print("schema_version:", migrate())
+    elif cmd == "backfill-ts":
+        migrate()
+        print("filas completadas:", backfill_ts())
+    elif cmd == "compact-payloads":
+        from payloads import compact_existing
+        migrate()
+        print("filas convertidas:", compact_existing())
+    elif cmd == "payload-gin":
+        from payloads import create_gin_index
+        migrate()
+        print("índice GIN:", "ok" if create_gin_index() else "omitido")
+    elif cmd == "payload-report":
+        import json as _json
+        from payloads import report
+        migrate()
+        print(_json.dumps(report(), indent=2))
+    elif cmd == "partition-signals":
+        from partitions import partition_signals
+        migrate()
+        print("filas movidas:", partition_signals())
+    elif cmd == "partitions":
+        from partitions import ensure_partitions, list_partitions
+        migrate()
+        ensure_partitions()
+        for name, rows in list_partitions():
+            print(f"{name}: ~{rows} filas")
+    elif cmd == "retention":
+        from partitions import archive_old, SIGNALS_RETENTION_MONTHS
+        migrate()
+        months = int(sys.argv[2]) if len(sys.argv) > 2 else SIGNALS_RETENTION_MONTHS
+        print("archivadas:", archive_old(months))
+    elif cmd == "rebuild-counters":
+        from counters import rebuild
+        migrate()
+        print("signal_counters:", rebuild())
+    elif cmd == "explain":
+        migrate()
+        bad = 0
+        for sql, plan, ok in explain_dashboard():
+            print(("✅ " if ok else "❌ ") + sql)
+            print("   " + plan.replace("\n", "\n   "))
+            bad += not ok
+        sys.exit(1 if bad else 0)
+    else:
+        print(f"Comando desconocido: {cmd}")
+        sys.exit(2)
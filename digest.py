@@ -0,0 +1,251 @@
+"""
+Modo digest: junta las señales de una ráfaga en un solo mensaje por chat.
+
+Al cierre de vela muchas estrategias disparan en el mismo segundo y cada
+señal era un mensaje de Telegram. Con el digest, la primera señal de un
+chat abre una ventana de `window` segundos; todo lo que llega en ese lapso
+se agrupa por símbolo/tf y sale como un único mensaje (partido en varios
+si supera el límite de 4096 caracteres de Telegram).
+
+Se vacía por timer (fin de la ventana) o por tamaño (`max_items` señales
+pendientes en el chat). Si en la ventana llegó una sola señal se manda
+el mensaje original, igual que sin digest.
+
+    digest.add(chat_id, item, text)   # item = {"symbol","tf","side",...}
+
+Config:
+    TELEGRAM_DIGEST            1 = activar
+    TELEGRAM_DIGEST_WINDOW     2     seg por ventana
+    TELEGRAM_DIGEST_MAX_ITEMS  50    señales que fuerzan el flush
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from logs import get_logger, log_event
+
+TELEGRAM_DIGEST = os.getenv("TELEGRAM_DIGEST", "0").strip() == "1"
+TELEGRAM_DIGEST_WINDOW = float(os.getenv("TELEGRAM_DIGEST_WINDOW", "2"))
+TELEGRAM_DIGEST_MAX_ITEMS = int(os.getenv("TELEGRAM_DIGEST_MAX_ITEMS", "50"))
+
+TELEGRAM_MAX_CHARS = 4096
+
+log = get_logger("digest")
+
+
+def _icon(side: str) -> str:
+    return "🟢" if side == "BUY" else "🔴" if side == "SELL" else "✅"
+
+
+def _line(item: dict) -> str:
+    if item.get("raw_message") is not None:
+        # texto no-JSON de TradingView: no tiene precio/tp/sl
+        return f"⚠️ {item['raw_message']}"
+    line = (
+        f"{_icon(item.get('side'))} {item.get('side')} 💰 {item.get('price')}"
+        f" 🎯 {item.get('tp')} 🛑 {item.get('sl')}"
+    )
+    if item.get("reason"):
+        line += f" 🧾 {item['reason']}"
+    return line
+
+
+def _tg_len(text: str) -> int:
+    # Telegram cuenta el límite en unidades UTF-16 (un emoji ocupa 2)
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _clip(text: str, limit: int) -> str:
+    """Recorta a `limit` unidades UTF-16 (con "…"), sin partir un emoji."""
+    if _tg_len(text) <= limit:
+        return text
+    cut = text.encode("utf-16-le")[:2 * max(0, limit - 1)]
+    return cut.decode("utf-16-le", errors="ignore") + "…"
+
+
+def render(items, max_chars: int = TELEGRAM_MAX_CHARS):
+    """
+    Arma el/los mensajes del digest: encabezado + bloques por símbolo/tf en
+    orden de llegada. Devuelve una lista de textos de <= max_chars cada uno;
+    lo que no entra sigue en el mensaje siguiente (con su encabezado).
+    Título y líneas se recortan a max_chars // 4 (unidades UTF-16), así
+    encabezado + título + una línea siempre entran en un mensaje.
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault((item.get("symbol"), item.get("tf")), []).append(item)
+
+    header = f"📦 BANCRIPFUT PRO DIGEST ({len(items)} señales)"
+    chunks, current = [], header
+    for (symbol, tf), group in groups.items():
+        title = _clip(f"🪙 {symbol} ⏱ {tf}", max_chars // 4)
+        if current != header and _tg_len(current) + 2 + _tg_len(title) > max_chars:
+            chunks.append(current)
+            current = header
+        current += "\n\n" + title
+        for item in group:
+            line = _clip(_line(item), max_chars // 4)
+            if _tg_len(current) + 1 + _tg_len(line) > max_chars:
+                # el grupo sigue en el mensaje siguiente
+                chunks.append(current)
+                current = f"{header}\n\n{title} (cont.)"
+            current += "\n" + line
+    chunks.append(current)
+    assert all(_tg_len(c) <= max_chars for c in chunks), "digest chunk > max_chars"
+    return chunks
+
+
+class DigestBuffer:
+    """
+        buf = DigestBuffer(send_fn)       # send_fn(chat_id, text); puede lanzar
+        buf.add(chat_id, item, text)      # text = mensaje individual (ventana de 1)
+    """
+    def __init__(self, send_fn, window: float = 2.0, max_items: int = 50,
+                 max_chars: int = TELEGRAM_MAX_CHARS):
+        self.send_fn = send_fn
+        self.window = max(0.0, float(window))
+        self.max_items = max(1, int(max_items))
+        self.max_chars = int(max_chars)
+
+        self._cond = threading.Condition()
+        self._pending = {}    # chat -> [(item, text)]
+        self._deadline = {}   # chat -> monotonic en que vence la ventana
+        self._pid = None
+
+        self.items = 0
+        self.messages = 0
+        self.flushes_size = 0
+        self.flushes_timer = 0
+        self.errors = 0
+
+    def _start(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._cond:
+            if self._pid == pid:
+                return
+            # lo pendiente del padre no es de este proceso
+            self._pending, self._deadline = {}, {}
+            threading.Thread(target=self._run, name="tg-digest", daemon=True).start()
+            self._pid = pid
+
+    def add(self, chat_id, item: dict, text: str):
+        self._start()
+        chat_id = str(chat_id)
+        with self._cond:
+            pending = self._pending.setdefault(chat_id, [])
+            pending.append((item, text))
+            self.items += 1
+            if len(pending) == 1:
+                self._deadline[chat_id] = time.monotonic() + self.window
+            elif len(pending) >= self.max_items:
+                # umbral de tamaño: vencer la ventana ya
+                self._deadline[chat_id] = 0.0
+            self._cond.notify()
+
+    def _take_due(self, now: float, force: bool = False):
+        due = []
+        for chat, deadline in list(self._deadline.items()):
+            if force or deadline <= now:
+                due.append((chat, self._pending.pop(chat, []), deadline == 0.0))
+                del self._deadline[chat]
+        return due
+
+    def _deliver(self, chat, entries, by_size: bool):
+        if not entries:
+            return
+        if len(entries) == 1:
+            texts = [entries[0][1]]
+        else:
+            texts = render([item for item, _ in entries], self.max_chars)
+        if by_size:
+            self.flushes_size += 1
+        else:
+            self.flushes_timer += 1
+        for text in texts:
+            try:
+                self.send_fn(chat, text)
+                self.messages += 1
+            except Exception as e:
+                self.errors += 1
+                log_event(log, "digest_send_error", logging.WARNING, chat=chat, error=str(e)[:200])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    due = self._take_due(now)
+                    if due:
+                        break
+                    nxt = min(self._deadline.values(), default=None)
+                    self._cond.wait(None if nxt is None else max(0.0, nxt - now))
+            # el envío va fuera del lock: add() nunca espera a Telegram
+            for chat, entries, by_size in due:
+                self._deliver(chat, entries, by_size)
+
+    def flush(self):
+        """Vacía todas las ventanas ya (al apagar)."""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            due = self._take_due(time.monotonic(), force=True)
+        for chat, entries, by_size in due:
+            self._deliver(chat, entries, by_size)
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = sum(len(v) for v in self._pending.values())
+            chats = len(self._pending)
+        return {
+            "window_s": self.window,
+            "pending": pending,
+            "chats": chats,
+            "items": self.items,
+            "messages": self.messages,
+            "flushes_timer": self.flushes_timer,
+            "flushes_size": self.flushes_size,
+            "errors": self.errors,
+        }
+
+
+def _default_send(chat_id: str, text: str):
+    # mismo camino que un mensaje suelto: outbox > scheduler > envío directo
+    import outbox
+    from scheduler import TELEGRAM_SCHEDULER, scheduler
+    if outbox.OUTBOX_ENABLED:
+        outbox.enqueue_now(chat_id, text)
+        return
+    if TELEGRAM_SCHEDULER:
+        fut = scheduler.submit(chat_id, text)
+        fut.add_done_callback(lambda f: _on_scheduled(f, chat_id, text))
+        return
+    from notifier import send_message
+    send_message(chat_id, text)
+
+
+def _on_scheduled(fut, chat_id: str, text: str):
+    """
+    Si el scheduler no pudo mandar el digest, se loguea y pasa al outbox
+    para que lo reintente (no se pierde en silencio).
+    """
+    if fut.cancelled() or fut.exception() is None:
+        return
+    log_event(log, "digest_send_error", logging.WARNING, chat=chat_id,
+              error=str(fut.exception())[:200], via="scheduler")
+    import outbox
+    try:
+        outbox.enqueue_now(chat_id, text)
+    except Exception as e:
+        log_event(log, "digest_enqueue_error", logging.ERROR, chat=chat_id, error=str(e)[:200])
+
+
+digest = DigestBuffer(
+    _default_send,
+    window=TELEGRAM_DIGEST_WINDOW,
+    max_items=TELEGRAM_DIGEST_MAX_ITEMS,
+)
+atexit.register(digest.flush)
@@ -1,7 +1,26 @@
+import logging
 from datetime import datetime, timezone
-from config import MAX_SIGNALS_PER_DAY, COOLDOWN_MINUTES, MIN_RR
+from config import MAX_SIGNALS_PER_DAY, COOLDOWN_MINUTES, MIN_RR, TELEGRAM_CHAT_ID
 from storage import load_state, save_state, append_trade
 from notifier import send_telegram
+from logs import get_logger, log_event
+import outbox
+
+log = get_logger("engine")
+
+def _notify(text: str) -> None:
+    """
+    El estado ya se guardó cuando se notifica: un fallo de Telegram no debe
+    hacer fallar process_signal. Con outbox se encola (y se reintenta);
+    sin outbox se intenta una vez y se loguea el error.
+    """
+    if outbox.OUTBOX_ENABLED and TELEGRAM_CHAT_ID:
+        outbox.enqueue_now(TELEGRAM_CHAT_ID, text)
+        return
+    try:
+        send_telegram(text)
+    except Exception as e:
+        log_event(log, "telegram_error", logging.WARNING, error=str(e)[:200])
 
 def _utc_now():
     return datetime.now(timezone.utc)
@@ -77,7 +96,7 @@ def process_signal(payload: dict) -> None:
             "state_before": state.copy(),
         })
 
-        send_telegram(
+        _notify(
             f"✅ CIERRE\n"
             f"🪙 {symbol} ⏱ {tf}\n"
             f"📌 {side}\n"
@@ -138,7 +157,7 @@ def process_signal(payload: dict) -> None:
         "rr_min": MIN_RR
     })
 
-    send_telegram(
+    _notify(
         f"📡 SEÑAL\n"
         f"🪙 {symbol} ⏱ {tf}\n"
         f"📌 {side} ({new_pos})\n"
@@ -0,0 +1,22 @@
+"""
+Config de gunicorn (se carga sola si gunicorn arranca en esta carpeta):
+    gunicorn server:app
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+
+
+def on_starting(server):
+    # Migraciones + admin una sola vez, en el master, antes de forkear workers
+    from server import bootstrap
+    import db
+    bootstrap()
+    db.close_pool()
+
+
+def post_fork(server, worker):
+    # cada worker arma su propio pool de conexiones después del fork
+    import db
+    db.reset_pool()
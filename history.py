@@ -0,0 +1,145 @@
+"""
+Historial de señales con paginación por cursor (keyset).
+
+En vez de OFFSET (que lee y descarta todas las filas anteriores), cada
+página arranca donde terminó la otra usando el id:
+
+    before_id=X  -> id < X   ORDER BY id DESC   (más viejas)
+    after_id=X   -> id > X   ORDER BY id ASC    (más nuevas, se devuelven DESC)
+
+Con los índices (filtros..., id) la página N cuesta lo mismo que la
+primera, y es estable aunque entren señales nuevas mientras se navega.
+`since` / `until` filtran por rango sobre la columna nativa `ts`
+(idx_signals_ts): "últimas 24h" es un range scan del índice.
+Con `signals` particionada por mes (Postgres, partitions.py) la página se
+arma recorriendo los meses de a uno desde el lado del cursor y corta
+apenas se completa: la primera página lee solo la partición actual.
+"""
+from datetime import datetime, timedelta, timezone
+
+from db import ts_param
+import partitions
+
+SIGNAL_COLUMNS = "id, ts_utc, symbol, tf, side, price, tp, sl, reason"
+
+_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
+
+def parse_time(value):
+    """
+    ISO 8601 ("2024-05-01", "2024-05-01T10:00:00Z"), epoch en segundos o
+    relativo ("24h", "7d", "30m") -> datetime UTC. None si viene vacío.
+    Lanza ValueError si no se puede interpretar.
+    """
+    value = (value or "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value), timezone.utc)
+    unit = value[-1:].lower()
+    if unit in _UNITS and value[:-1].isdigit():
+        return datetime.now(timezone.utc) - timedelta(**{_UNITS[unit]: int(value[:-1])})
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_id(value):
+    value = (value or "").strip()
+    return int(value) if value else None
+
+
+def parse_args(args, default_limit: int = 200, max_limit: int = 1000) -> dict:
+    """
+    request.args -> filtros normalizados. Lanza ValueError con parámetros
+    inválidos (el endpoint responde 400).
+    """
+    limit = int(args.get("limit") or default_limit)
+    return {
+        "symbol": args.get("symbol", "").strip(),
+        "tf": args.get("tf", "").strip(),
+        "side": args.get("side", "").strip(),
+        "since": parse_time(args.get("since")),
+        "until": parse_time(args.get("until")),
+        "before_id": parse_id(args.get("before_id")),
+        "after_id": parse_id(args.get("after_id")),
+        "limit": max(1, min(limit, max_limit)),
+    }
+
+
+def fetch_page(c, symbol="", tf="", side="", since=None, until=None,
+               before_id=None, after_id=None, limit=200, columns=SIGNAL_COLUMNS) -> dict:
+    """
+    Una página (siempre en orden id DESC) + cursores:
+        {"rows": [...], "before_id": id para la página siguiente (más viejas) o None,
+                        "after_id": id para la anterior (más nuevas) o None}
+    """
+    base = f"SELECT {columns} FROM signals WHERE 1=1"
+    params = []
+    for col, val in (("symbol", symbol), ("tf", tf), ("side", side)):
+        if val:
+            base += f" AND {col}=?"
+            params.append(val)
+
+    newer = after_id is not None and before_id is None
+    if newer:
+        tail, cursor = " AND id > ? ORDER BY id ASC LIMIT ?", [after_id]
+    elif before_id is not None:
+        tail, cursor = " AND id < ? ORDER BY id DESC LIMIT ?", [before_id]
+    else:
+        tail, cursor = " ORDER BY id DESC LIMIT ?", []
+
+    rows = []
+    for lo, hi in partitions.windows(c, since, until, newest_first=not newer):
+        q, p = base, list(params)
+        if lo:
+            q += " AND ts >= ?"
+            p.append(ts_param(lo))
+        if hi:
+            q += " AND ts < ?"
+            p.append(ts_param(hi))
+        # una fila de más para saber si hay otra página sin hacer COUNT
+        rows += c.execute(q + tail, (*p, *cursor, limit + 1 - len(rows))).fetchall()
+        if len(rows) > limit:
+            break
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+
+    if not rows:
+        return {"rows": [], "before_id": None, "after_id": None}
+    # hacia el lado que se pidió sabemos por `more`; hacia el otro, hay
+    # página si vinimos de un cursor
+    older_exists = more if not newer else True
+    newer_exists = more if newer else before_id is not None
+    return {
+        "rows": rows,
+        "before_id": rows[-1]["id"] if older_exists else None,
+        "after_id": rows[0]["id"] if newer_exists else None,
+    }
+
+
+def side_stats(c, since, until=None, symbol="", tf="") -> dict:
+    """
+    Conteo por side en un rango de tiempo: {"total": n, "BUY": n, ...}.
+    Range scan sobre idx_signals_ts (no lee señales fuera del rango).
+    """
+    # agrupar por una expresión (no por la columna) evita que SQLite elija
+    # recorrer idx_signals_side entero para ahorrarse el GROUP BY
+    q = "SELECT COALESCE(side,'') side, COUNT(*) n FROM signals WHERE ts >= ?"
+    params = [ts_param(since)]
+    if until:
+        q += " AND ts < ?"
+        params.append(ts_param(until))
+    for col, val in (("symbol", symbol), ("tf", tf)):
+        if val:
+            q += f" AND {col}=?"
+            params.append(val)
+    q += " GROUP BY COALESCE(side,'')"
+    out = {"total": 0}
+    for r in c.execute(q, tuple(params)).fetchall():
+        out[r["side"]] = r["n"]
+        out["total"] += r["n"]
+    return out
@@ -0,0 +1,68 @@
+"""
+Idempotencia de señales: TradingView reintenta el webhook cuando hay
+timeout, y cada reintento no debe generar otra fila ni otro Telegram.
+
+Clave:
+  - `id` explícito en el payload, o
+  - hash de symbol/tf/side/price/tiempo de vela (`time` o `bar_time`).
+Sin id ni tiempo de vela no hay clave (no se deduplica: dos señales
+iguales en velas distintas son señales distintas).
+
+La tabla `signal_keys` (idem_key PRIMARY KEY) es el respaldo durable y
+delante va un LRU en memoria para contestar duplicados en O(1) sin tocar
+DB ni Telegram.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def signal_key(data: dict):
+    explicit = data.get("id")
+    if explicit is not None and str(explicit).strip():
+        return "id:" + str(explicit).strip()[:200]
+
+    bar_time = data.get("time", data.get("bar_time"))
+    if bar_time is None or not str(bar_time).strip():
+        return None
+
+    parts = [
+        str(data.get("symbol", "")).strip().upper(),
+        str(data.get("tf", "")).strip(),
+        str(data.get("side", "")).strip().upper(),
+        str(data.get("price", "")).strip(),
+        str(bar_time).strip(),
+    ]
+    return "h:" + hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    LRU thread-safe de tamaño fijo: clave -> resultado original.
+    """
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = max(1, int(maxsize))
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            v = self._d.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self._d.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key, value):
+        with self._lock:
+            self._d[key] = value
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._d), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
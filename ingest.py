@@ -0,0 +1,114 @@
+"""
+Cola de ingesta asíncrona para /webhook.
+
+El request solo parsea, autentica y encola; un pool de workers en segundo
+plano drena la cola (DB + Telegram). Así un Telegram lento no bloquea la
+ingesta ni ocupa los workers de gunicorn.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from logs import get_logger, log_event
+
+log = get_logger("ingest")
+
+
+class IngestQueue:
+    """
+    Cola acotada + pool de workers.
+
+        q = IngestQueue(handler, workers=2, maxsize=1000)
+        if not q.submit(job):
+            # cola llena -> 503
+    """
+    def __init__(self, handler, workers: int = 2, maxsize: int = 1000, name: str = "ingest"):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.maxsize = max(1, int(maxsize))
+        self.name = name
+
+        self._q = queue.Queue(maxsize=self.maxsize)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._threads = []
+
+        # métricas
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._lags = deque(maxlen=1024)  # ms entre encolar y empezar a procesar
+        self._lag_max = 0.0
+
+    def start(self):
+        # fork-safe: los threads no sobreviven al fork de gunicorn, así que
+        # cada proceso arranca los suyos la primera vez que encola.
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._q = queue.Queue(maxsize=self.maxsize)
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = pid
+
+    def submit(self, job) -> bool:
+        self.start()
+        try:
+            self._q.put_nowait((time.monotonic(), job))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def _worker(self):
+        while True:
+            t0, job = self._q.get()
+            lag = (time.monotonic() - t0) * 1000.0
+            self._lags.append(lag)
+            if lag > self._lag_max:
+                self._lag_max = lag
+            try:
+                self.handler(job)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                log_event(log, "ingest_worker_error", logging.ERROR, queue=self.name, error=str(e)[:200])
+            finally:
+                self._q.task_done()
+
+    def join(self):
+        """Espera a que la cola quede vacía (útil en scripts)."""
+        self._q.join()
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        n = len(lags)
+
+        def pct(p):
+            if not n:
+                return 0.0
+            return round(lags[min(n - 1, int(p * n))], 2)
+
+        return {
+            "depth": self._q.qsize(),
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "lag_ms_p50": pct(0.50),
+            "lag_ms_p99": pct(0.99),
+            "lag_ms_max": round(self._lag_max, 2),
+        }
@@ -0,0 +1,165 @@
+"""
+Logging estructurado (JSON lines) no bloqueante para el hot path.
+
+El request solo arma el registro y lo mete en una cola en memoria; un
+thread aparte lo formatea y lo escribe a stdout. Si la cola se llena se
+descartan registros (y se cuentan) en vez de frenar el request.
+
+    from logs import get_logger, log_event, payload_for_log
+    log = get_logger("webhook")
+    log_event(log, "webhook_received", payload=payload_for_log(data))
+
+Config:
+    LOG_LEVEL            INFO
+    LOG_FORMAT           json | text
+    LOG_QUEUE_SIZE       10000
+    LOG_PAYLOAD_SAMPLE   fracción de payloads que se loguean (0..1)
+    LOG_REDACT_KEYS      claves que se reemplazan por "***"
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").strip().lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PAYLOAD_SAMPLE = float(os.getenv("LOG_PAYLOAD_SAMPLE", "1.0"))
+LOG_REDACT_KEYS = {
+    k.strip().lower()
+    for k in os.getenv("LOG_REDACT_KEYS", "passphrase,sig,nonce,secret,token").split(",")
+    if k.strip()
+}
+
+_STD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _STD_ATTRS and not k.startswith("_"):
+                out[k] = v
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler acotado y fork-safe: el listener (thread escritor) se
+    arranca en el proceso que emite, así sobrevive al fork de gunicorn.
+    """
+    def __init__(self, target: logging.Handler, maxsize: int):
+        super().__init__(queue.Queue(maxsize=max(1, maxsize)))
+        self.target = target
+        self.maxsize = max(1, maxsize)
+        self.dropped = 0
+        self._pid = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self.queue = queue.Queue(maxsize=self.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, self.target)
+            self._listener.start()
+            self._pid = pid
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # el formateo (json.dumps) lo hace el thread escritor, no el request
+        return record
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def _get_handler():
+    global _handler
+    if _handler is None:
+        with _handler_lock:
+            if _handler is None:
+                target = logging.StreamHandler(sys.stdout)
+                if LOG_FORMAT == "json":
+                    target.setFormatter(JsonFormatter())
+                else:
+                    target.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+                _handler = AsyncQueueHandler(target, LOG_QUEUE_SIZE)
+                # al salir, vaciar lo que quede en la cola
+                atexit.register(_handler.stop)
+    return _handler
+
+
+def get_logger(name: str) -> logging.Logger:
+    log = logging.getLogger(f"bancripfut.{name}")
+    if not log.handlers:
+        log.addHandler(_get_handler())
+        log.setLevel(LOG_LEVEL)
+        log.propagate = False
+    return log
+
+
+def log_event(log: logging.Logger, event: str, level: int = logging.INFO, **fields):
+    """
+    Un evento = una línea JSON: {"msg": event, ...fields}
+    """
+    if log.isEnabledFor(level):
+        log.log(level, event, extra=fields)
+
+
+def redact(data):
+    if isinstance(data, dict):
+        return {
+            k: ("***" if str(k).lower() in LOG_REDACT_KEYS else redact(v))
+            for k, v in data.items()
+        }
+    if isinstance(data, list):
+        return [redact(v) for v in data]
+    return data
+
+
+def payload_for_log(data):
+    """
+    Payload redactado, o None si este request no salió sorteado.
+    """
+    if LOG_PAYLOAD_SAMPLE <= 0 or (LOG_PAYLOAD_SAMPLE < 1 and random.random() >= LOG_PAYLOAD_SAMPLE):
+        return None
+    return redact(data)
+
+
+def log_stats() -> dict:
+    h = _handler
+    if h is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": h.queue.qsize(), "dropped": h.dropped}
+
@@ -0,0 +1,317 @@
+"""
+Anti-replay de nonces para el webhook.
+
+Un nonce se recuerda mientras su `ts` siga siendo aceptable por el chequeo
+de skew (|now - ts| <= MAX_SKEW), o sea hasta ts + MAX_SKEW. Después ya no
+hace falta: cualquier replay lo rechaza el chequeo de ts.
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from logs import get_logger, log_event
+
+log = get_logger("nonces")
+
+
+class NonceStoreFull(Exception):
+    pass
+
+
+class MemoryNonceStore:
+    """
+    Ring de buckets por segundo de expiración + índice nonce -> segundo.
+
+    - insert / lookup: O(1)
+    - expiración: por tiempo (no por cantidad), O(1) amortizado: cada
+      segundo se barre una sola vez y cada nonce se borra una sola vez.
+    - memoria acotada por max_entries; si se llena se rechaza (fail closed)
+      en vez de desalojar nonces vivos, que es lo que habilitaría replays.
+    """
+    def __init__(self, max_skew: int, max_entries: int = 200000):
+        self.max_skew = int(max_skew)
+        self.max_entries = int(max_entries)
+        # expiración posible: ts + max_skew, con ts en [now-max_skew, now+max_skew]
+        self.size = 2 * self.max_skew + 2
+        self._buckets = [set() for _ in range(self.size)]
+        self._bucket_sec = [None] * self.size
+        self._index = {}
+        self._swept = int(time.time())
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.inserts = 0
+        self.expired = 0
+        self.rejected_full = 0
+
+    def _expire(self, now: int):
+        if now <= self._swept:
+            return
+        # si estuvo inactivo más de una vuelta del ring, alcanza con una vuelta
+        start = max(self._swept + 1, now - self.size + 1)
+        for sec in range(start, now + 1):
+            i = sec % self.size
+            bsec = self._bucket_sec[i]
+            if bsec is not None and bsec <= now:
+                for n in self._buckets[i]:
+                    self._index.pop(n, None)
+                self.expired += len(self._buckets[i])
+                self._buckets[i] = set()
+                self._bucket_sec[i] = None
+        self._swept = now
+
+    def seen(self, nonce: str, ts: int) -> bool:
+        """
+        True si el nonce ya se usó dentro de la ventana; si no, lo registra.
+        """
+        now = int(time.time())
+        exp = int(ts) + self.max_skew + 1
+        with self._lock:
+            self._expire(now)
+            if nonce in self._index:
+                self.hits += 1
+                return True
+            if len(self._index) >= self.max_entries:
+                self.rejected_full += 1
+                raise NonceStoreFull("nonce store full")
+
+            i = exp % self.size
+            if self._bucket_sec[i] != exp:
+                # bucket de una vuelta anterior todavía sin barrer
+                for n in self._buckets[i]:
+                    self._index.pop(n, None)
+                self._buckets[i] = set()
+                self._bucket_sec[i] = exp
+            self._buckets[i].add(nonce)
+            self._index[nonce] = exp
+            self.inserts += 1
+            return False
+
+    def __len__(self):
+        return len(self._index)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._index),
+            "max_entries": self.max_entries,
+            "buckets": self.size,
+            "inserts": self.inserts,
+            "replays": self.hits,
+            "expired": self.expired,
+            "rejected_full": self.rejected_full,
+        }
+
+
+class DBNonceStore:
+    """
+    Ventana anti-replay compartida por todos los workers: tabla
+    webhook_nonces (PK = nonce) en SQLite-WAL o Postgres.
+
+    El INSERT ... ON CONFLICT es atómico: si el nonce existe y sigue vivo no
+    se toca ninguna fila (rowcount 0 = replay). Si existe pero ya expiró
+    (todavía no barrido) se reutiliza.
+
+    Los expirados se borran en batch desde un thread barrendero cada
+    `sweep_seconds`, nunca en el request.
+    """
+    def __init__(self, max_skew: int, sweep_seconds: int = 60, sweep_batch: int = 5000):
+        self.max_skew = int(max_skew)
+        self.sweep_seconds = max(1, int(sweep_seconds))
+        self.sweep_batch = max(1, int(sweep_batch))
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.inserts = 0
+        self.swept = 0
+
+    def _start_sweeper(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            threading.Thread(target=self._sweep_loop, name="nonce-sweeper", daemon=True).start()
+            self._pid = pid
+
+    def seen(self, nonce: str, ts: int) -> bool:
+        from db import conn
+
+        self._start_sweeper()
+        now = int(time.time())
+        with conn() as c:
+            c.execute(
+                "INSERT INTO webhook_nonces(nonce,expires_at) VALUES(?,?) "
+                "ON CONFLICT(nonce) DO UPDATE SET expires_at=excluded.expires_at "
+                "WHERE webhook_nonces.expires_at <= ?",
+                (nonce, int(ts) + self.max_skew + 1, now)
+            )
+            fresh = c.rowcount == 1
+            c.commit(strict=True)
+        if fresh:
+            self.inserts += 1
+            return False
+        self.hits += 1
+        return True
+
+    def sweep(self) -> int:
+        """
+        Borra expirados en batches acotados. Devuelve cuántos borró.
+        """
+        from db import conn
+
+        total = 0
+        now = int(time.time())
+        while True:
+            with conn() as c:
+                c.execute(
+                    "DELETE FROM webhook_nonces WHERE nonce IN "
+                    "(SELECT nonce FROM webhook_nonces WHERE expires_at <= ? LIMIT ?)",
+                    (now, self.sweep_batch)
+                )
+                n = c.rowcount or 0
+                c.commit()
+            total += n
+            if n < self.sweep_batch:
+                break
+        self.swept += total
+        return total
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_seconds)
+            try:
+                self.sweep()
+            except Exception as e:
+                log_event(log, "nonce_sweep_error", logging.ERROR, error=str(e)[:200])
+
+    def stats(self) -> dict:
+        return {
+            "backend": "db",
+            "inserts": self.inserts,
+            "replays": self.hits,
+            "swept": self.swept,
+            "sweep_seconds": self.sweep_seconds,
+        }
+
+
+class ShmNonceStore:
+    """
+    Hash table en memoria compartida (mmap de un archivo en /dev/shm) para
+    que todos los workers de gunicorn de la misma máquina compartan la
+    ventana sin tocar la DB.
+
+    Slots de 16 bytes: (clave u64, expira u64). Clave = blake2b-64 del nonce.
+    Open addressing con probing lineal acotado a `max_probe` slots desde la
+    posición inicial: una clave siempre vive dentro de esa ventana, así que
+    lookup/insert son O(max_probe) y los slots expirados se reutilizan sin
+    necesidad de barrer.
+    Lock entre procesos con flock (un fd propio por proceso).
+    """
+    _SLOT = struct.Struct("<QQ")
+
+    def __init__(self, max_skew: int, path: str = None, slots: int = 65536, max_probe: int = 64):
+        self.max_skew = int(max_skew)
+        self.slots = max(1024, int(slots))
+        self.max_probe = max(1, min(int(max_probe), self.slots))
+        if not path:
+            base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            path = os.path.join(base, "bancripfut_nonces")
+        self.path = path
+        self._pid = None
+        self._fd = None
+        self._mm = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.inserts = 0
+        self.rejected_full = 0
+
+    def _open(self):
+        # fd y mmap por proceso: flock es por "open file description" y un fd
+        # heredado por fork compartiría el lock con el padre
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        size = self.slots * self._SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._mm = mmap.mmap(fd, size)
+        self._pid = pid
+
+    @staticmethod
+    def _key(nonce: str) -> int:
+        k = int.from_bytes(hashlib.blake2b(nonce.encode("utf-8"), digest_size=8).digest(), "little")
+        return k or 1
+
+    def seen(self, nonce: str, ts: int) -> bool:
+        key = self._key(nonce)
+        now = int(time.time())
+        exp = int(ts) + self.max_skew + 1
+        unpack, pack, step = self._SLOT.unpack_from, self._SLOT.pack_into, self._SLOT.size
+
+        with self._lock:
+            self._open()
+            mm = self._mm
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                i = key % self.slots
+                reuse = None
+                for _ in range(self.max_probe):
+                    k, e = unpack(mm, i * step)
+                    if k == key and e > now:
+                        self.hits += 1
+                        return True
+                    if k == 0:
+                        if reuse is None:
+                            reuse = i
+                        break
+                    if reuse is None and e <= now:
+                        reuse = i
+                    i = (i + 1) % self.slots
+                if reuse is None:
+                    self.rejected_full += 1
+                    raise NonceStoreFull("nonce store full")
+                pack(mm, reuse * step, key, exp)
+                self.inserts += 1
+                return False
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "shm",
+            "path": self.path,
+            "slots": self.slots,
+            "inserts": self.inserts,
+            "replays": self.hits,
+            "rejected_full": self.rejected_full,
+        }
+
+
+def make_nonce_store(backend: str, max_skew: int, **opts):
+    """
+    backend: memory (por proceso) | db (tabla compartida) | shm (memoria compartida)
+    """
+    backend = (backend or "memory").strip().lower()
+    if backend == "db":
+        return DBNonceStore(max_skew, sweep_seconds=opts.get("sweep_seconds", 60))
+    if backend == "shm":
+        return ShmNonceStore(max_skew, path=opts.get("shm_path"), slots=opts.get("shm_slots", 65536))
+    if backend == "memory":
+        return MemoryNonceStore(max_skew, max_entries=opts.get("max_entries", 200000))
+    raise ValueError(f"NONCE_BACKEND desconocido: {backend}")
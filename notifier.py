@@ -1,14 +1,268 @@
+"""
+Notificador Telegram único (server.py, engine.py, bot.py y el outbox).
+
+- Una requests.Session por proceso con pool keep-alive hacia
+  api.telegram.org: los mensajes reutilizan la conexión TLS.
+- Timeouts consistentes (connect / read) en todos los envíos.
+- API sync (send_message / notify / send_telegram) y async (asend_message /
+  anotify). La async usa aiohttp si está instalado; si no, delega al
+  cliente sync en un thread.
+- Circuit breaker por proceso (breaker.py): si Telegram viene fallando,
+  los envíos lanzan CircuitOpenError al instante en vez de esperar el
+  timeout. Errores de red y 5xx cuentan como fallo; un 4xx no (Telegram
+  respondió), y un 429 no cambia el estado.
+
+Config:
+    TELEGRAM_API_BASE         https://api.telegram.org (apuntar a un stub en pruebas)
+    TELEGRAM_CONNECT_TIMEOUT  5
+    TELEGRAM_READ_TIMEOUT     10
+    TELEGRAM_POOL_SIZE        10
+    TELEGRAM_BREAKER_WINDOW        30   seg de la ventana de tasa de fallos
+    TELEGRAM_BREAKER_MIN_CALLS     10   llamadas mínimas en la ventana para abrir
+    TELEGRAM_BREAKER_FAILURE_RATE  0.5
+    TELEGRAM_BREAKER_OPEN_SECONDS  30   seg abierto antes de probar (half-open)
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from breaker import CircuitBreaker
 from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
+from logs import get_logger, log_event
+
+try:
+    import aiohttp  # opcional
+except ImportError:
+    aiohttp = None
+
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "10"))
+TELEGRAM_BREAKER_WINDOW = float(os.getenv("TELEGRAM_BREAKER_WINDOW", "30"))
+TELEGRAM_BREAKER_MIN_CALLS = int(os.getenv("TELEGRAM_BREAKER_MIN_CALLS", "10"))
+TELEGRAM_BREAKER_FAILURE_RATE = float(os.getenv("TELEGRAM_BREAKER_FAILURE_RATE", "0.5"))
+TELEGRAM_BREAKER_OPEN_SECONDS = float(os.getenv("TELEGRAM_BREAKER_OPEN_SECONDS", "30"))
+
+log = get_logger("notifier")
+
+
+class TelegramError(Exception):
+    """
+    Error de envío. `status` = HTTP status (None si fue de red),
+    `retry_after` = segundos pedidos por Telegram en un 429.
+    """
+    def __init__(self, message: str, status: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(TelegramError):
+    """
+    El breaker está abierto: no se intentó el envío.
+    `retry_after` = segundos hasta la próxima prueba.
+    """
+
+
+breaker = CircuitBreaker(
+    "telegram",
+    window=TELEGRAM_BREAKER_WINDOW,
+    min_calls=TELEGRAM_BREAKER_MIN_CALLS,
+    failure_rate=TELEGRAM_BREAKER_FAILURE_RATE,
+    open_seconds=TELEGRAM_BREAKER_OPEN_SECONDS,
+)
+
+
+def _check_breaker():
+    if not breaker.allow():
+        raise CircuitOpenError("telegram circuit open", retry_after=max(0.1, breaker.retry_after()))
+
+
+def _record(status):
+    # status None = error de red
+    if status == 429:
+        breaker.release()
+    else:
+        breaker.record(status is not None and status < 500)
+
+
+def _url(token: str) -> str:
+    return f"{TELEGRAM_API_BASE}/bot{token}/sendMessage"
+
+
+def _error_from(status: int, body) -> TelegramError:
+    desc, retry_after = "", None
+    if isinstance(body, dict):
+        desc = str(body.get("description", ""))
+        retry_after = (body.get("parameters") or {}).get("retry_after")
+    return TelegramError(
+        f"telegram {status}: {desc[:200]}",
+        status=status,
+        retry_after=float(retry_after) if retry_after is not None else None,
+    )
+
+
+# =========================
+# SYNC (Session con pool, una por proceso)
+# =========================
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            # los sockets heredados del padre no se reutilizan después del fork
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TELEGRAM_POOL_SIZE, max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session, _session_pid = s, pid
+    return _session
+
+
+def send_message(chat_id: str, text: str, timeout: float = None) -> dict:
+    """
+    Envía a un chat puntual. Lanza TelegramError si Telegram no responde 200
+    (el outbox y el scheduler usan eso para reintentar).
+    `timeout` (seg) acota el read timeout, p.ej. con el deadline del request.
+    """
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
+        raise TelegramError("Telegram no configurado (token/chat_id faltante)")
+
+    _check_breaker()
+    read_timeout = TELEGRAM_READ_TIMEOUT if timeout is None else max(0.1, min(timeout, TELEGRAM_READ_TIMEOUT))
+    t0 = time.perf_counter()
+    try:
+        r = _get_session().post(
+            _url(TELEGRAM_BOT_TOKEN),
+            json={"chat_id": chat_id, "text": text},
+            timeout=(min(TELEGRAM_CONNECT_TIMEOUT, read_timeout), read_timeout),
+        )
+    except requests.RequestException as e:
+        _record(None)
+        log_event(log, "telegram_error", logging.WARNING, error=str(e)[:200],
+                  latency_ms=round((time.perf_counter() - t0) * 1000, 1))
+        raise TelegramError(str(e)) from e
+
+    _record(r.status_code)
+    ok = r.status_code == 200
+    log_event(log, "telegram", logging.INFO if ok else logging.WARNING,
+              http_status=r.status_code,
+              latency_ms=round((time.perf_counter() - t0) * 1000, 1),
+              error=None if ok else r.text[:200])
+    try:
+        body = r.json()
+    except ValueError:
+        body = None
+    if not ok:
+        raise _error_from(r.status_code, body)
+    return body or {}
+
+
+def notify(text: str, chat_id: str = None, timeout: float = None) -> bool:
+    """
+    Como send_message pero nunca lanza: devuelve True si salió.
+    Sin chat_id usa TELEGRAM_CHAT_ID.
+    """
+    chat_id = chat_id or TELEGRAM_CHAT_ID
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
+        log_event(log, "telegram_not_configured", logging.WARNING)
+        return False
+    try:
+        send_message(chat_id, text, timeout=timeout)
+        return True
+    except TelegramError:
+        return False
+
 
 def send_telegram(text: str) -> None:
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print("⚠️ Telegram no configurado (token/chat_id faltante).")
+        log_event(log, "telegram_not_configured", logging.WARNING)
         return
+    send_message(TELEGRAM_CHAT_ID, text)
+
+
+# =========================
+# ASYNC
+# =========================
+_aio_sessions = {}
+
+
+async def _aio_session():
+    # una ClientSession (con su pool) por event loop
+    loop = asyncio.get_running_loop()
+    s = _aio_sessions.get(loop)
+    if s is None or s.closed:
+        s = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=TELEGRAM_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(sock_connect=TELEGRAM_CONNECT_TIMEOUT, sock_read=TELEGRAM_READ_TIMEOUT),
+        )
+        _aio_sessions[loop] = s
+    return s
+
+
+async def asend_message(chat_id: str, text: str, timeout: float = None) -> dict:
+    if aiohttp is None:
+        return await asyncio.to_thread(send_message, chat_id, text, timeout)
+
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
+        raise TelegramError("Telegram no configurado (token/chat_id faltante)")
+
+    _check_breaker()
+    session = await _aio_session()
+    t0 = time.perf_counter()
+    try:
+        kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        async with session.post(
+            _url(TELEGRAM_BOT_TOKEN),
+            json={"chat_id": chat_id, "text": text},
+            **kwargs,
+        ) as r:
+            try:
+                body = await r.json(content_type=None)
+            except ValueError:
+                body = None
+            status = r.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        _record(None)
+        log_event(log, "telegram_error", logging.WARNING, error=str(e)[:200],
+                  latency_ms=round((time.perf_counter() - t0) * 1000, 1))
+        raise TelegramError(str(e)) from e
+
+    _record(status)
+    log_event(log, "telegram", logging.INFO if status == 200 else logging.WARNING,
+              http_status=status, latency_ms=round((time.perf_counter() - t0) * 1000, 1))
+    if status != 200:
+        raise _error_from(status, body)
+    return body or {}
+
+
+async def anotify(text: str, chat_id: str = None, timeout: float = None) -> bool:
+    chat_id = chat_id or TELEGRAM_CHAT_ID
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
+        log_event(log, "telegram_not_configured", logging.WARNING)
+        return False
+    try:
+        await asend_message(chat_id, text, timeout=timeout)
+        return True
+    except TelegramError:
+        return False
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text}
 
-    r = requests.post(url, json=payload, timeout=30)
-    print("📨 Telegram status:", r.status_code, r.text[:200])
-    r.raise_for_status()
+async def aclose():
+    """Cierra la ClientSession del loop actual (al apagar)."""
+    s = _aio_sessions.pop(asyncio.get_running_loop(), None)
+    if s is not None:
+        await s.close()
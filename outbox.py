@@ -0,0 +1,306 @@
+"""
+Outbox persistente de Telegram.
+
+Los mensajes se escriben en la tabla `outbox` en la MISMA transacción que
+la señal (si el INSERT de la señal hace rollback, el mensaje tampoco
+existe). Un pool de workers reclama filas en batch, envía, y marca
+DELIVERED; si falla reprograma con backoff exponencial + jitter.
+
+Sobrevive reinicios: una fila reclamada por un proceso que murió vuelve a
+estar disponible cuando vence su lease.
+
+Estados: PENDING -> SENDING -> DELIVERED
+                            \\-> PENDING (reintento) ... -> FAILED
+"""
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from db import conn
+from logs import get_logger, log_event
+from notifier import CircuitOpenError
+
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "0").strip() == "1"
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "20"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1.0"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "12"))
+OUTBOX_BASE_DELAY = float(os.getenv("OUTBOX_BASE_DELAY", "2"))     # seg
+OUTBOX_MAX_DELAY = float(os.getenv("OUTBOX_MAX_DELAY", "900"))     # seg
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+# espera máxima por el scheduler: siempre menor que el lease, si no otro
+# worker reclama la fila mientras este sigue esperando
+OUTBOX_SEND_TIMEOUT = min(
+    float(os.getenv("OUTBOX_SEND_TIMEOUT", str(OUTBOX_LEASE_SECONDS / 2))),
+    OUTBOX_LEASE_SECONDS * 0.8,
+)
+OUTBOX_KEEP_HOURS = float(os.getenv("OUTBOX_KEEP_HOURS", "72"))     # DELIVERED se purgan después
+
+log = get_logger("outbox")
+
+INSERT_OUTBOX_SQL = (
+    "INSERT INTO outbox(created_at,chat_id,text,status,attempts,next_attempt_at) "
+    "VALUES(?,?,?,'PENDING',0,?)"
+)
+
+
+class SendDeferred(Exception):
+    """
+    El mensaje no llegó a enviarse (p.ej. seguía en la cola del scheduler):
+    la fila vuelve a PENDING sin gastar intento.
+    """
+    def __init__(self, msg: str, retry_after: float = None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+def enqueue(c, chat_id: str, text: str):
+    """
+    Encola dentro de la transacción de `c` (no hace commit).
+    """
+    now = int(time.time())
+    c.execute(INSERT_OUTBOX_SQL, (now, str(chat_id), text, now))
+
+
+def enqueue_many(c, messages):
+    """
+    messages: lista de (chat_id, text). Misma transacción que `c`.
+    """
+    if not messages:
+        return
+    now = int(time.time())
+    c.executemany(INSERT_OUTBOX_SQL, [(now, str(chat), text, now) for chat, text in messages])
+
+
+def enqueue_now(chat_id: str, text: str):
+    """
+    Encola en su propia transacción (para llamadores sin DB, p.ej. engine).
+    """
+    with conn() as c:
+        enqueue(c, chat_id, text)
+        c.commit(strict=True)
+    outbox_worker.wake()
+
+
+def backoff_delay(attempts: int) -> float:
+    """
+    Exponencial con tope y jitter completo-ish (50%..150%) para no
+    sincronizar reintentos de muchos mensajes.
+    """
+    base = min(OUTBOX_MAX_DELAY, OUTBOX_BASE_DELAY * (2 ** max(0, attempts - 1)))
+    return base * random.uniform(0.5, 1.5)
+
+
+class OutboxWorker:
+    """
+        outbox_worker = OutboxWorker(send_fn)   # send_fn(chat_id, text) lanza si falla
+        outbox_worker.start()                   # idempotente, fork-safe
+    """
+    def __init__(self, send_fn, workers: int = 2, batch: int = 20, poll: float = 1.0):
+        self.send_fn = send_fn
+        self.workers = max(1, int(workers))
+        self.batch = max(1, int(batch))
+        self.poll = max(0.05, float(poll))
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._next_purge = 0.0
+
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.deferred = 0
+        self.lost = 0           # filas que otro worker reclamó antes de enviarlas
+
+    def start(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._wake = threading.Event()
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True).start()
+            self._pid = pid
+
+    def wake(self):
+        self._wake.set()
+
+    def claim(self, worker_id: str):
+        """
+        Reclama hasta `batch` filas vencidas (PENDING o SENDING con lease
+        vencido) y las devuelve (dicts con su `token` de reclamo). SKIP
+        LOCKED en Postgres para que varios workers/procesos no se pisen; en
+        SQLite el UPDATE ya es atómico.
+        """
+        now = int(time.time())
+        token = f"{worker_id}:{uuid.uuid4().hex[:12]}"
+        with conn() as c:
+            skip = " FOR UPDATE SKIP LOCKED" if c.kind == "postgres" else ""
+            c.execute(
+                "UPDATE outbox SET status='SENDING', claimed_by=?, lease_until=? "
+                "WHERE id IN (SELECT id FROM outbox WHERE "
+                "(status='PENDING' AND next_attempt_at<=?) OR (status='SENDING' AND lease_until<?) "
+                "ORDER BY id LIMIT ?" + skip + ") "
+                "AND (status='PENDING' OR lease_until<?)",
+                (token, now + OUTBOX_LEASE_SECONDS, now, now, self.batch, now)
+            )
+            c.commit(strict=True)
+            rows = c.execute(
+                "SELECT id, chat_id, text, attempts FROM outbox WHERE claimed_by=? AND status='SENDING' ORDER BY id",
+                (token,)
+            ).fetchall()
+        return [{**dict(r), "token": token} for r in rows]
+
+    def _renew(self, row) -> bool:
+        """
+        Lease nuevo justo antes de enviar: el lease del claim cubre el
+        batch, no N envíos en serie. False si la fila ya no es nuestra
+        (venció y la reclamó otro worker): no se envía.
+        """
+        with conn() as c:
+            c.execute(
+                "UPDATE outbox SET lease_until=? WHERE id=? AND claimed_by=? AND status='SENDING'",
+                (int(time.time()) + OUTBOX_LEASE_SECONDS, row["id"], row["token"])
+            )
+            mine = c.rowcount == 1
+            c.commit()
+        return mine
+
+    def _deliver(self, row):
+        if not self._renew(row):
+            self.lost += 1
+            return
+        # todos los UPDATE filtran por el token: si igual perdimos la fila,
+        # no pisamos el estado del que la reclamó después
+        try:
+            self.send_fn(row["chat_id"], row["text"])
+        except Exception as e:
+            if isinstance(e, (CircuitOpenError, SendDeferred)):
+                # no se intentó: reprogramar (breaker / cola del scheduler), sin gastar intento
+                with conn() as c:
+                    c.execute(
+                        "UPDATE outbox SET status='PENDING', next_attempt_at=?, claimed_by=NULL "
+                        "WHERE id=? AND claimed_by=?",
+                        (int(time.time() + max(1.0, e.retry_after or 1.0)), row["id"], row["token"])
+                    )
+                    c.commit()
+                self.deferred += 1
+                return
+            attempts = int(row["attempts"]) + 1
+            with conn() as c:
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    c.execute(
+                        "UPDATE outbox SET status='FAILED', attempts=?, last_error=?, claimed_by=NULL "
+                        "WHERE id=? AND claimed_by=?",
+                        (attempts, str(e)[:500], row["id"], row["token"])
+                    )
+                    self.failed += 1
+                else:
+                    c.execute(
+                        "UPDATE outbox SET status='PENDING', attempts=?, last_error=?, next_attempt_at=?, "
+                        "claimed_by=NULL WHERE id=? AND claimed_by=?",
+                        (attempts, str(e)[:500], int(time.time() + backoff_delay(attempts)), row["id"], row["token"])
+                    )
+                    self.retried += 1
+                c.commit()
+            log_event(log, "outbox_retry", logging.WARNING, id=row["id"], attempts=attempts, error=str(e)[:200])
+            return
+
+        with conn() as c:
+            c.execute(
+                "UPDATE outbox SET status='DELIVERED', attempts=attempts+1, delivered_at=?, claimed_by=NULL "
+                "WHERE id=? AND claimed_by=?",
+                (int(time.time()), row["id"], row["token"])
+            )
+            c.commit()
+        self.delivered += 1
+
+    def purge(self) -> int:
+        """
+        Borra DELIVERED viejos para que la tabla no crezca sin límite.
+        """
+        cutoff = int(time.time() - OUTBOX_KEEP_HOURS * 3600)
+        with conn() as c:
+            c.execute("DELETE FROM outbox WHERE status='DELIVERED' AND delivered_at < ?", (cutoff,))
+            n = c.rowcount or 0
+            c.commit()
+        return n
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + 600
+        self.purge()
+
+    def run_once(self, worker_id: str = "manual") -> int:
+        rows = self.claim(worker_id)
+        for row in rows:
+            self._deliver(row)
+        return len(rows)
+
+    def _run(self):
+        worker_id = f"{os.getpid()}-{threading.current_thread().name}"
+        while True:
+            try:
+                self._maybe_purge()
+                n = self.run_once(worker_id)
+            except Exception as e:
+                log_event(log, "outbox_error", logging.ERROR, error=str(e)[:200])
+                n = 0
+            if n < self.batch:
+                # nada (o poco) pendiente: dormir hasta el próximo poll o un wake()
+                self._wake.wait(self.poll)
+                self._wake.clear()
+
+    def stats(self) -> dict:
+        out = {
+            "workers": self.workers,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.failed,
+            "deferred": self.deferred,
+            "lost": self.lost,
+        }
+        try:
+            with conn() as c:
+                r = c.execute(
+                    "SELECT COUNT(*) n FROM outbox WHERE status IN ('PENDING','SENDING')"
+                ).fetchone()
+            out["pending"] = r["n"]
+        except Exception:
+            pass
+        return out
+
+
+def _default_send(chat_id: str, text: str):
+    from scheduler import TELEGRAM_SCHEDULER, scheduler
+    if TELEGRAM_SCHEDULER:
+        # respeta los límites de Telegram; lanza si el scheduler se rinde
+        fut = scheduler.submit(chat_id, text)
+        try:
+            fut.result(OUTBOX_SEND_TIMEOUT)
+        except FutureTimeout:
+            if fut.cancel():
+                # nunca salió de la cola: liberar la fila y reintentar más tarde
+                raise SendDeferred("scheduler backlog", retry_after=OUTBOX_BASE_DELAY)
+            # ya estaba en vuelo: cuenta como intento fallido (at-least-once)
+            raise TimeoutError(f"scheduler send > {OUTBOX_SEND_TIMEOUT:g}s")
+        return
+    from notifier import send_message
+    send_message(chat_id, text)
+
+
+outbox_worker = OutboxWorker(
+    _default_send,
+    workers=OUTBOX_WORKERS,
+    batch=OUTBOX_BATCH,
+    poll=OUTBOX_POLL_SECONDS,
+)
@@ -0,0 +1,412 @@
+"""
+Particiones mensuales de `signals` y retención con archivo a disco.
+
+Postgres: `python db.py partition-signals` convierte `signals` (una vez,
+en una ventana de mantenimiento: bloquea la tabla mientras copia) en una
+tabla particionada por RANGE (ts), una partición por mes:
+
+    signals_2024_05   [2024-05-01, 2024-06-01)
+
+Las particiones se crean SIGNALS_PARTITION_AHEAD meses por adelantado al
+arrancar el server, desde un thread por proceso cada
+SIGNALS_PARTITION_CHECK_SECONDS (un server que no se reinicia en meses
+sigue teniendo el mes siguiente) y en cada corrida de `python db.py
+partitions` / `retention`. Si igual llega una fila sin partición, el
+INSERT crea las que faltan y se reintenta una vez (ver
+is_missing_partition). Con `ts >= ?` el planner descarta las
+particiones fuera de rango, y el historial (history.py) recorre los meses
+de a uno, así la primera página del dashboard lee solo el mes actual.
+
+Retención (`python db.py retention [meses]`): cada mes más viejo que
+SIGNALS_RETENTION_MONTHS se vuelca a SIGNALS_ARCHIVE_DIR/signals_AAAA_MM.csv.gz
+y sale de la base:
+  - Postgres particionado: DETACH + DROP de la partición (sin DELETE fila
+    por fila, sin bloat ni vacuum).
+  - SQLite (o Postgres sin particionar): por lotes cortos; cada lote se
+    agrega al .csv.gz (un miembro gzip por lote) ANTES de borrarlo, así una
+    caída a mitad de camino puede repetir filas en el archivo pero nunca
+    perderlas. El espacio del .db se recupera con VACUUM.
+En la misma transacción se descuentan los contadores del dashboard y se
+borran las claves de idempotencia de lo archivado.
+
+Config:
+    SIGNALS_PARTITION_AHEAD     3    meses creados por adelantado
+    SIGNALS_PARTITION_CHECK_SECONDS  3600  cada cuánto se revisan en proceso
+    SIGNALS_RETENTION_MONTHS    0    meses en la base (0 = no archivar)
+    SIGNALS_ARCHIVE_DIR         archive
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from db import conn, ts_param, _is_postgres
+from logs import get_logger, log_event
+import counters
+import payloads
+
+SIGNALS_PARTITION_AHEAD = int(os.getenv("SIGNALS_PARTITION_AHEAD", "3"))
+SIGNALS_PARTITION_CHECK_SECONDS = float(os.getenv("SIGNALS_PARTITION_CHECK_SECONDS", "3600"))
+SIGNALS_RETENTION_MONTHS = int(os.getenv("SIGNALS_RETENTION_MONTHS", "0"))
+SIGNALS_ARCHIVE_DIR = os.getenv("SIGNALS_ARCHIVE_DIR", "archive").strip() or "archive"
+
+ARCHIVE_COLUMNS = ("id", "ts_utc", "symbol", "tf", "side", "price", "tp", "sl", "reason", "idem_key", "payload")
+_SELECT_COLUMNS = "id, ts_utc, symbol, tf, side, price, tp, sl, reason, idem_key, payload, raw_json"
+
+_NAME_RE = re.compile(r"signals_(\d{4})_(\d{2})")
+# lock id arbitrario (distinto al de migraciones) para crear particiones
+_PARTITION_LOCK_ID = 7340022
+_CACHE_TTL = 60.0
+_cache = {"at": 0.0, "months": None}
+_keeper = {"pid": None}
+_keeper_lock = threading.Lock()
+
+log = get_logger("partitions")
+
+
+def _month(dt: datetime) -> datetime:
+    return dt.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month: datetime, n: int) -> datetime:
+    y, m = divmod(month.month - 1 + n, 12)
+    return month.replace(year=month.year + y, month=m + 1)
+
+
+def _name(month: datetime) -> str:
+    return f"signals_{month:%Y_%m}"
+
+
+def _as_datetime(value) -> datetime:
+    # inversa de ts_param: timestamptz en Postgres, epoch-ms en SQLite
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromtimestamp(value / 1000, timezone.utc)
+
+
+# =========================
+# PARTICIONES (Postgres)
+# =========================
+def is_partitioned(c) -> bool:
+    if c.kind != "postgres":
+        return False
+    r = c.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('signals')").fetchone()
+    return bool(r) and r["relkind"] == "p"
+
+
+def _partition_months(c) -> list:
+    rows = c.execute(
+        "SELECT ch.relname FROM pg_inherits i JOIN pg_class ch ON ch.oid = i.inhrelid "
+        "WHERE i.inhparent = 'signals'::regclass"
+    ).fetchall()
+    months = []
+    for r in rows:
+        m = _NAME_RE.fullmatch(r["relname"])
+        if m:
+            months.append(datetime(int(m[1]), int(m[2]), 1, tzinfo=timezone.utc))
+    return sorted(months)
+
+
+def _create_partition(c, month: datetime):
+    # DDL no acepta parámetros: los límites salen de datetimes propios
+    c.execute(
+        f"CREATE TABLE IF NOT EXISTS {_name(month)} PARTITION OF signals "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    )
+
+
+def invalidate():
+    _cache["at"] = 0.0
+
+
+def windows(c, since=None, until=None, newest_first: bool = True) -> list:
+    """
+    Rangos [(lo, hi)] en los que partir una consulta por tiempo: uno por
+    partición (recortado a since/until) si `signals` está particionada, o
+    [(since, until)] tal cual si no. La lista de particiones se cachea
+    _CACHE_TTL segundos por proceso.
+    """
+    if c.kind != "postgres":
+        return [(since, until)]
+    now = time.monotonic()
+    if not _cache["at"] or now - _cache["at"] >= _CACHE_TTL:
+        _cache["months"] = _partition_months(c) if is_partitioned(c) else None
+        _cache["at"] = now
+    months = _cache["months"]
+    if months is None:
+        return [(since, until)]
+
+    # las particiones creadas por adelantado todavía están vacías
+    current = _month(datetime.now(timezone.utc))
+    out = []
+    for month in months:
+        lo, hi = month, _add_months(month, 1)
+        if (since and hi <= since) or (until and lo >= until) or lo > current:
+            continue
+        out.append((max(lo, since) if since else lo, min(hi, until) if until else hi))
+    return out[::-1] if newest_first else out
+
+
+def ensure_partitions(ahead: int = SIGNALS_PARTITION_AHEAD) -> list:
+    """
+    Crea las particiones del mes actual y los `ahead` siguientes que falten.
+    No-op si `signals` no está particionada. Devuelve los nombres creados.
+    """
+    if not _is_postgres():
+        return []
+    created = []
+    with conn() as c:
+        if not is_partitioned(c):
+            return []
+        # varios workers arrancando a la vez: uno crea, el resto ve que ya están
+        c.execute("SELECT pg_advisory_xact_lock(?)", (_PARTITION_LOCK_ID,))
+        existing = set(_partition_months(c))
+        first = _month(datetime.now(timezone.utc))
+        for i in range(max(0, ahead) + 1):
+            month = _add_months(first, i)
+            if month not in existing:
+                _create_partition(c, month)
+                created.append(_name(month))
+        c.commit(strict=True)
+    invalidate()
+    for name in created:
+        log_event(log, "partition_created", logging.INFO, partition=name)
+    return created
+
+
+def is_missing_partition(e: Exception) -> bool:
+    """El INSERT cayó en un mes sin partición (y no hay DEFAULT)."""
+    return getattr(e, "sqlstate", None) == "23514" and "no partition" in str(e)
+
+
+def _keep_loop():
+    while True:
+        time.sleep(SIGNALS_PARTITION_CHECK_SECONDS)
+        try:
+            ensure_partitions()
+        except Exception as e:
+            log_event(log, "partition_check_error", logging.ERROR, error=str(e)[:200])
+
+
+def start_keeper():
+    """
+    Thread (uno por proceso, fork-safe) que llama ensure_partitions cada
+    SIGNALS_PARTITION_CHECK_SECONDS. Barato de llamar en cada INSERT.
+    No-op en SQLite.
+    """
+    pid = os.getpid()
+    if _keeper["pid"] == pid or not _is_postgres() or SIGNALS_PARTITION_CHECK_SECONDS <= 0:
+        return
+    with _keeper_lock:
+        if _keeper["pid"] == pid:
+            return
+        threading.Thread(target=_keep_loop, name="partition-keeper", daemon=True).start()
+        _keeper["pid"] = pid
+
+
+def list_partitions() -> list:
+    """[(nombre, filas estimadas)] de más vieja a más nueva ([] si no hay)."""
+    if not _is_postgres():
+        return []
+    with conn() as c:
+        if not is_partitioned(c):
+            return []
+        rows = c.execute(
+            "SELECT ch.relname, GREATEST(ch.reltuples, 0)::bigint AS n FROM pg_inherits i "
+            "JOIN pg_class ch ON ch.oid = i.inhrelid "
+            "WHERE i.inhparent = 'signals'::regclass ORDER BY ch.relname"
+        ).fetchall()
+    return [(r["relname"], r["n"]) for r in rows]
+
+
+def partition_signals(ahead: int = SIGNALS_PARTITION_AHEAD) -> int:
+    """
+    Convierte `signals` en tabla particionada por mes (solo Postgres), en
+    UNA transacción: si algo falla queda como estaba. Copia todas las filas
+    con la tabla bloqueada, así que va en ventana de mantenimiento. Requiere
+    `ts` completo (`python db.py backfill-ts`). Devuelve las filas movidas.
+
+    La PK pasa a ser (id, ts) (la clave de partición tiene que estar en
+    todo índice único); los índices no únicos se recrean iguales.
+    """
+    if not _is_postgres():
+        print("⚠️ Particionar es solo para Postgres (SQLite: `python db.py retention`)")
+        return 0
+    now = datetime.now(timezone.utc)
+    with conn() as c:
+        if is_partitioned(c):
+            print("✅ signals ya está particionada")
+            return 0
+        c.execute("LOCK TABLE signals IN ACCESS EXCLUSIVE MODE")
+        if c.execute("SELECT 1 FROM signals WHERE ts IS NULL LIMIT 1").fetchone():
+            raise RuntimeError("hay señales sin `ts`: correr antes `python db.py backfill-ts`")
+
+        r = c.execute("SELECT MIN(ts) lo, MAX(ts) hi FROM signals").fetchone()
+        seq = c.execute("SELECT pg_get_serial_sequence('signals', 'id') seq").fetchone()["seq"]
+        indexes = [
+            r2["indexdef"] for r2 in c.execute(
+                "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() "
+                "AND tablename = 'signals'"
+            ).fetchall()
+            if not r2["indexdef"].upper().startswith("CREATE UNIQUE")
+        ]
+
+        c.execute("ALTER TABLE signals RENAME TO signals_legacy")
+        c.execute("CREATE TABLE signals (LIKE signals_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (ts)")
+        month = _month(r["lo"] or now)
+        last = max(_add_months(_month(now), max(0, ahead)), _month(r["hi"] or now))
+        while month <= last:
+            _create_partition(c, month)
+            month = _add_months(month, 1)
+
+        c.execute("INSERT INTO signals SELECT * FROM signals_legacy")
+        moved = c.rowcount
+        # la secuencia del id sobrevive al DROP de la tabla vieja
+        if seq:
+            c.execute(f"ALTER SEQUENCE {seq} OWNED BY signals.id")
+        c.execute("DROP TABLE signals_legacy")
+        c.execute("ALTER TABLE signals ADD PRIMARY KEY (id, ts)")
+        for stmt in indexes:
+            c.execute(stmt)
+        c.execute("ANALYZE signals")
+        c.commit(strict=True)
+    invalidate()
+    return moved
+
+
+# =========================
+# RETENCIÓN / ARCHIVO
+# =========================
+def _archive_path(month: datetime) -> str:
+    return os.path.join(SIGNALS_ARCHIVE_DIR, f"{_name(month)}.csv.gz")
+
+
+def _archive_row(r) -> list:
+    data = payloads.row_payload(r)
+    payload = "" if data is None else json.dumps(
+        payloads.strip_secrets(data), separators=(",", ":"), ensure_ascii=False
+    )
+    return [r[col] for col in ARCHIVE_COLUMNS[:-1]] + [payload]
+
+
+def _append(path: str, rows):
+    """
+    Agrega las filas como un miembro gzip nuevo (un .gz con varios miembros
+    se lee como uno solo) y hace fsync antes de volver.
+    """
+    new = not os.path.exists(path)
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz, \
+                io.TextIOWrapper(gz, encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            if new:
+                w.writerow(ARCHIVE_COLUMNS)
+            w.writerows(_archive_row(r) for r in rows)
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def _archive_partition(month: datetime, batch: int) -> int:
+    """
+    Vuelca la partición entera a un .tmp, lo renombra y recién ahí la
+    separa y la borra. Si se corta antes del DROP, la próxima corrida
+    rehace el archivo completo.
+    """
+    name, path = _name(month), _archive_path(month)
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    groups = Counter()
+    last_id, n = 0, 0
+    while True:
+        with conn() as c:
+            rows = c.execute(
+                f"SELECT {_SELECT_COLUMNS} FROM {name} WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch)
+            ).fetchall()
+        if not rows:
+            break
+        _append(tmp, rows)
+        groups.update((r["symbol"], r["tf"], r["side"]) for r in rows)
+        last_id = rows[-1]["id"]
+        n += len(rows)
+    if n:
+        os.replace(tmp, path)
+
+    with conn() as c:
+        c.execute(f"DELETE FROM signal_keys k USING {name} p WHERE k.idem_key = p.idem_key")
+        c.execute(f"ALTER TABLE signals DETACH PARTITION {name}")
+        counters.subtract(c, groups.elements())
+        c.execute(f"DROP TABLE {name}")
+        c.commit(strict=True)
+    return n
+
+
+def _archive_rows(month: datetime, batch: int, pause: float) -> int:
+    lo, hi = ts_param(month), ts_param(_add_months(month, 1))
+    path = _archive_path(month)
+    n = 0
+    while True:
+        with conn() as c:
+            # ORDER BY ts recorre idx_signals_ts sin ordenar; lo archivado se
+            # borra, así que cada lote arranca del principio del mes
+            rows = c.execute(
+                f"SELECT {_SELECT_COLUMNS} FROM signals WHERE ts >= ? AND ts < ? ORDER BY ts LIMIT ?",
+                (lo, hi, batch)
+            ).fetchall()
+            if not rows:
+                return n
+            _append(path, rows)
+            c.executemany("DELETE FROM signals WHERE id=?", [(r["id"],) for r in rows])
+            c.executemany(
+                "DELETE FROM signal_keys WHERE idem_key=?",
+                [(r["idem_key"],) for r in rows if r["idem_key"]]
+            )
+            counters.subtract(c, [(r["symbol"], r["tf"], r["side"]) for r in rows])
+            c.commit(strict=True)
+        n += len(rows)
+        time.sleep(pause)
+
+
+def archive_old(months: int = SIGNALS_RETENTION_MONTHS, batch: int = 2000, pause: float = 0.05) -> dict:
+    """
+    Archiva y saca de la base los meses anteriores a (mes actual - months).
+    months <= 0 no hace nada. Devuelve {mes: filas archivadas}.
+    """
+    ensure_partitions()
+    if months <= 0:
+        print("⚠️ SIGNALS_RETENTION_MONTHS=0: no se archiva nada")
+        return {}
+    cutoff = _add_months(_month(datetime.now(timezone.utc)), -months)
+    os.makedirs(SIGNALS_ARCHIVE_DIR, exist_ok=True)
+
+    with conn() as c:
+        partitioned = is_partitioned(c)
+        if partitioned:
+            olds = [m for m in _partition_months(c) if m < cutoff]
+        else:
+            r = c.execute("SELECT MIN(ts) lo FROM signals").fetchone()
+            olds = []
+            if r and r["lo"] is not None:
+                month = _month(_as_datetime(r["lo"]))
+                while month < cutoff:
+                    olds.append(month)
+                    month = _add_months(month, 1)
+        if c.execute("SELECT 1 FROM signals WHERE ts IS NULL LIMIT 1").fetchone():
+            print("⚠️ hay señales sin `ts` (no se archivan): correr `python db.py backfill-ts`")
+
+    out = {}
+    for month in olds:
+        n = _archive_partition(month, batch) if partitioned else _archive_rows(month, batch, pause)
+        if n:
+            print(f"📦 {_name(month)}: {n} señales -> {_archive_path(month)}")
+            out[_name(month)] = n
+    invalidate()
+    return out
@@ -0,0 +1,175 @@
+"""
+Payload crudo de cada señal, compacto y sin secretos (columna `payload`).
+
+Antes `raw_json` guardaba el body tal cual: con passphrase, sig y nonce, y
+repitiendo lo que ya está en las columnas. Ahora:
+
+- Postgres: JSONB (binario, consultable). Con `python db.py payload-gin`
+  se crea un índice GIN para consultas ad-hoc (payload @> '{"strategy":"x"}').
+- SQLite: JSON compacto comprimido con deflate + diccionario fijo de las
+  claves/valores típicos de TradingView (un alert de ~250 bytes queda en
+  ~100). El primer byte es la versión del formato.
+
+decode() acepta cualquiera de las formas (JSONB, blob, o el raw_json TEXT
+de filas viejas), así que leer es transparente.
+"""
+import json
+import time
+import zlib
+
+from db import conn, _is_postgres
+
+# nunca se persisten (anti-replay / credenciales)
+SECRET_KEYS = {"passphrase", "sig", "signature", "nonce", "secret", "token"}
+
+_V1 = b"\x01"
+# diccionario de deflate v1: NO modificar (los blobs existentes dependen de
+# él); para cambiarlo, agregar un formato v2
+_ZDICT_V1 = (
+    b'{"symbol":"USDT","tf":"15m","1h","4h","side":"BUY","SELL","EXIT_LONG",'
+    b'"EXIT_SHORT","price":"tp":"sl":"reason":"time":"bar_time":"strategy":'
+    b'"strategy_id":"id":"raw_message":"'
+)
+
+
+def strip_secrets(data):
+    if isinstance(data, dict):
+        return {k: strip_secrets(v) for k, v in data.items() if str(k).lower() not in SECRET_KEYS}
+    if isinstance(data, list):
+        return [strip_secrets(v) for v in data]
+    return data
+
+
+def _compress(raw: bytes) -> bytes:
+    # deflate crudo con ventana de 1 KB: los alerts son chicos y armar el
+    # compresor con la ventana default cuesta ~10x más que comprimir
+    c = zlib.compressobj(6, zlib.DEFLATED, -10, 4, zlib.Z_DEFAULT_STRATEGY, _ZDICT_V1)
+    return _V1 + c.compress(raw) + c.flush()
+
+
+def _decompress(blob: bytes) -> bytes:
+    if blob[:1] != _V1:
+        raise ValueError(f"formato de payload desconocido: {blob[:1]!r}")
+    d = zlib.decompressobj(-15, zdict=_ZDICT_V1)
+    return d.decompress(blob[1:]) + d.flush()
+
+
+def encode(data: dict):
+    """
+    dict -> valor para la columna `payload` del backend actual.
+    """
+    data = strip_secrets(data)
+    if _is_postgres():
+        from psycopg.types.json import Jsonb
+        return Jsonb(data)
+    return _compress(json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+
+def decode(value):
+    """
+    payload (JSONB -> dict, blob) o raw_json TEXT viejo -> dict (None si vacío).
+    """
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        return value
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    if isinstance(value, bytes):
+        return json.loads(_decompress(value))
+    try:
+        return json.loads(value)
+    except ValueError:
+        return {"raw_message": value}
+
+
+def row_payload(row):
+    """payload de una fila de `signals`, con fallback a raw_json."""
+    keys = row.keys()
+    if "payload" in keys and row["payload"] is not None:
+        return decode(row["payload"])
+    return decode(row["raw_json"]) if "raw_json" in keys else None
+
+
+def compact_existing(batch: int = 2000, pause: float = 0.05) -> int:
+    """
+    Pasa raw_json -> payload (sin secretos) en filas viejas y vacía raw_json,
+    por lotes cortos como backfill_ts. En SQLite el espacio se recupera
+    recién con VACUUM. Devuelve cuántas filas convirtió.
+    """
+    last_id, done = 0, 0
+    while True:
+        with conn() as c:
+            rows = c.execute(
+                "SELECT id, raw_json FROM signals WHERE id > ? AND payload IS NULL "
+                "AND raw_json IS NOT NULL ORDER BY id LIMIT ?",
+                (last_id, batch)
+            ).fetchall()
+            if not rows:
+                return done
+            c.executemany(
+                "UPDATE signals SET payload=?, raw_json=NULL WHERE id=?",
+                [(encode(decode(r["raw_json"])), r["id"]) for r in rows]
+            )
+            c.commit(strict=True)
+        last_id = rows[-1]["id"]
+        done += len(rows)
+        print(f"⏳ payloads compactados: {done} (id <= {last_id})")
+        time.sleep(pause)
+
+
+def create_gin_index():
+    """
+    Índice GIN sobre payload (solo Postgres), CONCURRENTLY para no frenar
+    los INSERTs: necesita autocommit, por eso va con conexión propia.
+    """
+    if not _is_postgres():
+        print("⚠️ GIN es solo para Postgres")
+        return False
+    import psycopg
+    from db import DATABASE_URL, _with_sslmode_require
+
+    with psycopg.connect(_with_sslmode_require(DATABASE_URL), autocommit=True) as pg:
+        pg.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_signals_payload_gin "
+            "ON signals USING GIN (payload jsonb_path_ops)"
+        )
+    return True
+
+
+def report(sample: int = 1000) -> dict:
+    """
+    Tamaño y latencia: raw_json TEXT (viejo) vs payload (nuevo), sobre las
+    últimas `sample` filas. Lo que no esté convertido se estima codificando.
+    """
+    with conn(readonly=True) as c:
+        rows = c.execute(
+            "SELECT raw_json, payload FROM signals ORDER BY id DESC LIMIT ?", (sample,)
+        ).fetchall()
+    if not rows:
+        return {"rows": 0}
+
+    datas = [row_payload(r) or {} for r in rows]
+    raw_sizes = [len(r["raw_json"].encode("utf-8")) for r in rows if r["raw_json"] is not None]
+    plain = [json.dumps(strip_secrets(d), separators=(",", ":"), ensure_ascii=False).encode("utf-8") for d in datas]
+
+    t0 = time.perf_counter()
+    blobs = [_compress(p) for p in plain]
+    t1 = time.perf_counter()
+    for b in blobs:
+        json.loads(_decompress(b))
+    t2 = time.perf_counter()
+    for p in plain:
+        json.loads(p)
+    t3 = time.perf_counter()
+
+    n = len(rows)
+    return {
+        "rows": n,
+        "raw_json_avg_bytes": round(sum(raw_sizes) / len(raw_sizes), 1) if raw_sizes else None,
+        "json_compact_avg_bytes": round(sum(map(len, plain)) / n, 1),
+        "blob_avg_bytes": round(sum(map(len, blobs)) / n, 1),
+        "encode_us_avg": round((t1 - t0) / n * 1e6, 2),
+        "decode_us_avg": round((t2 - t1) / n * 1e6, 2),
+        "json_loads_us_avg": round((t3 - t2) / n * 1e6, 2),
+    }
@@ -0,0 +1,133 @@
+"""
+Admisión y rate limiting para /webhook.
+
+- RateLimiter: token bucket por fuente (passphrase, IP o estrategia).
+- ConcurrencyGate: tope global de requests en vuelo; si está lleno se
+  rechaza al instante (load shedding) en vez de encolar más trabajo
+  bloqueante hasta que gunicorn mate los workers por timeout.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated", "allowed", "limited")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.allowed = 0
+        self.limited = 0
+
+    def peek(self, now: float) -> float:
+        """
+        Como take() pero sin consumir: 0 si hay token, o los segundos a esperar.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def take(self, now: float) -> float:
+        """
+        Consume 1 token. Devuelve 0 si pasó, o los segundos a esperar.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.allowed += 1
+            return 0.0
+        self.limited += 1
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class RateLimiter:
+    """
+        wait = limiter.check(key)
+        if wait: -> 429 con Retry-After = ceil(wait)
+
+    Como mucho `max_keys` buckets (LRU): con el tope lleno, una fuente nueva
+    desaloja a la usada hace más tiempo en O(1), así una IP/fuente nueva por
+    request no hace crecer la memoria.
+    """
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.max_keys = max(1, int(max_keys))
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, key: str) -> float:
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                while len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+                    self.evicted += 1
+                b = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            else:
+                self._buckets.move_to_end(key)
+            return b.take(now)
+
+    @staticmethod
+    def retry_after(wait: float) -> int:
+        return max(1, int(math.ceil(wait)))
+
+    def stats(self, top: int = 50) -> dict:
+        with self._lock:
+            items = sorted(self._buckets.items(), key=lambda kv: kv[1].limited, reverse=True)[:top]
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "keys": len(self._buckets),
+                "max_keys": self.max_keys,
+                "evicted": self.evicted,
+                "buckets": {
+                    k: {"allowed": b.allowed, "limited": b.limited, "tokens": round(b.tokens, 2)}
+                    for k, b in items
+                },
+            }
+
+
+class ConcurrencyGate:
+    """
+    Semáforo no bloqueante: try_enter() -> False si ya hay `limit` en vuelo.
+    limit <= 0 desactiva el tope.
+    """
+    def __init__(self, limit: int):
+        self.limit = int(limit)
+        self._sem = threading.BoundedSemaphore(self.limit) if self.limit > 0 else None
+        self.in_flight = 0
+        self.shed = 0
+
+    def try_enter(self) -> bool:
+        if self._sem is None:
+            self.in_flight += 1
+            return True
+        if not self._sem.acquire(blocking=False):
+            self.shed += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def leave(self):
+        self.in_flight -= 1
+        if self._sem is not None:
+            self._sem.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "shed": self.shed}
@@ -0,0 +1,245 @@
+"""
+Scheduler de envíos a Telegram que respeta sus límites.
+
+Telegram permite ~1 msg/s por chat y ~30 msg/s en total, y cuando se pasa
+responde 429 con `retry_after`. El scheduler:
+
+- mantiene una cola FIFO por chat (el orden por chat se respeta: nunca hay
+  dos mensajes del mismo chat en vuelo),
+- usa un token bucket por chat y uno global,
+- ante un 429 pausa el chat y el bucket global `retry_after` segundos y
+  reintenta el MISMO mensaje primero,
+- mide cuánto esperó cada mensaje en la cola (wait_ms).
+
+    fut = scheduler.submit(chat_id, text)   # Future -> {"wait_ms": ...}
+    ok = scheduler.send(chat_id, text, timeout=15)
+
+Config:
+    TELEGRAM_SCHEDULER       1 = server/outbox envían a través del scheduler
+    TELEGRAM_CHAT_RATE       1     msg/s por chat
+    TELEGRAM_CHAT_BURST      1
+    TELEGRAM_GLOBAL_RATE     30    msg/s en total
+    TELEGRAM_SEND_WORKERS    4     envíos HTTP en paralelo (chats distintos)
+    TELEGRAM_SEND_ATTEMPTS   3     intentos ante errores que no son 429
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ratelimit import TokenBucket
+
+TELEGRAM_SCHEDULER = os.getenv("TELEGRAM_SCHEDULER", "0").strip() == "1"
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "1"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_SEND_WORKERS = int(os.getenv("TELEGRAM_SEND_WORKERS", "4"))
+TELEGRAM_SEND_ATTEMPTS = int(os.getenv("TELEGRAM_SEND_ATTEMPTS", "3"))
+
+
+class _Msg:
+    __slots__ = ("text", "fut", "enqueued", "attempts")
+
+    def __init__(self, text, fut):
+        self.text = text
+        self.fut = fut
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class SendScheduler:
+    def __init__(self, send_fn, chat_rate: float = 1.0, chat_burst: float = 1.0,
+                 global_rate: float = 30.0, workers: int = 4, max_attempts: int = 3):
+        self.send_fn = send_fn
+        self.chat_rate = float(chat_rate)
+        self.chat_burst = max(1.0, float(chat_burst))
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.workers = max(1, int(workers))
+        self.max_attempts = max(1, int(max_attempts))
+
+        self._cond = threading.Condition()
+        self._queues = {}       # chat -> deque[_Msg]
+        self._buckets = {}      # chat -> TokenBucket
+        self._scheduled = set() # chats con entrada en el heap
+        self._inflight = set()  # chats con un envío en curso
+        self._paused_until = {} # chat -> monotonic (429)
+        self._global_paused_until = 0.0
+        self._heap = []         # (ready_at, seq, chat)
+        self._seq = itertools.count()
+        self._pid = None
+        self._pool = None
+
+        # métricas
+        self.sent = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.throttled = 0
+        self._waits = deque(maxlen=2048)
+        self._wait_max = 0.0
+
+    # ---------- API ----------
+    def _start(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._cond:
+            if self._pid == pid:
+                return
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="tg-send")
+            threading.Thread(target=self._run, name="tg-scheduler", daemon=True).start()
+            self._pid = pid
+
+    def submit(self, chat_id, text: str) -> Future:
+        self._start()
+        fut = Future()
+        chat_id = str(chat_id)
+        with self._cond:
+            self._queues.setdefault(chat_id, deque()).append(_Msg(text, fut))
+            self._schedule(chat_id, time.monotonic())
+            self._cond.notify()
+        return fut
+
+    def send(self, chat_id, text: str, timeout: float = None) -> bool:
+        """
+        True si salió. Con False el mensaje ya no se envía (si todavía no
+        había salido de la cola se cancela): el reintento es del llamador.
+        """
+        fut = self.submit(chat_id, text)
+        try:
+            fut.result(timeout)
+            return True
+        except Exception:
+            fut.cancel()
+            return False
+
+    # ---------- interno (con self._cond tomado) ----------
+    def _schedule(self, chat, at):
+        if chat in self._scheduled or chat in self._inflight or not self._queues.get(chat):
+            return
+        self._scheduled.add(chat)
+        heapq.heappush(self._heap, (at, next(self._seq), chat))
+
+    def _bucket(self, chat):
+        b = self._buckets.get(chat)
+        if b is None:
+            b = self._buckets[chat] = TokenBucket(self.chat_rate, self.chat_burst)
+        return b
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    at, _, chat = self._heap[0]
+                    if at > now:
+                        self._cond.wait(at - now)
+                        continue
+                    gwait = max(self.global_bucket.peek(now), self._global_paused_until - now)
+                    if gwait > 0:
+                        self._cond.wait(gwait)
+                        continue
+                    heapq.heappop(self._heap)
+                    self._scheduled.discard(chat)
+                    cwait = max(self._bucket(chat).peek(now), self._paused_until.get(chat, 0.0) - now)
+                    if cwait > 0:
+                        self._schedule(chat, now + cwait)
+                        continue
+                    q = self._queues.get(chat)
+                    # el llamador se cansó de esperar (Future.cancel): no se envía.
+                    # Un mensaje que ya salió una vez queda RUNNING y no se cancela.
+                    while q and q[0].attempts == 0 and not q[0].fut.set_running_or_notify_cancel():
+                        q.popleft()
+                        self.cancelled += 1
+                    if not q:
+                        self._queues.pop(chat, None)
+                        continue
+                    self.global_bucket.take(now)
+                    self._bucket(chat).take(now)
+                    msg = q.popleft()
+                    self._inflight.add(chat)
+                    break
+            self._pool.submit(self._send, chat, msg)
+
+    def _send(self, chat, msg):
+        wait_ms = (time.monotonic() - msg.enqueued) * 1000.0
+        msg.attempts += 1
+        err = None
+        try:
+            self.send_fn(chat, msg.text)
+        except Exception as e:
+            err = e
+
+        with self._cond:
+            self._inflight.discard(chat)
+            now = time.monotonic()
+            retry_after = getattr(err, "retry_after", None) if err is not None else None
+
+            if err is None:
+                self.sent += 1
+                self._waits.append(wait_ms)
+                self._wait_max = max(self._wait_max, wait_ms)
+                msg.fut.set_result({"wait_ms": round(wait_ms, 1), "attempts": msg.attempts})
+            elif retry_after:
+                # 429: mismo mensaje primero (orden por chat) y pausa chat + global
+                self.throttled += 1
+                until = now + float(retry_after)
+                self._paused_until[chat] = until
+                self._global_paused_until = max(self._global_paused_until, until)
+                self._queues.setdefault(chat, deque()).appendleft(msg)
+            elif msg.attempts < self.max_attempts:
+                self._paused_until[chat] = now + min(30.0, 2 ** msg.attempts)
+                self._queues.setdefault(chat, deque()).appendleft(msg)
+            else:
+                self.failed += 1
+                msg.fut.set_exception(err)
+
+            self._schedule(chat, now)
+            if not self._queues.get(chat) and chat not in self._scheduled:
+                # chat sin pendientes: liberar la cola vacía y la pausa vencida
+                self._queues.pop(chat, None)
+                if self._paused_until.get(chat, 0.0) <= now:
+                    self._paused_until.pop(chat, None)
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        n = len(waits)
+
+        def pct(p):
+            return round(waits[min(n - 1, int(p * n))], 1) if n else 0.0
+
+        with self._cond:
+            queued = sum(len(q) for q in self._queues.values())
+            chats = len(self._queues)
+        return {
+            "queued": queued,
+            "chats": chats,
+            "sent": self.sent,
+            "throttled_429": self.throttled,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p99": pct(0.99),
+            "wait_ms_max": round(self._wait_max, 1),
+        }
+
+
+def _default_send(chat_id, text):
+    from notifier import send_message
+    send_message(chat_id, text)
+
+
+scheduler = SendScheduler(
+    _default_send,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    chat_burst=TELEGRAM_CHAT_BURST,
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    workers=TELEGRAM_SEND_WORKERS,
+    max_attempts=TELEGRAM_SEND_ATTEMPTS,
+)
@@ -1,14 +1,36 @@
 import os, json
 import hmac, hashlib, time
-from collections import OrderedDict
+import logging
+from datetime import datetime, timezone
+from functools import partial
 
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, g
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager, login_user, login_required, logout_user, UserMixin, current_user
-import requests
 from dotenv import load_dotenv
 
-from db import init_db, conn, utc_now
+try:
+    import orjson  # opcional: parseo JSON más rápido
+except ImportError:
+    orjson = None
+
+from db import migrate, conn, ts_param, pool_stats, statement
+from ingest import IngestQueue
+from writer import BatchWriter
+from idempotency import signal_key, LRUCache
+from ratelimit import RateLimiter, ConcurrencyGate
+from logs import get_logger, log_event, payload_for_log, log_stats
+import outbox
+import notifier
+from scheduler import TELEGRAM_SCHEDULER, scheduler
+from digest import TELEGRAM_DIGEST, digest
+from subscriptions import SUBSCRIPTIONS_ENABLED, subscription_index, fanout
+import counters
+import history
+import payloads
+import partitions
+from nonces import make_nonce_store, NonceStoreFull
 
 
 # =========================
@@ -16,7 +38,6 @@ from db import init_db, conn, utc_now
 # =========================
 load_dotenv()
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 TELEGRAM_CHAT_ID   = os.getenv("TELEGRAM_CHAT_ID", "").strip()
 
 WEBHOOK_PASSPHRASE = os.getenv("WEBHOOK_PASSPHRASE", "BANCRIPFUTBOT").strip()
@@ -24,15 +45,49 @@ WEBHOOK_PASSPHRASE = os.getenv("WEBHOOK_PASSPHRASE", "BANCRIPFUTBOT").strip()
 # ✅ Firma HMAC (seguridad webhook)
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").encode("utf-8")
 MAX_SKEW = int(os.getenv("WEBHOOK_MAX_SKEW_SECONDS", "120"))  # tolerancia reloj (seg)
+NONCE_MAX_ENTRIES = int(os.getenv("NONCE_MAX_ENTRIES", "200000"))  # tope de memoria anti-replay
+# memory = por proceso | db = tabla compartida | shm = memoria compartida (misma máquina)
+NONCE_BACKEND = os.getenv("NONCE_BACKEND", "memory").strip().lower()
+NONCE_SWEEP_SECONDS = int(os.getenv("NONCE_SWEEP_SECONDS", "60"))
+NONCE_SHM_PATH = os.getenv("NONCE_SHM_PATH", "").strip()
+NONCE_SHM_SLOTS = int(os.getenv("NONCE_SHM_SLOTS", "65536"))
 
 SECRET_KEY = os.getenv("SECRET_KEY", "DEV_ONLY_CHANGE_ME").strip()
 
+# ✅ Ingesta asíncrona: el webhook responde 202 y workers guardan + notifican
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0").strip() == "1"
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+
+# ✅ Group commit: junta INSERTs de señales en ventanas cortas (ráfagas al cierre de vela)
+SIGNAL_BATCH = os.getenv("SIGNAL_BATCH", "0").strip() == "1"
+SIGNAL_BATCH_MS = float(os.getenv("SIGNAL_BATCH_MS", "10"))
+SIGNAL_BATCH_MAX = int(os.getenv("SIGNAL_BATCH_MAX", "100"))
+SIGNAL_BATCH_TIMEOUT = float(os.getenv("SIGNAL_BATCH_TIMEOUT", "10"))  # seg esperando el ack
+
+# ✅ Idempotencia: reintentos de TradingView no duplican filas ni Telegram
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+# ✅ Admisión: token bucket por fuente + tope global de requests en vuelo
+WEBHOOK_RATE = float(os.getenv("WEBHOOK_RATE", "0"))       # señales/seg por fuente (0 = sin límite)
+WEBHOOK_BURST = float(os.getenv("WEBHOOK_BURST", "50"))    # ráfaga permitida por fuente
+WEBHOOK_RATE_KEY = os.getenv("WEBHOOK_RATE_KEY", "passphrase").strip().lower()  # passphrase | ip | strategy
+WEBHOOK_RATE_MAX_KEYS = int(os.getenv("WEBHOOK_RATE_MAX_KEYS", "10000"))  # tope de buckets (LRU)
+# proxies delante de la app (Render/nginx = 1): la IP es el hop que agregó el
+# último proxy de confianza, nunca el primero de X-Forwarded-For (lo pone el cliente)
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+WEBHOOK_MAX_INFLIGHT = int(os.getenv("WEBHOOK_MAX_INFLIGHT", "0"))  # 0 = sin tope
+
 
 # =========================
 # APP
 # =========================
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+log = get_logger("server")
 
 login_manager = LoginManager()
 login_manager.login_view = "login"
@@ -50,10 +105,13 @@ class User(UserMixin):
         self.password_hash = row["password_hash"]
         self.role = row["role"]
 
+# en cada request autenticado
+SELECT_USER_SQL = statement("SELECT * FROM users WHERE id=?")
+
 @login_manager.user_loader
 def load_user(user_id):
-    with conn() as c:
-        r = c.execute("SELECT * FROM users WHERE id=?", (user_id,)).fetchone()
+    with conn(readonly=True) as c:
+        r = c.execute(SELECT_USER_SQL, (user_id,)).fetchone()
     return User(r) if r else None
 
 def ensure_admin():
@@ -67,6 +125,22 @@ def ensure_admin():
             )
             c.commit()
 
+_BOOTSTRAPPED = False
+
+def bootstrap():
+    """
+    Esquema + admin, UNA vez por proceso (al arrancar o en el hook
+    on_starting de gunicorn). Los requests nunca ejecutan DDL.
+    """
+    global _BOOTSTRAPPED
+    if _BOOTSTRAPPED:
+        return
+    migrate()
+    ensure_admin()
+    # Postgres particionado: meses por adelantado (no-op en SQLite)
+    partitions.ensure_partitions()
+    _BOOTSTRAPPED = True
+
 def is_admin():
     return hasattr(current_user, "role") and current_user.role == "ADMIN"
 
@@ -74,20 +148,64 @@ def is_admin():
 # =========================
 # TELEGRAM
 # =========================
-def send_telegram(text: str) -> bool:
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print("⚠️ Telegram no configurado (faltan TELEGRAM_BOT_TOKEN o TELEGRAM_CHAT_ID)")
+TELEGRAM_SCHEDULER_WAIT = float(os.getenv("TELEGRAM_SCHEDULER_WAIT", "30"))  # seg
+
+# ✅ Presupuesto por request: Telegram nunca se come más que esto del webhook
+WEBHOOK_DEADLINE = float(os.getenv("WEBHOOK_DEADLINE_SECONDS", "8"))
+# lo que no salió (breaker abierto, timeout, 5xx) se reintenta desde el outbox
+TELEGRAM_RETRY_QUEUE = os.getenv("TELEGRAM_RETRY_QUEUE", "1").strip() == "1"
+
+def _wait_for(timeout):
+    return TELEGRAM_SCHEDULER_WAIT if timeout is None else min(timeout, TELEGRAM_SCHEDULER_WAIT)
+
+def send_telegram(text: str, timeout: float = None) -> bool:
+    # cliente único con pool keep-alive y timeouts consistentes (notifier.py)
+    if TELEGRAM_SCHEDULER and TELEGRAM_CHAT_ID:
+        # respeta 1 msg/s por chat y 30/s global, con retry_after en 429
+        return scheduler.send(TELEGRAM_CHAT_ID, text, timeout=_wait_for(timeout))
+    return notifier.notify(text, chat_id=TELEGRAM_CHAT_ID, timeout=timeout)
+
+def _send_to(chat_id: str, text: str, timeout: float = None):
+    # envío a un chat puntual (fan-out); lanza si falla
+    if TELEGRAM_SCHEDULER:
+        fut = scheduler.submit(chat_id, text)
+        try:
+            fut.result(_wait_for(timeout))
+        except Exception:
+            # no salió a tiempo: que no salga después (lo reintenta el outbox)
+            fut.cancel()
+            raise
+    else:
+        notifier.send_message(chat_id, text, timeout=timeout)
+
+def _retry_later(chats, text: str) -> bool:
+    """
+    Manda al outbox los envíos que fallaron o no salieron a tiempo en el
+    request, también con el scheduler: cuando se rinde
+    (TELEGRAM_SEND_ATTEMPTS) el mensaje se descarta.
+    """
+    if not (TELEGRAM_RETRY_QUEUE and chats):
         return False
-
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text}
     try:
-        r = requests.post(url, json=payload, timeout=20)
-        print("📨 Telegram:", r.status_code, r.text[:200])
-        return r.status_code == 200
+        with conn() as c:
+            outbox.enqueue_many(c, [(chat, text) for chat in chats])
+            c.commit(strict=True)
     except Exception as e:
-        print("❌ Telegram error:", e)
+        log_event(log, "retry_queue_error", logging.ERROR, error=str(e)[:200])
         return False
+    outbox.outbox_worker.start()
+    outbox.outbox_worker.wake()
+    return True
+
+def _recipients(symbol: str, tf: str, side: str) -> list:
+    """
+    TELEGRAM_CHAT_ID (canal principal) + suscriptores que matchean
+    (índice en memoria, sin consultar la tabla por señal).
+    """
+    chats = [TELEGRAM_CHAT_ID] if TELEGRAM_CHAT_ID else []
+    if SUBSCRIPTIONS_ENABLED:
+        chats += sorted(subscription_index.match(symbol, tf, side) - set(chats))
+    return chats
 
 
 # =========================
@@ -99,77 +217,86 @@ def fnum(x):
     except:
         return None
 
+class InvalidJSON(ValueError):
+    """JSON bien formado pero inaceptable (NaN / Infinity): 400, no raw_message."""
+
+
+def _reject_constant(name: str):
+    raise InvalidJSON(f"{name} is not valid JSON")
+
+
+def _json_loads(body: bytes):
+    if orjson is not None:
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # orjson rechaza lo que json acepta (ints > 64 bits): probar con
+            # json antes de tratarlo como texto plano. NaN/Infinity siguen
+            # rechazados (no son JSON y romperían precios / tp / sl)
+            pass
+    return json.loads(body, parse_constant=_reject_constant)
+
 def parse_tv_payload():
     """
     TradingView a veces manda JSON normal y a veces texto plano.
+    Lee el body UNA vez y lo parsea UNA vez. Devuelve (data, body_bytes).
+    Con NaN / Infinity levanta InvalidJSON.
     """
-    data = request.get_json(silent=True)
-    if data is None:
-        raw = request.data.decode("utf-8", errors="ignore").strip()
-        if raw:
-            try:
-                data = json.loads(raw)
-            except Exception:
-                data = {"raw_message": raw}
-        else:
-            data = {}
-    return data
+    body = request.get_data(cache=True)
+    if not body.strip():
+        return {}, body
+    try:
+        data = _json_loads(body)
+    except InvalidJSON:
+        raise
+    except Exception:
+        data = None
+    if not isinstance(data, dict):
+        data = {"raw_message": body.decode("utf-8", errors="ignore").strip()}
+    return data, body
 
 
 # =========================
 # WEBHOOK SECURITY (HMAC + anti-replay)
 # =========================
-_NONCE_CACHE = OrderedDict()
-_NONCE_LIMIT = 2000
-
-def _clean_nonce_cache():
-    while len(_NONCE_CACHE) > _NONCE_LIMIT:
-        _NONCE_CACHE.popitem(last=False)
-
-def _seen_nonce(nonce: str) -> bool:
-    now = int(time.time())
-    # purga nonces viejos (más de 10 min)
-    for k, ts in list(_NONCE_CACHE.items()):
-        if now - ts > 600:
-            _NONCE_CACHE.pop(k, None)
-        else:
-            break
-    if nonce in _NONCE_CACHE:
-        return True
-    _NONCE_CACHE[nonce] = now
-    _clean_nonce_cache()
-    return False
+# nonces vistos: expiran por tiempo (ts + MAX_SKEW), no por cantidad.
+# Con varios workers usar NONCE_BACKEND=db o shm: si no, cada worker tiene
+# su propia ventana y un replay puede caer en otro worker.
+nonce_store = make_nonce_store(
+    NONCE_BACKEND, MAX_SKEW,
+    max_entries=NONCE_MAX_ENTRIES,
+    sweep_seconds=NONCE_SWEEP_SECONDS,
+    shm_path=NONCE_SHM_PATH,
+    shm_slots=NONCE_SHM_SLOTS,
+)
+
+def _seen_nonce(nonce: str, ts: int) -> bool:
+    return nonce_store.seen(nonce, ts)
 
 def _canonical_payload(data: dict) -> str:
     # JSON determinístico: ordena keys y sin espacios
     return json.dumps(data, separators=(",", ":"), sort_keys=True)
 
-def _hmac_hex(message: str) -> str:
+def _hmac_hex(message: bytes) -> str:
     if not WEBHOOK_SECRET:
         return ""
-    return hmac.new(WEBHOOK_SECRET, message.encode("utf-8"), hashlib.sha256).hexdigest()
+    return hmac.new(WEBHOOK_SECRET, message, hashlib.sha256).hexdigest()
 
-def verify_webhook_signature(data: dict) -> (bool, str):
+def _verify(ts, nonce, sig, signed_body: bytes) -> (bool, str):
     """
-    Requiere:
-      - ts: unix seconds (int)
-      - nonce: string
-      - sig: hex hmac sha256 (64 chars)
-
-    Firma = HMAC_SHA256(secret, f"{ts}.{nonce}.{canonical_json_without_sig}")
-
-    canonical_json_without_sig = json compacto (sort_keys) del payload SIN 'sig'
+    Chequeos comunes a los dos esquemas: formato, skew, HMAC y anti-replay.
+    Mensaje firmado = f"{ts}.{nonce}." + signed_body
     """
     if not WEBHOOK_SECRET:
         return False, "WEBHOOK_SECRET not set"
 
     try:
-        ts = int(data.get("ts"))
+        ts = int(ts)
     except Exception:
         return False, "missing/invalid ts"
 
-    nonce = str(data.get("nonce", "")).strip()
-    sig = str(data.get("sig", "")).strip().lower()
+    nonce = str(nonce or "").strip()
+    sig = str(sig or "").strip().lower()
 
     if not nonce or len(nonce) < 8:
         return False, "missing/invalid nonce"
@@ -180,46 +307,284 @@ def verify_webhook_signature(data: dict) -> (bool, str):
     if abs(now - ts) > MAX_SKEW:
         return False, f"ts skew too large ({now-ts}s)"
 
-    if _seen_nonce(nonce):
-        return False, "replay detected (nonce reused)"
+    expected = _hmac_hex(f"{ts}.{nonce}.".encode("utf-8") + signed_body)
+    if not hmac.compare_digest(expected, sig):
+        return False, "bad signature"
+
+    # el nonce se registra recién con la firma válida: requests sin firma
+    # no pueden llenar el store
+    try:
+        if _seen_nonce(nonce, ts):
+            return False, "replay detected (nonce reused)"
+    except NonceStoreFull:
+        return False, "nonce store full"
 
+    return True, "ok"
+
+def verify_webhook_signature(data: dict) -> (bool, str):
+    """
+    Esquema legacy (firma dentro del JSON). Requiere:
+      - ts: unix seconds (int)
+      - nonce: string
+      - sig: hex hmac sha256 (64 chars)
+
+    Firma = HMAC_SHA256(secret, f"{ts}.{nonce}.{canonical_json_without_sig}")
+
+    canonical_json_without_sig = json compacto (sort_keys) del payload SIN 'sig'
+    """
     # Firmamos sin el campo sig
-    d2 = dict(data)
-    d2.pop("sig", None)
+    d2 = {k: v for k, v in data.items() if k != "sig"}
+    canon = _canonical_payload(d2).encode("utf-8")
+    return _verify(data.get("ts"), data.get("nonce"), data.get("sig"), canon)
 
-    canon = _canonical_payload(d2)
-    msg = f"{ts}.{nonce}.{canon}"
-    expected = _hmac_hex(msg)
+def verify_raw_signature(header: str, body: bytes) -> (bool, str):
+    """
+    Esquema sobre bytes crudos (sin re-serializar nada):
+      X-Signature: {ts}.{nonce}.{hex hmac}
+    Firma = HMAC_SHA256(secret, f"{ts}.{nonce}." + body)
+    """
+    parts = (header or "").strip().split(".")
+    if len(parts) != 3:
+        return False, "missing/invalid X-Signature"
+    ts, nonce, sig = parts
+    return _verify(ts, nonce, sig, body)
 
-    if not hmac.compare_digest(expected, sig):
-        return False, "bad signature"
 
-    return True, "ok"
+# =========================
+# PROCESAMIENTO DE SEÑALES (DB + Telegram)
+# =========================
+INSERT_SIGNAL_SQL = (
+    "INSERT INTO signals(ts_utc,symbol,tf,side,price,tp,sl,reason,payload,ts,idem_key) "
+    "VALUES(?,?,?,?,?,?,?,?,?,?,?)"
+)
+# la clave se reserva primero: con clave repetida no inserta (rowcount 0)
+# y la señal no se guarda
+INSERT_KEY_SQL = statement("INSERT INTO signal_keys(idem_key) VALUES(?) ON CONFLICT(idem_key) DO NOTHING")
+
+def _signal_row(symbol, tf, side, price, tp, sl, reason, data, idem_key) -> tuple:
+    # ts_utc (texto, compat) y ts (nativo, indexado) salen del mismo instante;
+    # el payload se guarda sin secretos y compacto (payloads.py);
+    # idem_key siempre al final
+    now = datetime.now(timezone.utc)
+    return (now.isoformat(), symbol, tf, side, price, tp, sl, reason, payloads.encode(data), ts_param(now), idem_key)
+
+def _flush_signals(c, items):
+    """
+    Flush del writer. items = [(row, messages), ...] con messages =
+    [(chat_id, text), ...] o None.
+    Las claves de idempotencia se reservan una por una en signal_keys
+    (misma transacción) para saber por rowcount cuáles eran duplicadas;
+    después todas las filas nuevas van en un solo executemany. Los
+    contadores del dashboard y (con outbox) los mensajes de las filas nuevas
+    se escriben en la MISMA transacción. Devuelve True por fila nueva.
+    """
+    results = []
+    for row, _ in items:
+        if row[-1] is None:
+            results.append(True)
+            continue
+        c.execute(INSERT_KEY_SQL, (row[-1],))
+        results.append(c.rowcount == 1)
+    fresh = [row for (row, _), new in zip(items, results) if new]
+    if fresh:
+        c.executemany(INSERT_SIGNAL_SQL, fresh)
+
+    counters.bump(c, [row[1:4] for (row, _), new in zip(items, results) if new])
+    if outbox.OUTBOX_ENABLED:
+        outbox.enqueue_many(c, [
+            m for (_, messages), new in zip(items, results) if new and messages for m in messages
+        ])
+    return results
+
+signal_writer = BatchWriter(
+    _flush_signals,
+    window_ms=SIGNAL_BATCH_MS,
+    max_rows=SIGNAL_BATCH_MAX,
+    name="signal-writer",
+)
+
+idem_cache = LRUCache(IDEMPOTENCY_CACHE_SIZE)
+
+def _insert_signal(row: tuple, messages: list = None) -> bool:
+    """
+    Devuelve True si la fila es nueva, False si era un duplicado (idem_key).
+    `messages` = [(chat_id, text)] solo en modo outbox (se encolan con la señal).
+    Si la fila cae en un mes sin partición (Postgres particionado) se crean
+    las que faltan y se reintenta una vez.
+    """
+    partitions.start_keeper()
+    try:
+        return _write_signal(row, messages)
+    except Exception as e:
+        if not partitions.is_missing_partition(e):
+            raise
+        partitions.ensure_partitions()
+        return _write_signal(row, messages)
+
+def _write_signal(row: tuple, messages: list = None) -> bool:
+    if SIGNAL_BATCH:
+        # vuelve recién cuando el batch hizo commit (ack durable)
+        return signal_writer.write((row, messages), timeout=SIGNAL_BATCH_TIMEOUT)
+    with conn() as c:
+        inserted = _flush_signals(c, [(row, messages)])[0]
+        c.commit(strict=True)
+    return inserted
+
+def process_signal_job(job: dict) -> dict:
+    """
+    job = {"row": (ts_utc,symbol,tf,side,price,tp,sl,reason,payload,ts,idem_key), "msg": str, "item": dict}
+    Guarda la señal y manda el Telegram (solo si la fila es nueva).
+    Con TELEGRAM_DIGEST=1 el mensaje se junta con el resto de la ráfaga
+    (digest.py) y sale agrupado al cerrar la ventana.
+    Con OUTBOX_ENABLED=1 el mensaje queda en la tabla outbox (misma
+    transacción) y lo entregan los workers del outbox: el request no espera
+    a Telegram.
+    Se usa tanto en modo síncrono como desde los workers de la cola.
+    """
+    # destinatarios ANTES de abrir la transacción (el índice puede recargarse)
+    item = job["item"]
+    if job.get("admin_only"):
+        chats = [TELEGRAM_CHAT_ID] if TELEGRAM_CHAT_ID else []
+    else:
+        chats = _recipients(item["symbol"], item["tf"], item["side"])
+
+    if TELEGRAM_DIGEST:
+        if not _insert_signal(job["row"]):
+            return {"duplicate": True}
+        for chat in chats:
+            digest.add(chat, item, job["msg"])
+        return {"telegram_queued": True}
+
+    if outbox.OUTBOX_ENABLED:
+        if not _insert_signal(job["row"], [(chat, job["msg"]) for chat in chats]):
+            return {"duplicate": True}
+        outbox.outbox_worker.wake()
+        return {"telegram_queued": True}
+
+    if not _insert_signal(job["row"]):
+        return {"duplicate": True}
+
+    # lo que queda del presupuesto del request (None en los workers de la cola)
+    budget = job["deadline"] - time.monotonic() if job.get("deadline") else None
+    if budget is not None and budget < 0.2:
+        out, failed = {"telegram_sent": False}, chats
+    elif SUBSCRIPTIONS_ENABLED:
+        res = fanout.deliver(chats, job["msg"], partial(_send_to, timeout=budget), timeout=budget)
+        out = {"telegram_sent": res["sent"] > 0, "recipients": len(chats), "telegram_failed": res["failed"]}
+        failed = res["failed_chats"]
+    else:
+        ok = send_telegram(job["msg"], timeout=budget)
+        out, failed = {"telegram_sent": ok}, ([] if ok else chats)
+
+    if _retry_later(failed, job["msg"]):
+        out["telegram_retry"] = True
+    return out
+
+rate_limiter = RateLimiter(WEBHOOK_RATE, WEBHOOK_BURST, max_keys=WEBHOOK_RATE_MAX_KEYS)
+inflight_gate = ConcurrencyGate(WEBHOOK_MAX_INFLIGHT)
+
+def _rate_key(data: dict) -> str:
+    if WEBHOOK_RATE_KEY == "ip":
+        # remote_addr ya viene corregido por ProxyFix (TRUSTED_PROXIES)
+        return "ip:" + (request.remote_addr or "?")
+    if WEBHOOK_RATE_KEY == "strategy":
+        return "strategy:" + str(data.get("strategy_id", data.get("strategy", "?")))[:64]
+    # nunca exponer la passphrase en las métricas: solo un hash corto
+    p = str(data.get("passphrase", "")).strip()
+    return "pass:" + hashlib.sha256(p.encode("utf-8")).hexdigest()[:12]
+
+def _process_queued(job: dict) -> dict:
+    """
+    Handler de la cola: el resultado entra al cache de idempotencia recién
+    cuando la señal quedó commiteada (un 202 no garantiza nada todavía).
+    """
+    out = process_signal_job(job)
+    key = job["row"][-1]
+    if key:
+        idem_cache.put(key, ({"ok": True, **out, **job.get("extra", {})}, 200))
+    return out
+
+def _rate_limited(key: str):
+    """429 con Retry-After si `key` se quedó sin tokens, si no None."""
+    wait = rate_limiter.check(key)
+    if not wait:
+        return None
+    resp = jsonify({"ok": False, "error": "rate limited"})
+    resp.headers["Retry-After"] = str(RateLimiter.retry_after(wait))
+    return resp, 429
+
+ingest_queue = IngestQueue(_process_queued, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE)
+
+def _dispatch(job: dict, extra: dict = None):
+    """
+    Modo async: encola y responde 202 (503 si la cola está llena); el worker
+    cachea el resultado después del commit.
+    Modo sync: procesa en el request como siempre.
+    """
+    extra = extra or {}
+    if WEBHOOK_ASYNC:
+        job["extra"] = extra
+        if not ingest_queue.submit(job):
+            resp = jsonify({"ok": False, "error": "queue full"})
+            resp.headers["Retry-After"] = "1"
+            return resp, 503
+        return jsonify({"ok": True, "queued": True, **extra}), 202
+
+    job["deadline"] = time.monotonic() + WEBHOOK_DEADLINE
+    result, status = {"ok": True, **process_signal_job(job), **extra}, 200
+    key = job["row"][-1]
+    if key:
+        idem_cache.put(key, (result, status))
+    return jsonify(result), status
 
 
 # =========================
 # ROUTES
 # =========================
+@app.before_request
+def _start_background():
+    # workers del outbox por proceso (después del fork de gunicorn); idempotente
+    if outbox.OUTBOX_ENABLED:
+        outbox.outbox_worker.start()
+
 @app.get("/")
 def home():
     return jsonify({"status": "BANCRIPFUTBOT PRO ONLINE"}), 200
 
 @app.get("/health")
 def health():
-    return jsonify({"ok": True}), 200
+    out = {
+        "ok": True,
+        "db": pool_stats(),
+        "nonces": nonce_store.stats(),
+        "idempotency": idem_cache.stats(),
+        "admission": inflight_gate.stats(),
+        "ratelimit": rate_limiter.stats(),
+        "logs": log_stats(),
+        "telegram_breaker": notifier.breaker.stats(),
+    }
+    if outbox.OUTBOX_ENABLED:
+        out["outbox"] = outbox.outbox_worker.stats()
+    if TELEGRAM_SCHEDULER:
+        out["telegram_scheduler"] = scheduler.stats()
+    if TELEGRAM_DIGEST:
+        out["telegram_digest"] = digest.stats()
+    if SUBSCRIPTIONS_ENABLED:
+        out["subscriptions"] = {**subscription_index.stats(), "fanout": fanout.stats()}
+    if WEBHOOK_ASYNC:
+        out["ingest"] = ingest_queue.stats()
+    if SIGNAL_BATCH:
+        out["writer"] = signal_writer.stats()
+    return jsonify(out), 200
 
 
 # ---- LOGIN UI ----
 @app.get("/login")
 def login():
-    init_db()
-    ensure_admin()
     return render_template("login.html")
 
 @app.post("/login")
 def login_post():
-    init_db()
-    ensure_admin()
     u = request.form.get("username", "").strip()
     p = request.form.get("password", "").strip()
 
@@ -244,99 +609,219 @@ def logout():
 @app.get("/dashboard")
 @login_required
 def dashboard():
-    symbol = request.args.get("symbol", "").strip()
-    tf = request.args.get("tf", "").strip()
-    side = request.args.get("side", "").strip()
-
-    q = "SELECT * FROM signals WHERE 1=1"
-    params = []
-
-    if symbol:
-        q += " AND symbol=?"; params.append(symbol)
-    if tf:
-        q += " AND tf=?"; params.append(tf)
-    if side:
-        q += " AND side=?"; params.append(side)
-
-    q += " ORDER BY id DESC LIMIT 200"
-
-    with conn() as c:
-        rows = c.execute(q, tuple(params)).fetchall()
-        total = c.execute("SELECT COUNT(*) n FROM signals").fetchone()["n"]
-
-        buys  = c.execute("SELECT COUNT(*) n FROM signals WHERE side='BUY'").fetchone()["n"]
-        sells = c.execute("SELECT COUNT(*) n FROM signals WHERE side='SELL'").fetchone()["n"]
+    try:
+        f = history.parse_args(request.args)
+    except ValueError:
+        flash("Filtro inválido (fecha o id)")
+        return redirect(url_for("dashboard"))
+
+    with conn(readonly=True) as c:
+        page = history.fetch_page(c, **f)
+        # contadores mantenidos en cada INSERT (counters.py), no COUNT(*)
+        totals = counters.totals(c)
+        total = totals["total"]
+        buys  = totals.get("BUY", 0)
+        sells = totals.get("SELL", 0)
+
+    # los links de página conservan los filtros
+    keep = {k: request.args.get(k) for k in ("symbol", "tf", "side", "since", "until", "limit") if request.args.get(k)}
+    older_url = url_for("dashboard", **keep, before_id=page["before_id"]) if page["before_id"] else None
+    newer_url = url_for("dashboard", **keep, after_id=page["after_id"]) if page["after_id"] else None
 
     return render_template(
         "dashboard.html",
-        rows=rows,
+        rows=page["rows"],
         total=total,
-        symbol=symbol,
-        tf=tf,
-        side=side,
+        symbol=f["symbol"],
+        tf=f["tf"],
+        side=f["side"],
+        since=request.args.get("since", ""),
+        until=request.args.get("until", ""),
+        older_url=older_url,
+        newer_url=newer_url,
         role=current_user.role,
         buys=buys,
         sells=sells
     )
 
 
+# ---- API HISTORIAL ----
+@app.get("/api/signals")
+@login_required
+def api_signals():
+    """
+    Historial paginado por cursor: ?before_id= / ?after_id= (+ symbol, tf,
+    side, since, until, limit). Los cursores de la respuesta van tal cual
+    en el próximo request. ?payload=1 agrega el payload decodificado.
+    """
+    try:
+        f = history.parse_args(request.args, default_limit=100, max_limit=1000)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": f"bad parameter: {e}"}), 400
+
+    with_payload = request.args.get("payload") == "1"
+    columns = history.SIGNAL_COLUMNS + (", payload, raw_json" if with_payload else "")
+    with conn(readonly=True) as c:
+        page = history.fetch_page(c, columns=columns, **f)
+
+    signals = []
+    for r in page["rows"]:
+        item = {k: r[k] for k in r.keys() if k not in ("payload", "raw_json")}
+        if with_payload:
+            item["payload"] = payloads.row_payload(r)
+        signals.append(item)
+
+    return jsonify({
+        "ok": True,
+        "signals": signals,
+        "next": {"before_id": page["before_id"]} if page["before_id"] else None,
+        "prev": {"after_id": page["after_id"]} if page["after_id"] else None,
+    }), 200
+
+
+@app.get("/api/signals/stats")
+@login_required
+def api_signals_stats():
+    """
+    Conteo por side en un rango: ?since=24h (default) &until= &symbol= &tf=
+    """
+    try:
+        since = history.parse_time(request.args.get("since") or "24h")
+        until = history.parse_time(request.args.get("until"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": f"bad parameter: {e}"}), 400
+
+    with conn(readonly=True) as c:
+        counts = history.side_stats(
+            c, since, until,
+            symbol=request.args.get("symbol", "").strip(),
+            tf=request.args.get("tf", "").strip(),
+        )
+    return jsonify({
+        "ok": True,
+        "since": since.isoformat(),
+        "until": until.isoformat() if until else None,
+        "counts": counts,
+    }), 200
+
+
 # ---- EXPORT ----
 @app.get("/export.csv")
 @login_required
 def export_csv():
+    """
+    Mismos filtros y cursor que /api/signals (limit hasta 10000). Si hay
+    más, el header X-Next-Before-Id trae el cursor de la siguiente parte.
+    """
     if not is_admin():
         return "Forbidden", 403
 
-    with conn() as c:
-        rows = c.execute(
-            "SELECT id, ts_utc, symbol, tf, side, price, tp, sl, reason "
-            "FROM signals ORDER BY id DESC LIMIT 2000"
-        ).fetchall()
+    try:
+        f = history.parse_args(request.args, default_limit=2000, max_limit=10000)
+    except ValueError as e:
+        return f"bad parameter: {e}", 400
+
+    with conn(readonly=True) as c:
+        page = history.fetch_page(c, **f)
 
     lines = ["id,ts_utc,symbol,tf,side,price,tp,sl,reason"]
-    for r in rows:
+    for r in page["rows"]:
         reason = (r["reason"] or "").replace('"', '""')
         lines.append(
             f'{r["id"]},{r["ts_utc"]},{r["symbol"]},{r["tf"]},{r["side"]},'
             f'{r["price"]},{r["tp"]},{r["sl"]},"{reason}"'
         )
 
-    return app.response_class("\n".join(lines), mimetype="text/csv")
+    resp = app.response_class("\n".join(lines), mimetype="text/csv")
+    if page["before_id"]:
+        resp.headers["X-Next-Before-Id"] = str(page["before_id"])
+    return resp
 
 
 # ---- WEBHOOK (TradingView) ----
 @app.post("/webhook")
 def webhook():
-    init_db()
-    data = parse_tv_payload()
-    print("📩 WEBHOOK RECEIVED:", data)
+    t0 = time.perf_counter()
+    # sobrecarga: cortar al instante en vez de apilar trabajo bloqueante
+    if not inflight_gate.try_enter():
+        resp = jsonify({"ok": False, "error": "overloaded"})
+        resp.headers["Retry-After"] = "1"
+        out = (resp, 503)
+    else:
+        try:
+            out = _webhook()
+        finally:
+            inflight_gate.leave()
+
+    # una sola línea por request, con latencia y payload (muestreado + redactado)
+    resp, status = out
+    body = resp.get_json(silent=True) or {}
+    log_event(
+        log, "webhook",
+        http_status=status,
+        latency_ms=round((time.perf_counter() - t0) * 1000, 2),
+        bytes=request.content_length,
+        error=body.get("error"),
+        detail=body.get("detail"),
+        duplicate=body.get("duplicate"),
+        payload=g.get("log_payload"),
+    )
+    return out
+
+def _webhook():
+    try:
+        data, body = parse_tv_payload()
+    except InvalidJSON as e:
+        return jsonify({"ok": False, "error": "invalid JSON", "detail": str(e)}), 400
+    g.log_payload = payload_for_log(data)
 
     if not data:
         return jsonify({"ok": False, "error": "empty body"}), 400
 
-    # Si vino texto raro (no JSON)
+    # Si vino texto raro (no JSON): no trae passphrase, se limita por IP
     if "raw_message" in data:
+        limited = _rate_limited("raw:" + (request.remote_addr or "?"))
+        if limited:
+            return limited
         raw = data.get("raw_message", "")
-        with conn() as c:
-            c.execute(
-                "INSERT INTO signals(ts_utc,symbol,tf,side,price,tp,sl,reason,raw_json) "
-                "VALUES(?,?,?,?,?,?,?,?,?)",
-                (utc_now(), "RAW", "RAW", "RAW", None, None, None, "RAW_MESSAGE", json.dumps(data))
-            )
-            c.commit()
-        send_telegram("⚠️ TradingView mandó texto no-JSON:\n" + raw[:3500])
-        return jsonify({"ok": True, "telegram_sent": True, "note": "raw"}), 200
+        job = {
+            "row": _signal_row("RAW", "RAW", "RAW", None, None, None, "RAW_MESSAGE", data, None),
+            "msg": "⚠️ TradingView mandó texto no-JSON:\n" + raw[:3500],
+            "item": {"symbol": "RAW", "tf": "RAW", "side": "RAW", "reason": "RAW_MESSAGE", "raw_message": raw[:3500]},
+            "admin_only": True,  # solo al canal principal, nunca a suscriptores
+        }
+        return _dispatch(job, {"note": "raw"})
 
     # 1) passphrase
     if str(data.get("passphrase", "")).strip() != WEBHOOK_PASSPHRASE:
         return jsonify({"ok": False, "error": "bad passphrase"}), 403
 
-    # 2) firma HMAC (ts/nonce/sig)
-    ok_sig, why = verify_webhook_signature(data)
+    # 2) firma HMAC: sobre el body crudo (X-Signature) o legacy (ts/nonce/sig en el JSON)
+    sig_header = request.headers.get("X-Signature")
+    if sig_header:
+        ok_sig, why = verify_raw_signature(sig_header, body)
+    else:
+        ok_sig, why = verify_webhook_signature(data)
+
+    # 3) reintento de una señal ya procesada: mismo resultado, sin DB ni Telegram.
+    # Un reintento firmado trae el mismo nonce, así que llega como "replay".
+    idem_key = signal_key(data)
+    cached = idem_cache.get(idem_key) if idem_key else None
+    if cached and (ok_sig or why.startswith("replay")):
+        result, status = cached
+        return jsonify({**result, "duplicate": True}), status
+
     if not ok_sig:
         return jsonify({"ok": False, "error": "bad_signature", "detail": why}), 403
 
-    # 3) campos
+    # rate limit por fuente: recién con la firma válida (un request forjado
+    # con la passphrase no puede vaciar el bucket compartido) y antes de DB
+    # y Telegram
+    limited = _rate_limited(_rate_key(data))
+    if limited:
+        return limited
+
+    # 4) campos
     symbol = str(data.get("symbol", "BTCUSDT"))
     tf     = str(data.get("tf", "15m"))
     side   = str(data.get("side", "N/A")).upper()
@@ -344,17 +829,12 @@ def webhook():
     tp     = fnum(data.get("tp"))
     sl     = fnum(data.get("sl"))
     reason = str(data.get("reason", ""))
+    # '*' es el "todos" de signal_counters (y de las suscripciones): una
+    # señal con side="*" se contaría dos veces en el total
+    if counters.ANY in (symbol.strip(), tf.strip(), side.strip()):
+        return jsonify({"ok": False, "error": "bad field", "detail": "'*' is reserved"}), 400
 
-    # 4) guardar en DB
-    with conn() as c:
-        c.execute(
-            "INSERT INTO signals(ts_utc,symbol,tf,side,price,tp,sl,reason,raw_json) "
-            "VALUES(?,?,?,?,?,?,?,?,?)",
-            (utc_now(), symbol, tf, side, price, tp, sl, reason, json.dumps(data))
-        )
-        c.commit()
-
-    # 5) enviar Telegram
+    # 5) mensaje Telegram
     icon = "🟢" if side == "BUY" else "🔴" if side == "SELL" else "✅"
     msg = (
         f"{icon} BANCRIPFUT PRO SIGNAL\n"
@@ -365,17 +845,21 @@ def webhook():
         f"🛑 SL: {sl}\n"
         f"🧾 {reason}"
     )
-    telegram_sent = send_telegram(msg)
 
-    return jsonify({"ok": True, "telegram_sent": telegram_sent}), 200
+    # 6) guardar en DB + enviar Telegram (en el request o en la cola)
+    job = {
+        "row": _signal_row(symbol, tf, side, price, tp, sl, reason, data, idem_key),
+        "msg": msg,
+        "item": {"symbol": symbol, "tf": tf, "side": side, "price": price, "tp": tp, "sl": sl, "reason": reason},
+    }
+    return _dispatch(job)
 
 
 # =========================
 # RUN LOCAL
 # =========================
 if __name__ == "__main__":
-    init_db()
-    ensure_admin()
+    bootstrap()
     port = int(os.getenv("PORT", "5000"))
     print(f"🚀 BANCRIPFUTBOT PRO iniciando en puerto {port}")
     app.run(host="0.0.0.0", port=port, debug=False)
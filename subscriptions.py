@@ -0,0 +1,241 @@
+"""
+Suscripciones: qué chats reciben qué señales.
+
+Tabla `subscriptions` (migración 5): chat_id (+ user_id opcional) con
+filtros symbol / tf / side, donde '*' = cualquiera.
+
+Por señal NO se consulta la tabla: se resuelve contra un índice en memoria
+symbol -> tf -> side -> {chats} (8 lookups de dict, con los comodines).
+El índice se recarga entero cada SUBSCRIPTIONS_REFRESH segundos (o al
+llamar invalidate() después de modificar la tabla desde este proceso).
+
+La entrega a N chats va por un pool acotado (SUBSCRIPTIONS_PARALLELISM)
+para no abrir miles de conexiones a la vez.
+
+    chats = subscription_index.match("BTCUSDT", "15m", "BUY")
+    fanout.deliver(chats, text, send_fn)
+
+CLI:
+    python subscriptions.py list
+    python subscriptions.py add <chat_id> [symbol] [tf] [side]
+    python subscriptions.py remove <chat_id> [symbol] [tf] [side]
+
+Config:
+    SUBSCRIPTIONS_ENABLED       1 = usar la tabla además de TELEGRAM_CHAT_ID
+    SUBSCRIPTIONS_REFRESH       30   seg entre recargas del índice
+    SUBSCRIPTIONS_PARALLELISM   16   envíos en paralelo por fan-out
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from db import conn, utc_now
+from logs import get_logger, log_event
+
+SUBSCRIPTIONS_ENABLED = os.getenv("SUBSCRIPTIONS_ENABLED", "0").strip() == "1"
+SUBSCRIPTIONS_REFRESH = float(os.getenv("SUBSCRIPTIONS_REFRESH", "30"))
+SUBSCRIPTIONS_PARALLELISM = int(os.getenv("SUBSCRIPTIONS_PARALLELISM", "16"))
+
+ANY = "*"
+
+log = get_logger("subscriptions")
+
+
+def _norm(value, upper: bool = False) -> str:
+    value = str(value if value is not None else ANY).strip() or ANY
+    return value.upper() if upper else value
+
+
+# =========================
+# TABLA
+# =========================
+def add_subscription(chat_id, symbol=ANY, tf=ANY, side=ANY, user_id=None) -> bool:
+    """
+    Alta (o reactivación). Devuelve True si quedó activa.
+    """
+    key = (str(chat_id), _norm(symbol, upper=True), _norm(tf), _norm(side, upper=True))
+    with conn() as c:
+        c.execute(
+            "INSERT INTO subscriptions(user_id,chat_id,symbol,tf,side,active,created_at) "
+            "VALUES(?,?,?,?,?,1,?) "
+            "ON CONFLICT(chat_id,symbol,tf,side) DO UPDATE SET active=1",
+            (user_id, *key, utc_now())
+        )
+        c.commit(strict=True)
+    subscription_index.invalidate()
+    return True
+
+
+def remove_subscription(chat_id, symbol=ANY, tf=ANY, side=ANY) -> bool:
+    with conn() as c:
+        c.execute(
+            "UPDATE subscriptions SET active=0 WHERE chat_id=? AND symbol=? AND tf=? AND side=?",
+            (str(chat_id), _norm(symbol, upper=True), _norm(tf), _norm(side, upper=True))
+        )
+        n = c.rowcount or 0
+        c.commit(strict=True)
+    subscription_index.invalidate()
+    return n > 0
+
+
+def list_subscriptions():
+    with conn() as c:
+        return c.execute(
+            "SELECT id, user_id, chat_id, symbol, tf, side, active FROM subscriptions ORDER BY id"
+        ).fetchall()
+
+
+# =========================
+# ÍNDICE EN MEMORIA
+# =========================
+class SubscriptionIndex:
+    """
+    symbol -> tf -> side -> set(chat_ids). Se reemplaza entero en
+    cada recarga (swap atómico), así match() nunca toma locks.
+    """
+    def __init__(self, refresh: float = 30.0):
+        self.refresh = max(0.0, float(refresh))
+        self._index = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.reloads = 0
+        self.matches = 0
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def load(self, rows=None):
+        if rows is None:
+            with conn() as c:
+                rows = c.execute(
+                    "SELECT chat_id, symbol, tf, side FROM subscriptions WHERE active=1"
+                ).fetchall()
+        index = {}
+        for r in rows:
+            (index.setdefault(r["symbol"], {})
+                  .setdefault(r["tf"], {})
+                  .setdefault(r["side"], set())
+                  .add(str(r["chat_id"])))
+        self._index = index
+        self._loaded_at = time.monotonic()
+        self.rows = len(rows)
+        self.reloads += 1
+
+    def _maybe_reload(self):
+        loaded = self._loaded_at
+        if loaded is not None and time.monotonic() - loaded < self.refresh:
+            return
+        # un solo thread recarga; el resto sigue con el índice anterior
+        if not self._lock.acquire(blocking=loaded is None):
+            return
+        try:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh:
+                self.load()
+        except Exception as e:
+            log_event(log, "subscriptions_reload_error", logging.ERROR, error=str(e)[:200])
+        finally:
+            self._lock.release()
+
+    def match(self, symbol: str, tf: str, side: str) -> set:
+        self._maybe_reload()
+        symbol, side = str(symbol).upper(), str(side).upper()
+        index = self._index
+        out = set()
+        for by_tf in (index.get(symbol), index.get(ANY)):
+            if not by_tf:
+                continue
+            for by_side in (by_tf.get(tf), by_tf.get(ANY)):
+                if not by_side:
+                    continue
+                for chats in (by_side.get(side), by_side.get(ANY)):
+                    if chats:
+                        out |= chats
+        self.matches += 1
+        return out
+
+    def stats(self) -> dict:
+        return {"rows": self.rows, "reloads": self.reloads, "matches": self.matches}
+
+
+# =========================
+# FAN-OUT
+# =========================
+class Fanout:
+    """
+    Entrega un mensaje a muchos chats con paralelismo acotado.
+    send_fn(chat_id, text) lanza si falla. `timeout` acota la espera total.
+    """
+    def __init__(self, parallelism: int = 16):
+        self.parallelism = max(1, int(parallelism))
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+
+    def _get_pool(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pool = ThreadPoolExecutor(self.parallelism, thread_name_prefix="fanout")
+                    self._pid = pid
+        return self._pool
+
+    def _send_one(self, send_fn, chat, text) -> bool:
+        try:
+            send_fn(chat, text)
+            return True
+        except Exception as e:
+            log_event(log, "fanout_send_error", logging.WARNING, chat=chat, error=str(e)[:200])
+            return False
+
+    def deliver(self, chats, text: str, send_fn, timeout: float = None) -> dict:
+        chats = list(chats)
+        if not chats:
+            return {"sent": 0, "failed": 0, "failed_chats": []}
+        if len(chats) == 1:
+            results = [self._send_one(send_fn, chats[0], text)]
+        else:
+            pool = self._get_pool()
+            futs = [pool.submit(self._send_one, send_fn, chat, text) for chat in chats]
+            done, _ = wait(futs, timeout=timeout)
+            # vencido el plazo: lo que no arrancó se cancela y cuenta como
+            # fallido (se puede reintentar); lo que ya está en vuelo termina solo
+            results = [f.result() if f in done else (False if f.cancel() else None) for f in futs]
+        ok = sum(1 for r in results if r)
+        failed_chats = [chat for chat, r in zip(chats, results) if r is False]
+        self.sent += ok
+        self.failed += len(failed_chats)
+        return {"sent": ok, "failed": len(failed_chats), "failed_chats": failed_chats}
+
+    def stats(self) -> dict:
+        return {"parallelism": self.parallelism, "sent": self.sent, "failed": self.failed}
+
+
+subscription_index = SubscriptionIndex(SUBSCRIPTIONS_REFRESH)
+fanout = Fanout(SUBSCRIPTIONS_PARALLELISM)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from db import migrate
+
+    migrate()
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "list"
+    args = sys.argv[2:]
+    if cmd == "list":
+        for r in list_subscriptions():
+            print(dict(r))
+    elif cmd == "add" and args:
+        add_subscription(*args[:4])
+        print("✅ Suscripción activa")
+    elif cmd == "remove" and args:
+        print("✅ Suscripción desactivada" if remove_subscription(*args[:4]) else "⚠️ No existe")
+    else:
+        print("Uso: python subscriptions.py list | add <chat_id> [symbol] [tf] [side] | remove ...")
+        sys.exit(2)
@@ -0,0 +1,35 @@
+"""
+Los módulos leen su config del entorno al importarse: SQLite en un
+directorio temporal ANTES de importar nada del repo. Con DATABASE_URL
+definida los tests que usan `db` corren contra ese Postgres.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(prefix="bancripfut-tests-"), "test.db"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    Base migrada: SQLite nueva por test, o el Postgres de DATABASE_URL.
+    """
+    import db
+    if not db._is_postgres():
+        monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    db.migrate()
+    return db
+
+
+@pytest.fixture
+def sqlite_db(database):
+    if database._is_postgres():
+        pytest.skip("solo SQLite")
+    return database
@@ -0,0 +1,122 @@
+"""
+conn() y aconn() tienen que comportarse igual: mismos resultados, mismo
+rowcount y mismo commit/rollback. SQLite siempre; Postgres con
+DATABASE_URL.
+"""
+import asyncio
+import uuid
+
+import db
+
+INSERT = "INSERT INTO users(username,password_hash) VALUES(?,?)"
+
+
+def _visible(prefix: str) -> int:
+    # desde otra conexión: solo ve lo commiteado
+    with db.conn(readonly=True) as c:
+        return c.execute(
+            "SELECT COUNT(*) n FROM users WHERE username LIKE ?", (prefix + "%",)
+        ).fetchone()["n"]
+
+
+def _sync(p: str) -> list:
+    out = []
+    with db.conn() as c:
+        c.execute(INSERT, (p + "one", "h"))
+        out.append(("insert", c.rowcount))
+        c.executemany(INSERT, [(f"{p}many{i}", "h") for i in range(3)])
+        out.append(("before commit", _visible(p)))
+        c.commit(strict=True)
+        out.append(("after commit", _visible(p)))
+        r = c.execute("SELECT username, role FROM users WHERE username=?", (p + "one",)).fetchone()
+        out.append(("fetchone", r["username"][len(p):], r["role"], sorted(r.keys())))
+        rows = c.execute("SELECT username FROM users WHERE username LIKE ? ORDER BY username", (p + "many%",)).fetchall()
+        out.append(("fetchall", [r["username"][len(p):] for r in rows]))
+        out.append(("missing", c.execute("SELECT id FROM users WHERE username=?", (p + "nope",)).fetchone()))
+        c.execute("UPDATE users SET role='ADMIN' WHERE username LIKE ?", (p + "many%",))
+        out.append(("update", c.rowcount))
+        c.execute("DELETE FROM users WHERE username=?", (p + "many0",))
+        out.append(("delete", c.rowcount))
+    # salir del bloque sin error = commit
+    out.append(("exit commits", _visible(p)))
+
+    try:
+        with db.conn() as c:
+            c.execute(INSERT, (p + "rollback", "h"))
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    out.append(("exception rolls back", _visible(p)))
+
+    with db.conn() as c:
+        c.execute("SELECT COUNT(*) n FROM users WHERE username LIKE ?", (p + "%",))
+        out.append(("session fetchone", c.fetchone()["n"]))
+        c.execute("SELECT username FROM users WHERE username LIKE ?", (p + "%",))
+        out.append(("session fetchall", len(c.fetchall())))
+    return out
+
+
+async def _async(p: str) -> list:
+    out = []
+    async with db.aconn() as c:
+        await c.execute(INSERT, (p + "one", "h"))
+        out.append(("insert", c.rowcount))
+        await c.executemany(INSERT, [(f"{p}many{i}", "h") for i in range(3)])
+        out.append(("before commit", _visible(p)))
+        await c.commit(strict=True)
+        out.append(("after commit", _visible(p)))
+        r = await (await c.execute("SELECT username, role FROM users WHERE username=?", (p + "one",))).fetchone()
+        out.append(("fetchone", r["username"][len(p):], r["role"], sorted(r.keys())))
+        cur = await c.execute("SELECT username FROM users WHERE username LIKE ? ORDER BY username", (p + "many%",))
+        out.append(("fetchall", [r["username"][len(p):] for r in await cur.fetchall()]))
+        out.append(("missing", await (await c.execute("SELECT id FROM users WHERE username=?", (p + "nope",))).fetchone()))
+        await c.execute("UPDATE users SET role='ADMIN' WHERE username LIKE ?", (p + "many%",))
+        out.append(("update", c.rowcount))
+        await c.execute("DELETE FROM users WHERE username=?", (p + "many0",))
+        out.append(("delete", c.rowcount))
+    out.append(("exit commits", _visible(p)))
+
+    try:
+        async with db.aconn() as c:
+            await c.execute(INSERT, (p + "rollback", "h"))
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    out.append(("exception rolls back", _visible(p)))
+
+    async with db.aconn() as c:
+        await c.execute("SELECT COUNT(*) n FROM users WHERE username LIKE ?", (p + "%",))
+        out.append(("session fetchone", (await c.fetchone())["n"]))
+        await c.execute("SELECT username FROM users WHERE username LIKE ?", (p + "%",))
+        out.append(("session fetchall", len(await c.fetchall())))
+    await db.aclose_pool()
+    return out
+
+
+def _prefix() -> str:
+    return f"t{uuid.uuid4().hex[:10]}_"
+
+
+def test_same_results_rowcount_and_commits(database):
+    sync = _sync(_prefix())
+    async_ = asyncio.run(_async(_prefix()))
+    assert sync == async_
+    # y los valores son los esperados, no solo iguales entre sí
+    assert dict((k[0], k[1:]) for k in sync)["exit commits"] == (3,)
+    assert ("before commit", 0) in sync and ("after commit", 4) in sync
+
+
+def test_readonly_session_reads_committed_rows(database):
+    p = _prefix()
+    with db.conn() as c:
+        c.execute(INSERT, (p + "ro", "h"))
+
+    async def read():
+        async with db.aconn(readonly=True) as c:
+            r = await (await c.execute("SELECT username FROM users WHERE username=?", (p + "ro",))).fetchone()
+        await db.aclose_pool()
+        return r["username"]
+
+    with db.conn(readonly=True) as c:
+        sync = c.execute("SELECT username FROM users WHERE username=?", (p + "ro",)).fetchone()["username"]
+    assert sync == asyncio.run(read()) == p + "ro"
@@ -0,0 +1,54 @@
+"""
+Regresión de planes del dashboard (antes: `python db.py explain` a mano).
+"""
+import pytest
+
+
+def test_dashboard_queries_use_index_and_pk_order(database):
+    bad = [(sql, plan) for sql, plan, ok in database.explain_dashboard() if not ok]
+    assert not bad, "\n\n".join(f"{sql}\n{plan}" for sql, plan in bad)
+
+
+def test_filtered_query_without_index_is_flagged(sqlite_db):
+    import history
+    with sqlite_db.conn() as c:
+        c.execute("DROP INDEX idx_signals_side")
+        c.commit()
+    flagged = {sql for sql, _, ok in sqlite_db.explain_dashboard() if not ok}
+    # primera página de fetch_page filtrada sólo por side (con cursor el PK
+    # acota el rango y el plan pasa igual)
+    assert f"SELECT {history.SIGNAL_COLUMNS} FROM signals WHERE 1=1 AND side=? ORDER BY id DESC LIMIT ?" in flagged
+
+
+def test_dashboard_queries_follow_fetch_page(sqlite_db):
+    import history
+    sqls = [sql for sql, *_ in sqlite_db.dashboard_queries()]
+    assert all(sql.startswith(f"SELECT {history.SIGNAL_COLUMNS} FROM signals") for sql in sqls if "FROM signals " in sql)
+    assert any("ts >= ? AND ts < ?" in sql for sql in sqls)
+    assert any("signal_counters" in sql for sql in sqls)
+
+
+@pytest.mark.parametrize("kind, plan, filtered, ok", [
+    # listado sin filtros: scan del PK en orden, corta en LIMIT
+    ("sqlite", "SCAN signals", False, True),
+    ("sqlite", "SCAN signals\nUSE TEMP B-TREE FOR ORDER BY", False, False),
+    ("sqlite", "SCAN signals", True, False),
+    ("sqlite", "SEARCH signals USING INDEX idx_signals_side (side=?)", True, True),
+    ("postgres", "Limit\n  ->  Index Scan Backward using signals_pkey on signals", False, True),
+    ("postgres", "Limit\n  ->  Sort\n        Sort Key: id DESC\n        ->  Seq Scan on signals", False, False),
+    ("postgres", "Limit\n  ->  Sort  (cost=1.0..2.0 rows=1 width=8)\n"
+                 "        ->  Bitmap Heap Scan on signals", True, False),
+    # tabla particionada: Merge Append mezcla los índices de cada partición sin ordenar
+    ("postgres", "Limit\n  ->  Merge Append\n        Sort Key: signals.id DESC\n"
+                 "        ->  Index Scan Backward using signals_2026_10_pkey on signals_2026_10", False, True),
+])
+def test_plan_ok(kind, plan, filtered, ok):
+    from db import _plan_ok
+    assert _plan_ok(kind, plan, filtered) is ok
+
+
+def test_plan_ok_ranged_accepts_sort_over_window():
+    from db import _plan_ok
+    plan = "SEARCH signals USING INDEX idx_signals_ts (ts>? AND ts<?)\nUSE TEMP B-TREE FOR ORDER BY"
+    assert _plan_ok("sqlite", plan, False, ranged=True)
+    assert not _plan_ok("sqlite", plan, False)
@@ -0,0 +1,64 @@
+"""
+Varios procesos (fork, como los workers de gunicorn) reproduciendo los
+mismos nonces: cada nonce se acepta exactamente una vez entre todos.
+"""
+import multiprocessing
+import random
+import time
+import uuid
+from collections import Counter
+
+import pytest
+
+import nonces
+
+WORKERS = 8
+NONCES = 3000
+
+ctx = multiprocessing.get_context("fork")
+
+
+def _replay(store, batch, start, out):
+    order = list(batch)
+    random.shuffle(order)
+    ts = int(time.time())
+    start.wait()
+    out.put([n for n in order if not store.seen(n, ts)])
+
+
+def _accepted(store) -> Counter:
+    batch = [uuid.uuid4().hex for _ in range(NONCES)]
+    start, out = ctx.Barrier(WORKERS), ctx.Queue()
+    procs = [ctx.Process(target=_replay, args=(store, batch, start, out)) for _ in range(WORKERS)]
+    for p in procs:
+        p.start()
+    accepted = Counter()
+    for _ in procs:
+        accepted.update(out.get(timeout=60))
+    for p in procs:
+        p.join(timeout=10)
+        assert p.exitcode == 0
+    assert set(accepted) == set(batch)
+    return accepted
+
+
+def test_db_store_accepts_each_nonce_once(database):
+    store = nonces.DBNonceStore(max_skew=300, sweep_seconds=3600)
+    accepted = _accepted(store)
+    assert max(accepted.values()) == 1
+
+
+def test_shm_store_accepts_each_nonce_once(tmp_path):
+    store = nonces.ShmNonceStore(max_skew=300, path=str(tmp_path / "nonces.shm"), slots=65536)
+    accepted = _accepted(store)
+    assert max(accepted.values()) == 1
+
+
+@pytest.mark.parametrize("backend", ["shm", "db"])
+def test_replay_in_parent_after_workers(backend, database, tmp_path):
+    store = nonces.make_nonce_store(backend, 300, shm_path=str(tmp_path / "n.shm"), sweep_seconds=3600)
+    nonce, ts = uuid.uuid4().hex, int(time.time())
+    p = ctx.Process(target=store.seen, args=(nonce, ts))
+    p.start()
+    p.join(timeout=10)
+    assert store.seen(nonce, ts) is True
@@ -0,0 +1,64 @@
+"""
+Perfil SQLite (WAL + busy_timeout): varios procesos escribiendo señales a
+la vez, un commit por señal como el webhook, con lecturas del dashboard
+en paralelo. Todas las filas llegan y ningún "database is locked".
+"""
+import multiprocessing
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import db
+from server import INSERT_SIGNAL_SQL
+
+WRITERS = 4
+ROWS = 250
+
+ctx = multiprocessing.get_context("fork")
+
+
+def _writer(n, start, out):
+    locked = 0
+    start.wait()
+    for i in range(ROWS):
+        now = datetime.now(timezone.utc)
+        row = (now.isoformat(), f"W{n}", "1m", "BUY", 1.0, 2.0, 0.5, "stress", None,
+               db.ts_param(now), f"stress-{n}-{i}")
+        try:
+            with db.conn() as c:
+                c.execute(INSERT_SIGNAL_SQL, row)
+                c.commit(strict=True)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            locked += 1
+    out.put(locked)
+
+
+def _reader(start, stop):
+    start.wait()
+    while not stop.is_set():
+        with db.conn(readonly=True) as c:
+            c.execute("SELECT id, symbol FROM signals ORDER BY id DESC LIMIT 200").fetchall()
+
+
+def test_concurrent_writers_no_lock_errors(sqlite_db):
+    start, out, stop = ctx.Barrier(WRITERS + 2), ctx.Queue(), ctx.Event()
+    writers = [ctx.Process(target=_writer, args=(n, start, out)) for n in range(WRITERS)]
+    reader = ctx.Process(target=_reader, args=(start, stop))
+    for p in writers + [reader]:
+        p.start()
+    start.wait()
+    t0 = time.perf_counter()
+    locked = sum(out.get(timeout=120) for _ in writers)
+    dt = time.perf_counter() - t0
+    stop.set()
+    for p in writers + [reader]:
+        p.join(timeout=30)
+        assert p.exitcode == 0
+
+    with db.conn(readonly=True) as c:
+        n = c.execute("SELECT COUNT(*) n FROM signals WHERE reason='stress'").fetchone()["n"]
+    print(f"\n{WRITERS} procesos x {ROWS} señales: {int(n / dt)} escrituras/s, {locked} locked")
+    assert locked == 0
+    assert n == WRITERS * ROWS
@@ -0,0 +1,151 @@
+"""
+Writer con micro-batching + group commit.
+
+Junta los INSERTs que llegan dentro de una ventana corta (SIGNAL_BATCH_MS)
+o hasta N filas, y los escribe en UNA transacción con executemany.
+Cada llamador recibe su ack (Future) recién cuando el batch hizo commit,
+así que la durabilidad es la misma que un INSERT+COMMIT individual pero con
+un solo fsync/flush de WAL por batch. Si el batch falla se reintenta fila
+por fila: una fila mala no tumba a las demás.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db import conn
+from logs import get_logger, log_event
+
+log = get_logger("writer")
+
+
+def executemany_flush(sql: str):
+    """
+    flush por defecto: un executemany de `sql` con todas las filas.
+    """
+    def _flush(c, rows):
+        c.executemany(sql, rows)
+        return [None] * len(rows)
+    return _flush
+
+
+class BatchWriter:
+    """
+        w = BatchWriter(executemany_flush("INSERT ..."), window_ms=10, max_rows=100)
+        w.write(row)          # bloquea hasta el commit del batch
+        fut = w.submit(row)   # o async: Future que se resuelve al commit
+
+    `flush(c, rows)` corre dentro de `with conn() as c` y devuelve una lista
+    de resultados (uno por fila) que se entregan a cada Future.
+    """
+    def __init__(self, flush, window_ms: float = 10, max_rows: int = 100, name: str = "writer"):
+        self.flush = flush
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_rows = max(1, int(max_rows))
+        self.name = name
+
+        self._q = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+        # métricas
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+        self.isolated = 0       # batches que fallaron y se reescribieron fila por fila
+        self.max_batch = 0
+        self.last_commit_ms = 0.0
+
+    def _start(self):
+        # fork-safe: un thread escritor por proceso
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._q = queue.Queue()
+            threading.Thread(target=self._run, name=self.name, daemon=True).start()
+            self._pid = pid
+
+    def submit(self, row) -> Future:
+        self._start()
+        fut = Future()
+        self._q.put((row, fut))
+        return fut
+
+    def write(self, row, timeout: float = None):
+        return self.submit(row).result(timeout)
+
+    def _collect(self):
+        batch = [self._q.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_rows:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=left))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_each(self, batch):
+        """
+        El batch falló (y se hizo rollback): cada fila en su propia
+        transacción, así solo la fila mala recibe la excepción.
+        """
+        self.isolated += 1
+        for row, fut in batch:
+            try:
+                with conn() as c:
+                    res = self.flush(c, [row])[0]
+                    c.commit(strict=True)
+            except Exception as e:
+                self.errors += 1
+                log_event(log, "writer_row_error", logging.ERROR, writer=self.name, error=str(e)[:200])
+                fut.set_exception(e)
+                continue
+            self.rows += 1
+            fut.set_result(res)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            rows = [r for r, _ in batch]
+            t0 = time.perf_counter()
+            try:
+                with conn() as c:
+                    results = self.flush(c, rows)
+                    c.commit(strict=True)
+            except Exception as e:
+                if len(batch) > 1:
+                    self._write_each(batch)
+                    continue
+                self.errors += 1
+                log_event(log, "writer_batch_error", logging.ERROR, writer=self.name, error=str(e)[:200])
+                batch[0][1].set_exception(e)
+                continue
+
+            self.last_commit_ms = (time.perf_counter() - t0) * 1000.0
+            self.batches += 1
+            self.rows += len(rows)
+            self.max_batch = max(self.max_batch, len(rows))
+            for (_, fut), res in zip(batch, results):
+                fut.set_result(res)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._q.qsize(),
+            "window_ms": self.window * 1000.0,
+            "max_rows": self.max_rows,
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "errors": self.errors,
+            "isolated": self.isolated,
+            "last_commit_ms": round(self.last_commit_ms, 3),
+        }